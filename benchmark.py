@@ -0,0 +1,385 @@
+"""
+benchmark.py: Throughput and latency benchmarks for octoprint_api.
+
+Runs the client against local fake OctoPrint servers (fake_octoprint.py)
+and measures requests per second and latency percentiles for a set of
+scenarios in three concurrency modes:
+  serial   -- one Api object, one call after the other
+  threaded -- one Api object shared by several threads
+  fleet    -- several printers driven through a PrinterFleet
+
+Results can be saved as JSON and compared against an earlier run:
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json
+
+--compression instead measures gzip over a simulated slow link: the
+default (uncompressed) upload of a generated G-code file against the
+opt-in compressed uploads at two levels, and large responses with and
+without server-side gzip, reporting transfer times, bytes on the wire
+and the server's decompression time.
+    python benchmark.py --compression --bandwidth 2000000 --upload-size 20
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import octoprint_api
+from fake_octoprint import FakeOctoPrint, FakePrinter
+from octoprint_fleet import PrinterFleet
+
+_MODES = ['serial', 'threaded', 'fleet']
+
+
+def _status_call(limit):
+    def call(api):
+        return api.get_status(history=True, limit=limit)
+    return call
+
+
+def _get_files(api):
+    return api.get_files()
+
+
+def _jog(api):
+    return api.jog(x=1)
+
+
+def _job_pause(api):
+    # toggles between paused and printing
+    return api.job('pause')
+
+
+def _start_print(api):
+    api.select_file('benchy.gcode', start_print=True)
+
+
+# name -> (call, setup run once per printer before measuring)
+SCENARIOS = [
+    ('get_status[limit=2]', _status_call(2), None),
+    ('get_status[limit=50]', _status_call(50), None),
+    ('get_status[limit=300]', _status_call(300), None),
+    ('get_files', _get_files, None),
+    ('jog', _jog, None),
+    ('job', _job_pause, _start_print),
+]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(scenario, mode, latencies, errors, seconds, sent):
+    """
+    Results of one run. calls counts the timed API calls, requests the
+    HTTP requests actually sent (fewer where concurrent GETs were
+    coalesced); rps is based on the requests.
+    """
+    latencies = sorted(latencies)
+    count = len(latencies) + errors
+    return {'scenario': scenario,
+            'mode': mode,
+            'calls': count,
+            'requests': sent,
+            'errors': errors,
+            'seconds': round(seconds, 4),
+            'rps': round(sent / seconds, 1) if seconds else None,
+            'mean_ms': round(1000.0 * sum(latencies) / len(latencies), 3) if latencies else None,
+            'p50_ms': round(1000.0 * percentile(latencies, 0.50), 3) if latencies else None,
+            'p99_ms': round(1000.0 * percentile(latencies, 0.99), 3) if latencies else None}
+
+
+def _timed(call, api, latencies, lock):
+    start = time.perf_counter()
+    try:
+        call(api)
+    except (octoprint_api.HTTPException, octoprint_api.OctoprintException):
+        return 1
+    elapsed = time.perf_counter() - start
+    with lock:
+        latencies.append(elapsed)
+    return 0
+
+
+def run_serial(call, apis, count, options):
+    api = apis[0]
+    latencies, lock = [], threading.Lock()
+    errors = 0
+    start = time.perf_counter()
+    for _ in range(count):
+        errors += _timed(call, api, latencies, lock)
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_threaded(call, apis, count, options):
+    api = apis[0]
+    latencies, lock = [], threading.Lock()
+    errors = [0]
+    per_thread = [count // options.threads] * options.threads
+    per_thread[0] += count - sum(per_thread)
+
+    def worker(n):
+        failed = 0
+        for _ in range(n):
+            failed += _timed(call, api, latencies, lock)
+        with lock:
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in per_thread]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def run_fleet(call, apis, count, options):
+    fleet = PrinterFleet(dict(('printer{0}'.format(n), api) for n, api in enumerate(apis)),
+                         max_workers=options.threads)
+    latencies, lock = [], threading.Lock()
+    errors = 0
+    rounds = max(1, count // len(apis))
+    start = time.perf_counter()
+    try:
+        for _ in range(rounds):
+            timed_call = fleet.submit(lambda api: _timed(call, api, latencies, lock))
+            errors += sum(result.value for result in timed_call.as_completed())
+    finally:
+        fleet.close(close_printers=False)
+    return latencies, errors, time.perf_counter() - start
+
+
+_RUNNERS = {'serial': run_serial, 'threaded': run_threaded, 'fleet': run_fleet}
+
+
+def run_scenario(name, call, setup, mode, options):
+    printers = options.printers if mode == 'fleet' else 1
+    servers = [FakeOctoPrint(printer=FakePrinter(files=options.files, print_time=1e9),
+                             latency=options.latency, error_rate=options.error_rate,
+                             record_requests=False).start()
+               for _ in range(printers)]
+    apis = [octoprint_api.Api(base_url=server.url, api_key='fake',
+                              pool_size=max(4, options.threads), circuit_breaker=False)
+            for server in servers]
+    try:
+        if setup is not None:
+            for api in apis:
+                setup(api)
+        # warm up connections
+        for api in apis:
+            api.get_version()
+        before = _requests_sent(apis)
+        latencies, errors, seconds = _RUNNERS[mode](call, apis, options.requests, options)
+        sent = _requests_sent(apis) - before
+    finally:
+        for api in apis:
+            api.close()
+        for server in servers:
+            server.stop()
+    return summarize(name, mode, latencies, errors, seconds, sent)
+
+
+def _requests_sent(apis):
+    return sum(stats['requests'] for api in apis for stats in api.metrics.snapshot().values())
+
+
+def write_gcode(path, size):
+    """
+    Write a G-code file of about size bytes: concentric perimeters
+    layer by layer, like sliced parts.
+    """
+    written, layer, e = 0, 0, 0.0
+    with open(path, 'w') as f:
+        f.write('G21\nG90\nM82\nG28\nG92 E0\n')
+        while written < size:
+            layer += 1
+            lines = [';LAYER:{0}\nG1 Z{1:.2f} F3000\n'.format(layer, 0.2 * layer)]
+            for ring in range(10):
+                radius = 20.0 + ring * 0.45
+                for step in range(120):
+                    angle = 2 * math.pi * step / 120
+                    e += 0.0235
+                    lines.append('G1 X{0:.3f} Y{1:.3f} E{2:.5f}\n'.format(
+                        100 + radius * math.cos(angle), 100 + radius * math.sin(angle), e))
+            chunk = ''.join(lines)
+            f.write(chunk)
+            written += len(chunk)
+
+
+def run_compression(options):
+    """
+    Transfer times with and without gzip over a link of options.bandwidth bytes/s.
+    """
+    results = []
+    handle, path = tempfile.mkstemp(suffix='.gcode')
+    os.close(handle)
+    try:
+        write_gcode(path, int(options.upload_size * 1000000))
+        for level in (None, 1, 6):
+            server = FakeOctoPrint(bandwidth=options.bandwidth, record_requests=False).start()
+            api = octoprint_api.Api(base_url=server.url, api_key='fake', circuit_breaker=False)
+            try:
+                start = time.perf_counter()
+                if level is None:
+                    # the default path, what upload_file does unless asked to compress
+                    result = api.upload_file(path)
+                else:
+                    result = api.upload_file(path, compress=level)
+                seconds = time.perf_counter() - start
+            finally:
+                api.close()
+                server.stop()
+            results.append({'transfer': 'upload',
+                            'compression': 'gzip-{0} (opt-in)'.format(level) if level else 'none',
+                            'bytes': result.get('transferred') or os.path.getsize(path),
+                            'seconds': round(seconds, 3),
+                            'server_decompress_s': round(server.decompress_seconds, 3)})
+    finally:
+        os.remove(path)
+    for name, call in (('get_status[limit=300]', _status_call(300)), ('get_files', _get_files)):
+        for gzip in (False, True):
+            server = FakeOctoPrint(printer=FakePrinter(files=options.files), gzip=gzip,
+                                   bandwidth=options.bandwidth, record_requests=False).start()
+            api = octoprint_api.Api(base_url=server.url, api_key='fake', circuit_breaker=False)
+            try:
+                api.get_version()
+                sizes = []
+                api.add_hook(post=lambda method, url, response, elapsed, error: sizes.append(
+                    int(response.headers.get('Content-Length') or 0)))
+                start = time.perf_counter()
+                for _ in range(options.compression_requests):
+                    call(api)
+                seconds = (time.perf_counter() - start) / options.compression_requests
+            finally:
+                api.close()
+                server.stop()
+            results.append({'transfer': name, 'compression': 'gzip (server)' if gzip else 'none',
+                            'bytes': sizes[-1], 'seconds': round(seconds, 4),
+                            'server_decompress_s': None})
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change against a baseline run, returns the number of regressions.
+    """
+    previous = dict(((r['scenario'], r['mode']), r) for r in baseline['results'])
+    regressions = 0
+    print('{0:24} {1:9} {2:>10} {3:>10} {4:>8} {5:>10} {6:>10}'.format(
+        'scenario', 'mode', 'rps', 'baseline', 'change', 'p99 ms', 'baseline'))
+    for result in results:
+        old = previous.get((result['scenario'], result['mode']))
+        if old is None or not old['rps'] or not result['rps']:
+            continue
+        change = (result['rps'] - old['rps']) / old['rps']
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('{0:24} {1:9} {2:10.1f} {3:10.1f} {4:+7.1%} {5:10} {6:10}{7}'.format(
+            result['scenario'], result['mode'], result['rps'], old['rps'], change,
+            result['p99_ms'], old['p99_ms'], flag))
+    return regressions
+
+
+def parser_func():
+    parser = argparse.ArgumentParser(description='Benchmark octoprint_api against a fake server')
+    parser.add_argument('--requests', '-n', type=int, default=500,
+                        help='Requests per scenario and mode, default: 500')
+    parser.add_argument('--threads', '-t', type=int, default=8,
+                        help='Threads for threaded mode and fleet workers, default: 8')
+    parser.add_argument('--printers', '-p', type=int, default=4,
+                        help='Fake printers in fleet mode, default: 4')
+    parser.add_argument('--files', type=int, default=100,
+                        help='Files on each fake printer, default: 100')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Injected server latency in seconds, default: 0')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests failing with HTTP 500, default: 0')
+    parser.add_argument('--scenario', '-s', action='append',
+                        choices=[name for name, _, _ in SCENARIOS],
+                        help='Scenario to run (repeatable), default: all')
+    parser.add_argument('--mode', '-m', action='append', choices=_MODES,
+                        help='Concurrency mode to run (repeatable), default: all')
+    parser.add_argument('--output', '-o',
+                        help='Save results as JSON to this file')
+    parser.add_argument('--compare', '-c',
+                        help='Compare against results saved earlier')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Throughput drop counted as regression, default: 0.10')
+    parser.add_argument('--compression', action='store_true',
+                        help='Run the compression comparison instead of the scenarios')
+    parser.add_argument('--bandwidth', type=float, default=2000000,
+                        help='Simulated link speed for --compression in bytes/s, default: 2000000')
+    parser.add_argument('--upload-size', type=float, default=20,
+                        help='Size of the uploaded G-code for --compression in MB, default: 20')
+    parser.add_argument('--compression-requests', type=int, default=20,
+                        help='Requests per response measurement for --compression, default: 20')
+    return parser
+
+
+def main_compression(options):
+    results = run_compression(options)
+    default = results[0]
+    print('upload_file (default, uncompressed): {0} bytes in {1} s'.format(
+        default['bytes'], default['seconds']))
+    print()
+    print('{0:24} {1:18} {2:>12} {3:>10} {4:>16}'.format(
+        'transfer', 'compression', 'bytes', 'seconds', 'server unzip s'))
+    for result in results:
+        print('{transfer:24} {compression:18} {bytes:12} {seconds:10} {server_decompress_s!s:>16}'
+              .format(**result))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.time(),
+                       'options': vars(options),
+                       'compression': results}, f, indent=2)
+    return 0
+
+
+def main(argv=None):
+    options = parser_func().parse_args(argv)
+    if options.compression:
+        return main_compression(options)
+    modes = options.mode or _MODES
+    results = []
+    print('{0:24} {1:9} {2:>8} {3:>8} {4:>7} {5:>10} {6:>10} {7:>10}'.format(
+        'scenario', 'mode', 'calls', 'requests', 'errors', 'rps', 'p50 ms', 'p99 ms'))
+    for name, call, setup in SCENARIOS:
+        if options.scenario and name not in options.scenario:
+            continue
+        for mode in modes:
+            result = run_scenario(name, call, setup, mode, options)
+            results.append(result)
+            print('{scenario:24} {mode:9} {calls:8} {requests:8} {errors:7} {rps:10} {p50_ms:10} '
+                  '{p99_ms:10}'
+                  .format(**result))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.time(),
+                       'options': vars(options),
+                       'results': results}, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        print('')
+        if compare(results, baseline, options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
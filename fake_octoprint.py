@@ -0,0 +1,1004 @@
+"""
+fake_octoprint.py: A local stand-in for an OctoPrint server.
+
+Implements the subset of the OctoPrint REST API used by octoprint_api.py
+with a simulated printer (heaters approach their targets, jobs make
+progress over time), so the clients can be exercised without hardware.
+
+Usage as a library:
+    with FakeOctoPrint(api_key='secret') as server:
+        printer = octoprint_api.Api(base_url=server.url, api_key='secret')
+
+Usage stand-alone:
+    python fake_octoprint.py --port 5000 --apikey secret
+"""
+import hashlib
+import json
+import math
+import random
+import socket
+import threading
+import time
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs, unquote
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+    from urllib import unquote
+
+
+class FakePrinter(object):
+    """
+    Simulated printer state behind the fake server.
+    Heaters follow their targets exponentially with time constant
+    heat_time seconds, a started job finishes after print_time seconds.
+    history_size bounds the temperature history (prefilled with one sample
+    per second), files adds that many generated files to the local storage.
+    """
+
+    def __init__(self, tools=1, heat_time=2.0, print_time=60.0, room_temp=21.0,
+                 history_size=300, files=0):
+        self.lock = threading.RLock()
+        self.history_size = history_size
+        self.heat_time = heat_time
+        self.print_time = print_time
+        self.room_temp = room_temp
+        self.connected = True
+        self.state = 'Operational'
+        self.heaters = {}
+        for n in range(tools):
+            self.heaters['tool{0}'.format(n)] = {'actual': room_temp, 'target': 0.0, 'offset': 0}
+        self.heaters['bed'] = {'actual': room_temp, 'target': 0.0, 'offset': 0}
+        self.history = []
+        self.active_tool = 0
+        self.position = {'x': 0.0, 'y': 0.0, 'z': 0.0, 'e': 0.0}
+        self.commands = []
+        self.files = {}
+        self.files_version = 0
+        self.selected = None
+        self.job_started = None
+        self.job_elapsed = 0.0
+        self.events = []
+        self.event_count = 0
+        self._last_update = time.time()
+        self.add_file('local', 'benchy.gcode', size=1234567)
+        self.add_file('local', 'calibration_cube.gcode', size=54321)
+        for n in range(files):
+            self.add_file('local', 'part_{0:05d}.gcode'.format(n), size=100000 + n,
+                          date=self._last_update - n)
+        now = int(self._last_update)
+        for t in range(now - history_size, now):
+            sample = {'time': t}
+            for name in self.heaters:
+                sample[name] = {'actual': room_temp, 'target': 0.0}
+            self.history.append(sample)
+
+    def add_file(self, origin, name, size=0, date=None, analysis=None, content_hash=None):
+        basename = name.rsplit('/', 1)[-1]
+        entry = {'name': basename,
+                 'path': name,
+                 'display': basename,
+                 'origin': origin,
+                 'size': size,
+                 'date': int(date if date is not None else time.time()),
+                 'type': 'machinecode',
+                 'typePath': ['machinecode', 'gcode'],
+                 'refs': {'resource': '/api/files/{0}/{1}'.format(origin, name)}}
+        if origin == 'local':
+            entry['hash'] = content_hash or '{0:040x}'.format(abs(hash(name)))
+            entry['gcodeAnalysis'] = analysis or {'estimatedPrintTime': self.print_time,
+                                                  'filament': {'tool0': {'length': 1000.0,
+                                                                         'volume': 2.4}}}
+        self.files[(origin, name)] = entry
+        self.files_version += 1
+        return entry
+
+    def emit(self, event, payload=None):
+        """
+        Record an OctoPrint event for push clients.
+        """
+        with self.lock:
+            self.events.append({'type': event, 'payload': payload or {}})
+            self.event_count += 1
+            del self.events[:-100]
+
+    def events_since(self, count):
+        """
+        Return (events emitted after the first count events, new count).
+        """
+        with self.lock:
+            missed = self.event_count - count
+            return self.events[len(self.events) - min(missed, len(self.events)):], self.event_count
+
+    def update(self):
+        """
+        Advance the simulation to the current time.
+        """
+        with self.lock:
+            now = time.time()
+            dt = now - self._last_update
+            self._last_update = now
+            decay = math.exp(-dt / self.heat_time) if self.heat_time > 0 else 0.0
+            for heater in self.heaters.values():
+                goal = heater['target'] if heater['target'] > 0 else self.room_temp
+                heater['actual'] = goal + (heater['actual'] - goal) * decay
+            if self.state == 'Printing':
+                self.job_elapsed += dt
+                if self.job_elapsed >= self.print_time:
+                    self.job_elapsed = self.print_time
+                    self.state = 'Operational'
+                    self.job_started = None
+                    self.emit('PrintDone', {'time': self.print_time})
+            sample = {'time': int(now)}
+            for name, heater in self.heaters.items():
+                sample[name] = {'actual': round(heater['actual'], 2), 'target': heater['target']}
+            if self.history and self.history[-1]['time'] == sample['time']:
+                self.history[-1] = sample
+            else:
+                self.history.append(sample)
+                del self.history[:-self.history_size]
+
+    def flags(self):
+        state = self.state
+        return {'operational': self.connected,
+                'paused': state == 'Paused',
+                'printing': state == 'Printing',
+                'cancelling': False,
+                'pausing': False,
+                'sdReady': False,
+                'error': False,
+                'ready': self.connected and state == 'Operational',
+                'closedOrError': not self.connected}
+
+    def temperatures(self, history=False, limit=None):
+        with self.lock:
+            temps = {}
+            for name, heater in self.heaters.items():
+                temps[name] = {'actual': round(heater['actual'], 2),
+                               'target': heater['target'],
+                               'offset': heater['offset']}
+            if history:
+                temps['history'] = list(self.history[-limit:] if limit else self.history)
+            return temps
+
+    def job_info(self):
+        with self.lock:
+            entry = self.files.get(self.selected) if self.selected else None
+            if entry:
+                progress = self.job_elapsed / self.print_time if self.print_time else 0.0
+                job = {'file': {'name': entry['name'], 'origin': entry['origin'],
+                                'size': entry['size'], 'date': entry['date']},
+                       'estimatedPrintTime': self.print_time,
+                       'filament': {'length': 1000.0, 'volume': 2.4}}
+                progress = {'completion': round(progress * 100.0, 3),
+                            'filepos': int(entry['size'] * progress),
+                            'printTime': int(self.job_elapsed),
+                            'printTimeLeft': int(self.print_time - self.job_elapsed)}
+            else:
+                job = {'file': {'name': None, 'origin': None, 'size': None, 'date': None},
+                       'estimatedPrintTime': None,
+                       'filament': None}
+                progress = {'completion': None, 'filepos': None,
+                            'printTime': None, 'printTimeLeft': None}
+            return {'job': job, 'progress': progress, 'state': self.state}
+
+    def push_state(self, history=False):
+        """
+        Payload of a SockJS 'current' or 'history' message.
+        """
+        with self.lock:
+            info = self.job_info()
+            temps = self.history if history else self.history[-1:]
+            return {'state': {'text': self.state, 'flags': self.flags()},
+                    'job': info['job'],
+                    'progress': info['progress'],
+                    'currentZ': self.position['z'],
+                    'offsets': {},
+                    'temps': list(temps),
+                    'logs': [],
+                    'messages': []}
+
+
+class _ChunkedReader(object):
+    """
+    Decodes a request body sent with chunked transfer encoding.
+    """
+
+    def __init__(self, rfile):
+        self._rfile = rfile
+        self._left = 0
+        self._done = False
+
+    def read(self, size):
+        if self._done:
+            return b''
+        if self._left == 0:
+            self._left = int(self._rfile.readline().split(b';')[0].strip(), 16)
+            if self._left == 0:
+                # skip trailers
+                while self._rfile.readline() not in (b'\r\n', b'\n', b''):
+                    pass
+                self._done = True
+                return b''
+        data = self._rfile.read(min(size, self._left))
+        self._left -= len(data)
+        if self._left == 0:
+            self._rfile.readline()
+        return data
+
+
+class _GunzipReader(object):
+    """
+    Decompresses a gzip-encoded request body while it is read,
+    adding the time spent to fake.decompress_seconds.
+    """
+
+    def __init__(self, raw, fake):
+        self._raw = raw
+        self._fake = fake
+        self._decompressor = zlib.decompressobj(31)
+        self._buffer = b''
+        self._eof = False
+
+    def read(self, size):
+        while len(self._buffer) < size and not self._eof:
+            chunk = self._raw.read(64 * 1024)
+            start = time.time()
+            if chunk:
+                self._buffer += self._decompressor.decompress(chunk)
+            else:
+                self._buffer += self._decompressor.flush()
+                self._eof = True
+            self._fake.decompress_seconds += time.time() - start
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class _ThrottledReader(object):
+    """
+    Reads no faster than bytes_per_second, simulating a slow link.
+    """
+
+    def __init__(self, raw, bytes_per_second):
+        self._raw = raw
+        self._rate = float(bytes_per_second)
+        self._start = time.time()
+        self._count = 0
+
+    def read(self, size):
+        data = self._raw.read(size)
+        self._count += len(data)
+        delay = self._start + self._count / self._rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return data
+
+
+def _read_multipart(rfile, length, boundary, chunk_size=64 * 1024):
+    """
+    Parse a multipart/form-data body from rfile without holding file parts
+    in memory. Returns (fields, files) where files maps the field name to
+    a dictionary with filename, size and SHA1 hash of the contents.
+    length -- body length, None reads until rfile ends
+    """
+    delimiter = b'\r\n--' + boundary.encode('ascii')
+    buf = b'\r\n'
+    remaining = length if length is not None else float('inf')
+    fields, files = {}, {}
+
+    def fill():
+        chunk = rfile.read(int(min(chunk_size, remaining))) if remaining > 0 else b''
+        return chunk
+
+    # skip to the first delimiter
+    while True:
+        index = buf.find(delimiter)
+        if index >= 0:
+            buf = buf[index + len(delimiter):]
+            break
+        chunk = fill()
+        if not chunk:
+            raise ValueError('Malformed multipart body')
+        remaining -= len(chunk)
+        buf = buf[-len(delimiter):] + chunk
+    while True:
+        while len(buf) < 2 and remaining > 0:
+            chunk = fill()
+            remaining -= len(chunk)
+            buf += chunk
+        if buf.startswith(b'--'):
+            break
+        while b'\r\n\r\n' not in buf:
+            chunk = fill()
+            if not chunk:
+                raise ValueError('Malformed multipart body')
+            remaining -= len(chunk)
+            buf += chunk
+        head, buf = buf.split(b'\r\n\r\n', 1)
+        disposition = {}
+        for line in head.decode('utf-8').split('\r\n'):
+            if line.lower().startswith('content-disposition:'):
+                for item in line.split(';')[1:]:
+                    key, _, value = item.strip().partition('=')
+                    disposition[key] = value.strip('"')
+        sha1 = hashlib.sha1()
+        size = 0
+        data = []
+        while True:
+            index = buf.find(delimiter)
+            if index >= 0:
+                part, buf = buf[:index], buf[index + len(delimiter):]
+            else:
+                keep = len(delimiter) - 1
+                part, buf = buf[:-keep], buf[-keep:]
+            size += len(part)
+            if 'filename' in disposition:
+                sha1.update(part)
+            else:
+                data.append(part)
+            if index >= 0:
+                break
+            chunk = fill()
+            if not chunk:
+                raise ValueError('Malformed multipart body')
+            remaining -= len(chunk)
+            buf += chunk
+        if 'filename' in disposition:
+            files[disposition.get('name')] = {'filename': disposition['filename'],
+                                              'size': size, 'hash': sha1.hexdigest()}
+        else:
+            fields[disposition.get('name')] = b''.join(data).decode('utf-8')
+    # drain the epilogue
+    while remaining > 0:
+        chunk = fill()
+        if not chunk:
+            break
+        remaining -= len(chunk)
+    return fields, files
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeOctoPrint/1.0'
+    # headers and body are written separately, avoid delayed-ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.fake.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, data=None, headers=None):
+        fake = self.server.fake
+        if data is None:
+            body = b''
+        elif isinstance(data, bytes):
+            body = data
+        else:
+            body = json.dumps(data).encode('utf-8')
+        compressed = (fake.gzip and len(body) >= 1024 and
+                      'gzip' in (self.headers.get('Accept-Encoding') or ''))
+        if compressed:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            body = compressor.compress(body) + compressor.flush()
+        self.send_response(status)
+        if data is not None:
+            self.send_header('Content-Type', 'application/json')
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if fake.bandwidth:
+            # simulate a slow link
+            step = max(1, int(fake.bandwidth / 20))
+            for start in range(0, len(body), step):
+                time.sleep(len(body[start:start + step]) / float(fake.bandwidth))
+                self.wfile.write(body[start:start + step])
+        else:
+            self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _dispatch(self, method):
+        fake = self.server.fake
+        parts = urlsplit(self.path)
+        path = unquote(parts.path).rstrip('/')
+        query = dict((k, v[-1]) for k, v in parse_qs(parts.query).items())
+        content_type = self.headers.get('Content-Type') or ''
+        if method == 'POST' and content_type.startswith('multipart/form-data'):
+            # handlers parse uploads from the stream themselves
+            body = None
+        else:
+            body = self._read_body() if method == 'POST' else b''
+        fake.record(method, path, query, body)
+        if (fake.api_key is not None and not path.startswith('/sockjs') and
+                self.headers.get('X-Api-Key') != fake.api_key):
+            self.close_connection = body is None
+            return self._send(401, {'error': 'Invalid API key'})
+        handler = fake.route(method, path)
+        if handler is None:
+            self.close_connection = body is None
+            return self._send(404, {'error': 'Not found'})
+        if path.startswith('/api/'):
+            if fake.latency:
+                time.sleep(fake.latency)
+            if fake.error_rate and random.random() < fake.error_rate:
+                self.close_connection = body is None
+                return self._send(500, {'error': 'Injected failure'})
+        fake.printer.update()
+        try:
+            result = handler(self, path, query, body)
+        except ValueError as e:
+            return self._send(400, {'error': str(e)})
+        if isinstance(result, tuple):
+            self._send(*result)
+        elif result is not None:
+            self._send(200, result)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args, **kwargs):
+        HTTPServer.__init__(self, *args, **kwargs)
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self.connections_lock:
+            self.connections.add(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        with self.connections_lock:
+            self.connections.discard(request)
+        HTTPServer.shutdown_request(self, request)
+
+    def close_connections(self):
+        """
+        Drop open keep-alive connections, like a server going away would.
+        """
+        with self.connections_lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError):
+                pass
+
+
+class FakeOctoPrint(object):
+    """
+    Local stand-in OctoPrint server running in a background thread.
+    api_key -- key clients must send, None disables the check. Default: 'fake'
+    host, port -- listening address, port 0 picks a free port.
+    printer -- FakePrinter instance, a default one is created if None
+    push_interval, heartbeat_interval, response_limit -- SockJS push timing
+    latency -- seconds added to every /api request. Default: 0
+    error_rate -- fraction of /api requests answered with HTTP 500. Default: 0
+    record_requests -- keep every request in self.requests. Default: True
+    gzip -- compress responses of 1 KiB and more for clients accepting gzip. Default: False
+    bandwidth -- limit uploads and responses to this many bytes per second. Default: None
+    Gzip-compressed uploads are decompressed, the time spent on that is
+    summed up in decompress_seconds.
+    """
+
+    def __init__(self, api_key='fake', host='127.0.0.1', port=0, printer=None, verbose=False,
+                 push_interval=0.5, heartbeat_interval=25.0, response_limit=128 * 1024,
+                 latency=0.0, error_rate=0.0, record_requests=True, gzip=False, bandwidth=None):
+        self.api_key = api_key
+        self.gzip = gzip
+        self.bandwidth = bandwidth
+        self.decompress_seconds = 0.0
+        self.latency = latency
+        self.error_rate = error_rate
+        self.record_requests = record_requests
+        self.push_interval = push_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.response_limit = response_limit
+        self._stopping = threading.Event()
+        self.printer = printer if printer is not None else FakePrinter()
+        self.verbose = verbose
+        self.requests = []
+        self._record_lock = threading.Lock()
+        self._httpd = _ThreadingServer((host, port), _FakeHandler)
+        self._httpd.fake = self
+        self._thread = None
+        self._routes = [
+            ('GET', '/api/version', self._get_version),
+            ('GET', '/api/connection', self._get_connection),
+            ('POST', '/api/connection', self._post_connection),
+            ('GET', '/api/printer', self._get_printer),
+            ('GET', '/api/printer/tool', self._get_tool),
+            ('GET', '/api/printer/bed', self._get_bed),
+            ('POST', '/api/printer/printhead', self._post_printhead),
+            ('POST', '/api/printer/tool', self._post_tool),
+            ('POST', '/api/printer/bed', self._post_bed),
+            ('POST', '/api/printer/command', self._post_command),
+            ('GET', '/api/job', self._get_job),
+            ('POST', '/api/job', self._post_job),
+            ('GET', '/api/files', self._get_files),
+            ('POST', '/api/files/', self._post_files),
+            ('POST', '/api/login', self._post_login),
+            ('GET', '/sockjs/info', self._get_sockjs_info),
+            ('POST', '/sockjs/', self._post_sockjs),
+        ]
+        # SockJS session id -> messages queued for the session
+        self._push_sessions = {}
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._httpd.shutdown()
+        self._httpd.close_connections()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def record(self, method, path, query, body):
+        if not self.record_requests:
+            return
+        with self._record_lock:
+            self.requests.append((method, path, query, body))
+
+    def route(self, method, path):
+        for r_method, r_path, handler in self._routes:
+            if r_method != method:
+                continue
+            if r_path.endswith('/') and path.startswith(r_path):
+                return handler
+            if path == r_path or (r_path == '/api/files' and path.startswith('/api/files/')):
+                return handler
+        return None
+
+    @staticmethod
+    def _json(body):
+        try:
+            return json.loads(body.decode('utf-8')) if body else {}
+        except ValueError:
+            raise ValueError('Malformed JSON body')
+
+    def _get_version(self, handler, path, query, body):
+        return {'api': '0.1', 'server': '1.3.12', 'text': 'OctoPrint 1.3.12 (fake)'}
+
+    def _get_connection(self, handler, path, query, body):
+        printer = self.printer
+        return {'current': {'state': printer.state if printer.connected else 'Closed',
+                            'port': '/dev/ttyACM0' if printer.connected else None,
+                            'baudrate': 115200 if printer.connected else None,
+                            'printerProfile': '_default'},
+                'options': {'ports': ['/dev/ttyACM0'],
+                            'baudrates': [250000, 115200],
+                            'printerProfiles': [{'name': 'Default', 'id': '_default'}],
+                            'portPreference': None,
+                            'baudratePreference': None,
+                            'printerProfilePreference': '_default',
+                            'autoconnect': False}}
+
+    def _post_connection(self, handler, path, query, body):
+        request = self._json(body)
+        printer = self.printer
+        with printer.lock:
+            if request.get('command') == 'connect':
+                printer.connected = True
+                printer.state = 'Operational'
+                printer.emit('Connected', {'port': '/dev/ttyACM0', 'baudrate': 115200})
+            elif request.get('command') == 'disconnect':
+                printer.connected = False
+                printer.state = 'Closed'
+                printer.emit('Disconnected')
+            else:
+                raise ValueError('Unknown command')
+        return 204, None
+
+    def _require_connected(self):
+        if not self.printer.connected:
+            return 409, {'error': 'Printer is not operational'}
+        return None
+
+    def _get_printer(self, handler, path, query, body):
+        busy = self._require_connected()
+        if busy:
+            return busy
+        history = query.get('history', 'false') == 'true'
+        limit = int(query['limit']) if 'limit' in query else None
+        printer = self.printer
+        return {'temperature': printer.temperatures(history=history, limit=limit),
+                'sd': {'ready': False},
+                'state': {'text': printer.state, 'flags': printer.flags()}}
+
+    def _get_heaters(self, query, match):
+        busy = self._require_connected()
+        if busy:
+            return busy
+        history = query.get('history', 'false') == 'true'
+        limit = int(query['limit']) if 'limit' in query else None
+        temps = self.printer.temperatures(history=history, limit=limit)
+        result = dict((k, v) for k, v in temps.items() if match(k))
+        if history:
+            result['history'] = [dict((k, v) for k, v in sample.items()
+                                      if k == 'time' or match(k))
+                                 for sample in temps['history']]
+        return result
+
+    def _get_tool(self, handler, path, query, body):
+        return self._get_heaters(query, lambda k: k.startswith('tool'))
+
+    def _get_bed(self, handler, path, query, body):
+        return self._get_heaters(query, lambda k: k == 'bed')
+
+    def _post_printhead(self, handler, path, query, body):
+        busy = self._require_connected()
+        if busy:
+            return busy
+        request = self._json(body)
+        printer = self.printer
+        with printer.lock:
+            if printer.state == 'Printing':
+                return 409, {'error': 'Printer is currently printing'}
+            if request.get('command') == 'jog':
+                for axis in 'xyz':
+                    if axis in request:
+                        printer.position[axis] += float(request[axis])
+            elif request.get('command') == 'home':
+                for axis in request.get('axes', []):
+                    printer.position[axis] = 0.0
+            else:
+                raise ValueError('Unknown command')
+        return 204, None
+
+    def _post_tool(self, handler, path, query, body):
+        busy = self._require_connected()
+        if busy:
+            return busy
+        request = self._json(body)
+        printer = self.printer
+        with printer.lock:
+            command = request.get('command')
+            if command == 'target':
+                for name, temp in request.get('targets', {}).items():
+                    if name not in printer.heaters:
+                        raise ValueError('Unknown tool {0}'.format(name))
+                    printer.heaters[name]['target'] = float(temp)
+            elif command == 'offset':
+                for name, offset in request.get('offsets', {}).items():
+                    printer.heaters[name]['offset'] = offset
+            elif command == 'select':
+                printer.active_tool = int(request['tool'].replace('tool', ''))
+            elif command == 'extrude':
+                if printer.state == 'Printing':
+                    return 409, {'error': 'Printer is currently printing'}
+                printer.position['e'] += float(request['amount'])
+            else:
+                raise ValueError('Unknown command')
+        return 204, None
+
+    def _post_bed(self, handler, path, query, body):
+        busy = self._require_connected()
+        if busy:
+            return busy
+        request = self._json(body)
+        printer = self.printer
+        with printer.lock:
+            if request.get('command') == 'target':
+                printer.heaters['bed']['target'] = float(request['target'])
+            elif request.get('command') == 'offset':
+                printer.heaters['bed']['offset'] = request['offset']
+            else:
+                raise ValueError('Unknown command')
+        return 204, None
+
+    def _post_command(self, handler, path, query, body):
+        busy = self._require_connected()
+        if busy:
+            return busy
+        request = self._json(body)
+        if 'commands' in request:
+            commands = request['commands']
+        elif 'command' in request:
+            commands = [request['command']]
+        else:
+            raise ValueError('No commands given')
+        with self.printer.lock:
+            self.printer.commands.extend(commands)
+        return 204, None
+
+    def _get_job(self, handler, path, query, body):
+        return self.printer.job_info()
+
+    def _post_job(self, handler, path, query, body):
+        busy = self._require_connected()
+        if busy:
+            return busy
+        command = self._json(body).get('command')
+        printer = self.printer
+        with printer.lock:
+            state = printer.state
+            if command == 'start':
+                if printer.selected is None or state in ('Printing', 'Paused'):
+                    return 409, {'error': 'Cannot start'}
+                printer.state = 'Printing'
+                printer.job_started = time.time()
+                printer.job_elapsed = 0.0
+                printer.emit('PrintStarted', {'name': printer.selected[1]})
+            elif command == 'restart':
+                if state != 'Paused':
+                    return 409, {'error': 'No paused job'}
+                printer.state = 'Printing'
+                printer.job_elapsed = 0.0
+                printer.emit('PrintStarted', {'name': printer.selected[1]})
+            elif command == 'pause':
+                if state == 'Printing':
+                    printer.state = 'Paused'
+                    printer.emit('PrintPaused', {'name': printer.selected[1]})
+                elif state == 'Paused':
+                    printer.state = 'Printing'
+                    printer.emit('PrintResumed', {'name': printer.selected[1]})
+                else:
+                    return 409, {'error': 'No active job'}
+            elif command == 'cancel':
+                if state not in ('Printing', 'Paused'):
+                    return 409, {'error': 'No active job'}
+                printer.state = 'Operational'
+                printer.job_elapsed = 0.0
+                printer.emit('PrintCancelled', {'name': printer.selected[1]})
+            else:
+                raise ValueError('Unknown command')
+        return 204, None
+
+    @staticmethod
+    def _file_tree(entries, recursive):
+        """
+        Arrange file entries into folders the way OctoPrint lists them.
+        """
+        top, folders = [], {}
+        for entry in entries:
+            parts = entry['path'].split('/')
+            children = top
+            for depth in range(len(parts) - 1):
+                key = (entry['origin'], '/'.join(parts[:depth + 1]))
+                folder = folders.get(key)
+                if folder is None:
+                    folder = folders[key] = {
+                        'name': parts[depth], 'path': key[1], 'display': parts[depth],
+                        'origin': key[0], 'type': 'folder', 'typePath': ['folder'],
+                        'children': [],
+                        'refs': {'resource': '/api/files/{0}/{1}'.format(*key)}}
+                    children.append(folder)
+                children = folder['children']
+            children.append(dict(entry))
+        if not recursive:
+            for entry in top:
+                entry.pop('children', None)
+        return top
+
+    def _get_files(self, handler, path, query, body):
+        location = path[len('/api/files/'):] if path.startswith('/api/files/') else None
+        if location not in (None, 'local', 'sdcard'):
+            return 404, {'error': 'Unknown location'}
+        recursive = query.get('recursive') == 'true'
+        printer = self.printer
+        with printer.lock:
+            etag = '"{0}-{1}-{2}"'.format(printer.files_version, location or 'all',
+                                          int(recursive))
+            if handler.headers.get('If-None-Match') == etag:
+                return 304, None, {'ETag': etag}
+            entries = [entry for (origin, name), entry in sorted(printer.files.items())
+                       if location is None or origin == location]
+            files = self._file_tree(entries, recursive)
+        return 200, {'files': files, 'free': 1 << 30}, {'ETag': etag}
+
+    def _post_files(self, handler, path, query, body):
+        location, _, name = path[len('/api/files/'):].partition('/')
+        if location not in ('local', 'sdcard'):
+            if body is None:
+                handler.close_connection = True
+            return 404, {'error': 'Unknown location'}
+        if body is None:
+            return self._upload(handler, location)
+        request = self._json(body)
+        printer = self.printer
+        with printer.lock:
+            if (location, name) not in printer.files:
+                return 404, {'error': 'File not found'}
+            if request.get('command') != 'select':
+                raise ValueError('Unknown command')
+            if printer.state in ('Printing', 'Paused'):
+                return 409, {'error': 'Printer is busy'}
+            printer.selected = (location, name)
+            printer.job_elapsed = 0.0
+            printer.emit('FileSelected', {'name': name, 'origin': location})
+            if request.get('print'):
+                printer.state = 'Printing'
+                printer.job_started = time.time()
+                printer.emit('PrintStarted', {'name': name, 'origin': location})
+        return 204, None
+
+    def _upload(self, handler, location):
+        content_type = handler.headers.get('Content-Type')
+        boundary = content_type.split('boundary=', 1)[-1].strip('"')
+        length = int(handler.headers.get('Content-Length') or 0)
+        rfile = handler.rfile
+        if 'chunked' in (handler.headers.get('Transfer-Encoding') or '').lower():
+            rfile, length = _ChunkedReader(rfile), None
+        if self.bandwidth:
+            rfile = _ThrottledReader(rfile, self.bandwidth)
+        if (handler.headers.get('Content-Encoding') or '').lower() == 'gzip':
+            rfile, length = _GunzipReader(rfile, self), None
+        fields, files = _read_multipart(rfile, length, boundary)
+        if 'file' not in files:
+            return 400, {'error': 'No file included'}
+        upload = files['file']
+        name = upload['filename']
+        if fields.get('path'):
+            name = '{0}/{1}'.format(fields['path'].strip('/'), name)
+        extension = name.rsplit('.', 1)[-1].lower()
+        if extension not in ('gcode', 'gco', 'g', 'stl'):
+            return 415, {'error': 'Unsupported file type'}
+        printer = self.printer
+        with printer.lock:
+            if printer.state in ('Printing', 'Paused') and printer.selected == (location, name):
+                return 409, {'error': 'File is currently being printed'}
+            entry = printer.add_file(location, name, size=upload['size'],
+                                     content_hash=upload['hash'])
+            printer.emit('Upload', {'name': name, 'target': location})
+            if fields.get('select') == 'true' or fields.get('print') == 'true':
+                printer.selected = (location, name)
+                printer.job_elapsed = 0.0
+            if fields.get('print') == 'true':
+                printer.state = 'Printing'
+                printer.job_started = time.time()
+        return 201, {'files': {location: {'name': entry['name'], 'origin': location,
+                                          'refs': entry['refs']}},
+                     'done': True}
+
+    def _post_login(self, handler, path, query, body):
+        request = self._json(body)
+        if not request.get('passive'):
+            return 401, {'error': 'Only passive login is supported'}
+        return {'name': 'fake', 'session': 'fake-session', 'active': True, 'admin': True}
+
+    def _get_sockjs_info(self, handler, path, query, body):
+        return {'websocket': False, 'origins': ['*:*'], 'cookie_needed': False,
+                'entropy': 12345}
+
+    def _post_sockjs(self, handler, path, query, body):
+        parts = path.split('/')
+        if len(parts) != 5:
+            return 404, {'error': 'Not found'}
+        session_id, transport = parts[3], parts[4]
+        if transport == 'xhr_send':
+            if session_id not in self._push_sessions:
+                return 404, {'error': 'Unknown session'}
+            for message in self._json(body):
+                self._push_sessions[session_id]['received'].append(json.loads(message))
+            return 204, None
+        if transport == 'xhr_streaming':
+            self._push_stream(handler, session_id)
+            return None
+        return 404, {'error': 'Not found'}
+
+    def _push_stream(self, handler, session_id):
+        """
+        Serve one SockJS xhr_streaming response with chunked encoding,
+        ending it after response_limit bytes like sockjs-tornado does.
+        """
+        printer = self.printer
+        session = self._push_sessions.get(session_id)
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/javascript; charset=UTF-8')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        sent = [0]
+
+        def write(frame):
+            data = (frame + '\n').encode('utf-8')
+            handler.wfile.write('{0:x}\r\n'.format(len(data)).encode('ascii') + data + b'\r\n')
+            handler.wfile.flush()
+            sent[0] += len(data)
+
+        def write_messages(messages):
+            write('a' + json.dumps([json.dumps(m) for m in messages]))
+
+        try:
+            write('h' * 2048)
+            if session is None:
+                session = {'received': [], 'events': printer.event_count}
+                self._push_sessions[session_id] = session
+                write('o')
+                write_messages([{'connected': {'version': '1.3.12', 'apikey': None}}])
+                printer.update()
+                write_messages([{'history': printer.push_state(history=True)}])
+            next_push = next_beat = time.time()
+            while sent[0] < self.response_limit and not self._stopping.is_set():
+                now = time.time()
+                events, session['events'] = printer.events_since(session['events'])
+                if events:
+                    write_messages([{'event': event} for event in events])
+                if now >= next_push:
+                    throttle = 1
+                    for message in session['received']:
+                        throttle = message.get('throttle', throttle)
+                    printer.update()
+                    write_messages([{'current': printer.push_state()}])
+                    next_push = now + self.push_interval * throttle
+                if now >= next_beat + self.heartbeat_interval:
+                    write('h')
+                    next_beat = now
+                self._stopping.wait(min(0.05, self.push_interval))
+            if self._stopping.is_set():
+                write('c[3000,"Go away!"]')
+            handler.wfile.write(b'0\r\n\r\n')
+        except (IOError, OSError):
+            pass
+        handler.close_connection = True
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a fake OctoPrint server')
+    parser.add_argument('--host', default='127.0.0.1', help='Listening address')
+    parser.add_argument('--port', '-p', type=int, default=5000, help='Listening port')
+    parser.add_argument('--apikey', '-a', default='fake', help='Required API key')
+    parser.add_argument('--tools', type=int, default=1, help='Number of extruders')
+    parser.add_argument('--files', type=int, default=0, help='Number of generated files')
+    parser.add_argument('--history-size', type=int, default=300,
+                        help='Temperature history length')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Added latency per request in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests failing with HTTP 500')
+    parser.add_argument('--gzip', action='store_true', help='Compress responses')
+    parser.add_argument('--bandwidth', type=float,
+                        help='Simulated link speed in bytes per second')
+    args = parser.parse_args()
+    server = FakeOctoPrint(api_key=args.apikey, host=args.host, port=args.port,
+                           printer=FakePrinter(tools=args.tools, files=args.files,
+                                               history_size=args.history_size),
+                           latency=args.latency, error_rate=args.error_rate,
+                           record_requests=False, verbose=True, gzip=args.gzip,
+                           bandwidth=args.bandwidth)
+    print('Fake OctoPrint listening on {0}'.format(server.url))
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
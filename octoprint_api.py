@@ -1,5 +1,22 @@
 import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import deque, OrderedDict
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from octoprint_models import FileListing, JobInfo, PrinterState
+
+_log = logging.getLogger(__name__)
 
 
 class HTTPException(Exception):
@@ -57,6 +74,1097 @@ class UnsupportedFileException(FileException):
     pass
 
 
+class WaitTimeoutException(OctoprintException):
+    """Raise when a printer did not reach a waited for condition in time.
+    """
+    pass
+
+
+def build_url_table(base_url):
+    """
+    Build the dictionary of OctoPrint API urls for base_url.
+    Shared by the blocking and the asyncio client.
+    """
+    return {'base': base_url,
+            'version': base_url + '/api/version',
+            'files': base_url + '/api/files',
+            'files-sd': base_url + '/api/files/sd',
+            'files-local': base_url + '/api/files/local',
+            'connection': base_url + '/api/connection',
+            'printer': base_url + '/api/printer',
+            'printhead': base_url + '/api/printer/printhead',
+            'tool': base_url + '/api/printer/tool',
+            'bed': base_url + '/api/printer/bed',
+            'sd': base_url + '/api/printer/sd',
+            'command': base_url + '/api/printer/command',
+            'job': base_url + '/api/job',
+            'login': base_url + '/api/login',
+            'sockjs': base_url + '/sockjs'}
+
+
+# File types OctoPrint accepts for upload
+_MACHINECODE_EXTENSIONS = ('.gcode', '.gco', '.g')
+_MODEL_EXTENSIONS = ('.stl',)
+_FILE_LOCATIONS = ('local', 'sdcard')
+
+
+class MultipartUpload(object):
+    """
+    File-like multipart/form-data request body that streams the file
+    part from disk in chunks, so the file never has to fit into memory.
+    The total length is known up front, so requests sends a regular
+    Content-Length instead of chunked encoding.
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, source, filename, size, fields=None, progress=None, throttle=None):
+        """
+        source -- binary file-like object positioned at the start of the data
+        filename -- file name sent to the server
+        size -- number of bytes that will be read from source
+        fields -- dictionary of additional form fields
+        progress -- callable(bytes_sent, bytes_total), called after every chunk
+        throttle -- callable(byte_count), called with the size of every chunk
+                    before it is handed out, may block to limit the rate
+        """
+        self.boundary = uuid.uuid4().hex
+        self._source = source
+        self._remaining = size
+        self._progress = progress
+        self._throttle = throttle
+        preamble = []
+        for name, value in (fields or {}).items():
+            preamble.append('--{0}\r\nContent-Disposition: form-data; name="{1}"\r\n\r\n{2}\r\n'
+                            .format(self.boundary, name, value))
+        preamble.append('--{0}\r\nContent-Disposition: form-data; name="file"; filename="{1}"\r\n'
+                        'Content-Type: application/octet-stream\r\n\r\n'
+                        .format(self.boundary, filename.replace('"', '')))
+        self._head = ''.join(preamble).encode('utf-8')
+        self._tail = '\r\n--{0}--\r\n'.format(self.boundary).encode('utf-8')
+        self.len = len(self._head) + size + len(self._tail)
+        self.bytes_sent = 0
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={0}'.format(self.boundary)
+
+    def __len__(self):
+        return self.len
+
+    def _next_chunk(self, size):
+        if self._head:
+            chunk, self._head = self._head[:size], self._head[size:]
+            return chunk
+        if self._remaining > 0:
+            chunk = self._source.read(min(size, self._remaining))
+            if not chunk:
+                raise FileException('File ended {0} bytes early'.format(self._remaining))
+            self._remaining -= len(chunk)
+            return chunk
+        chunk, self._tail = self._tail[:size], self._tail[size:]
+        return chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.CHUNK_SIZE
+        chunk = self._next_chunk(size)
+        if chunk:
+            if self._throttle is not None:
+                self._throttle(len(chunk))
+            self.bytes_sent += len(chunk)
+            if self._progress is not None:
+                self._progress(self.bytes_sent, self.len)
+        return chunk
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+class GzipUpload(object):
+    """
+    Request body compressing a MultipartUpload while it is sent.
+    The compressed length is not known up front, so requests sends
+    it with chunked transfer encoding.
+    """
+
+    def __init__(self, body, level=6, throttle=None):
+        """
+        body -- MultipartUpload to compress
+        level -- zlib compression level, 1 (fastest) to 9 (smallest). Default: 6
+        throttle -- callable(byte_count), called with the size of every
+                    compressed chunk before it is sent, may block to limit the rate
+        """
+        self.body = body
+        self.level = level
+        self.bytes_out = 0
+        self._throttle = throttle
+
+    @property
+    def content_type(self):
+        return self.body.content_type
+
+    def __iter__(self):
+        # wbits 31: gzip framing
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        while True:
+            chunk = self.body.read(MultipartUpload.CHUNK_SIZE)
+            if not chunk:
+                break
+            data = compressor.compress(chunk)
+            if data:
+                yield self._out(data)
+        yield self._out(compressor.flush())
+
+    def _out(self, data):
+        if self._throttle is not None:
+            self._throttle(len(data))
+        self.bytes_out += len(data)
+        return data
+
+
+class PushSubscription(object):
+    """
+    Receives printer updates pushed by OctoPrint over its SockJS socket
+    instead of polling get_status/get_job_info.
+
+    The SockJS xhr-streaming transport is used, so the plain HTTP session
+    machinery is enough. Messages are dispatched by topic to callbacks
+    registered with on(), and can also be consumed by iterating over the
+    subscription, which yields (topic, payload) tuples. Lost connections
+    are re-established with exponential backoff.
+
+    Topics:
+    'connected', 'current', 'history', 'event', 'plugin', 'slicingProgress',
+    'timelapse' -- the raw OctoPrint messages
+    'temperature' -- one temperature sample {'time': ..., 'tool0': {...}, ...}
+    'progress' -- {'job': ..., 'progress': ...} whenever the job progress changes
+    'state' -- {'text': ..., 'flags': ...} whenever the printer state changes
+    'disconnected' -- the socket was lost, payload is the exception or None
+    """
+
+    TOPICS = ('connected', 'current', 'history', 'event', 'plugin', 'slicingProgress',
+              'timelapse', 'temperature', 'progress', 'state', 'disconnected')
+
+    def __init__(self, api, throttle=None, reconnect_delay=1.0, max_reconnect_delay=30.0,
+                 heartbeat_timeout=60.0, queue_size=1000):
+        """
+        api -- Api object providing URL, API key and timeouts
+        throttle -- multiplier for OctoPrint's 0.5s update interval, None: server default
+        reconnect_delay -- first delay in seconds before reconnecting. Default: 1
+        max_reconnect_delay -- upper limit of the reconnect backoff. Default: 30
+        heartbeat_timeout -- seconds of silence after which the socket counts as lost.
+                             OctoPrint sends heartbeats every 25s. Default: 60
+        queue_size -- messages kept for iteration, the oldest are dropped. Default: 1000
+        """
+        self._api = api
+        self._throttle = throttle
+        self._reconnect_delay = reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+        self._heartbeat_timeout = heartbeat_timeout
+        self._callbacks = dict((topic, []) for topic in self.TOPICS)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._session = None
+        self._response = None
+        self._session_url = None
+        self._last_state = None
+        self._last_progress = None
+        self.connected = False
+
+    def on(self, topic, callback):
+        """
+        Call callback(payload) for every message of topic.
+        """
+        if topic not in self._callbacks:
+            raise ValueError('Unknown topic {0}'.format(topic))
+        self._callbacks[topic].append(callback)
+        return callback
+
+    def off(self, topic, callback):
+        self._callbacks[topic].remove(callback)
+
+    def start(self):
+        """
+        Connect in a background thread.
+        """
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='octoprint-push')
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Close the socket and wait for the background thread to end.
+        """
+        self._stop.set()
+        response = self._response
+        if response is not None:
+            response.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def __iter__(self):
+        return self.messages()
+
+    def messages(self, timeout=None):
+        """
+        Yield (topic, payload) tuples as they arrive.
+        Ends when the subscription is stopped or, with a timeout,
+        when no message arrived for timeout seconds.
+        """
+        while not (self._stop.is_set() and self._queue.empty()):
+            try:
+                yield self._queue.get(timeout=timeout if timeout is not None else 0.5)
+            except queue.Empty:
+                if timeout is not None:
+                    return
+
+    def send(self, message):
+        """
+        Send a message (e.g. {'throttle': 2}) to OctoPrint over the socket.
+        """
+        data = json.dumps([json.dumps(message)])
+        response = self._session.post(self._session_url + '/xhr_send', data=data,
+                                      headers={'Content-Type': 'text/plain'},
+                                      timeout=self._api.timeout)
+        if response.status_code >= 400:
+            raise HTTPException(response)
+
+    def _new_session_url(self):
+        server_id = '{0:03d}'.format(random.randint(0, 999))
+        return '{0}/{1}/{2}'.format(self._api._url['sockjs'], server_id, uuid.uuid4().hex)
+
+    def _run(self):
+        delay = self._reconnect_delay
+        self._session = requests.Session()
+        self._session.headers['X-Api-Key'] = self._api.apikey
+        self._session_url = self._new_session_url()
+        while not self._stop.is_set():
+            error = None
+            try:
+                if self._stream():
+                    # response size limit reached, the session goes on with the next request
+                    delay = self._reconnect_delay
+                    continue
+            except Exception as e:
+                # stop() closing the response mid-read surfaces as arbitrary errors
+                error = e
+            finally:
+                self._response = None
+            if self._stop.is_set():
+                break
+            if self.connected:
+                self.connected = False
+                self._dispatch('disconnected', error)
+            self._session_url = self._new_session_url()
+            self._stop.wait(delay)
+            delay = min(delay * 2, self._max_reconnect_delay)
+        if self.connected:
+            self.connected = False
+            self._dispatch('disconnected', None)
+
+    def _stream(self):
+        """
+        Read one xhr_streaming response. Returns True if any frame was
+        received, SockJS ends these responses after a size limit and
+        the session simply continues with the next request.
+        """
+        response = self._session.post(self._session_url + '/xhr_streaming', stream=True,
+                                      timeout=(self._api.timeout[0], self._heartbeat_timeout))
+        self._response = response
+        if response.status_code >= 400:
+            response.close()
+            raise HTTPException(response)
+        received = False
+        pending = b''
+        for chunk in response.iter_content(chunk_size=None):
+            pending += chunk
+            lines = pending.split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if self._frame(line.decode('utf-8')):
+                    received = True
+            if self._stop.is_set():
+                break
+        response.close()
+        return received
+
+    def _frame(self, frame):
+        """
+        Handle one SockJS frame, returns True for meaningful frames.
+        """
+        if not frame or frame[0] == 'h':
+            return frame == 'h'
+        kind = frame[0]
+        if kind == 'o':
+            self._opened()
+        elif kind == 'a':
+            for message in json.loads(frame[1:]):
+                if not isinstance(message, dict):
+                    message = json.loads(message)
+                self._decode(message)
+        elif kind == 'c':
+            raise ValueError('Socket closed by server: {0}'.format(frame[1:]))
+        return True
+
+    def _opened(self):
+        self.connected = True
+        try:
+            login = self._session.post(self._api._url['login'], json={'passive': True},
+                                       timeout=self._api.timeout)
+            if login.status_code == 200:
+                user = login.json()
+                if user.get('name') and user.get('session'):
+                    self.send({'auth': '{0}:{1}'.format(user['name'], user['session'])})
+        except (requests.RequestException, ValueError):
+            # older OctoPrint versions push without authentication
+            pass
+        if self._throttle is not None:
+            self.send({'throttle': self._throttle})
+
+    def _decode(self, message):
+        for topic, payload in message.items():
+            if topic not in self._callbacks:
+                continue
+            self._dispatch(topic, payload)
+            if topic in ('current', 'history'):
+                self._decode_state(payload, topic == 'history')
+
+    def _decode_state(self, payload, history):
+        for sample in payload.get('temps') or []:
+            self._dispatch('temperature', sample)
+        state = payload.get('state')
+        if state is not None and (self._last_state is None or
+                                  state.get('text') != self._last_state.get('text')):
+            self._last_state = state
+            self._dispatch('state', state)
+        progress = {'job': payload.get('job'), 'progress': payload.get('progress')}
+        if progress['progress'] is not None and progress != self._last_progress:
+            self._last_progress = progress
+            if not history:
+                self._dispatch('progress', progress)
+
+    def _dispatch(self, topic, payload):
+        item = (topic, payload)
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                break
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+        for callback in list(self._callbacks[topic]):
+            try:
+                callback(payload)
+            except Exception:
+                # a failing callback must not take the socket down
+                _log.exception('Push callback for %s failed', topic)
+
+
+def _gcode_lines(commands):
+    """
+    Yield the G-code commands of a string, iterable or file object,
+    without comments and blank lines. Strings may hold several lines.
+    """
+    if isinstance(commands, (str, bytes)) or not hasattr(commands, '__iter__'):
+        commands = [commands]
+    for item in commands:
+        if isinstance(item, bytes):
+            item = item.decode('utf-8')
+        for line in str(item).splitlines():
+            line = line.split(';', 1)[0].strip()
+            if line:
+                yield line
+
+
+class GcodeBatcher(object):
+    """
+    Buffer for G-code commands sent through /api/printer/command.
+    Commands are collected and sent in batches once batch_size commands
+    are pending or the oldest pending command is flush_interval seconds
+    old. Leaving the context flushes the rest.
+
+        with GcodeBatcher(printer) as gcode:
+            for x in range(0, 200, 10):
+                gcode.add('G1 X{0} F3000'.format(x))
+    """
+
+    def __init__(self, api, batch_size=50, flush_interval=0.5):
+        """
+        api -- Api object to send the commands with
+        batch_size -- commands per request. Default: 50
+        flush_interval -- maximum seconds a command waits in the buffer,
+                          None flushes only by count. Default: 0.5
+        """
+        self._api = api
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._lock = threading.RLock()
+        self._timer = None
+        self._error = None
+        self.sent = 0
+
+    def add(self, commands):
+        """
+        Add one command, several lines or an iterable of commands.
+        """
+        with self._lock:
+            self._raise_error()
+            for line in _gcode_lines(commands):
+                self._pending.append(line)
+                if len(self._pending) >= self.batch_size:
+                    self._flush_locked()
+            if self._pending and self._timer is None and self.flush_interval is not None:
+                self._timer = threading.Timer(self.flush_interval, self._flush_timer)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """
+        Send all pending commands now.
+        """
+        with self._lock:
+            self._raise_error()
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.batch_size]
+            self._api.send_gcode_batch(batch)
+            del self._pending[:len(batch)]
+            self.sent += len(batch)
+
+    def _flush_timer(self):
+        with self._lock:
+            self._timer = None
+            try:
+                self._flush_locked()
+            except Exception as e:
+                # raised in the caller's thread on its next add or flush
+                self._error = e
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+        return False
+
+
+class _QueuedCommand(object):
+    """
+    A command waiting in a CommandQueue. Merged jogs keep one part
+    (future, arguments) per caller, so each of them can be cancelled.
+    """
+    __slots__ = ('method', 'parts')
+
+    def __init__(self, method, future, kwargs):
+        self.method = method
+        self.parts = [(future, kwargs)]
+
+    def axes(self):
+        return frozenset(axis for axis, value in self.parts[0][1].items() if value is not None)
+
+
+class CommandQueue(object):
+    """
+    Background queue for printhead and tool commands of one printer.
+    Calls return a concurrent.futures.Future right away and a worker
+    thread sends the commands in order. A jog on the same axes as the
+    jog waiting last in the queue is added to it, so rapid button presses
+    become a single request.
+
+        queue = printer.command_queue()
+        queue.jog(x=10)
+        queue.jog(x=10)      # sent together as one jog of x=20
+        queue.home(z=True).result()
+        queue.cancel_pending(moves_only=True)
+    """
+
+    # Commands moving the printhead or the filament
+    MOVES = ('jog', 'home', 'extrude')
+
+    def __init__(self, api, merge_jogs=True):
+        """
+        api -- Api object to send the commands with
+        merge_jogs -- add consecutive queued jogs on the same axes. Default: True
+        """
+        self._api = api
+        self.merge_jogs = merge_jogs
+        self._pending = deque()
+        self._lock = threading.Condition()
+        self._thread = None
+        self._busy = False
+        self._closing = False
+        self.sent = 0
+        self.merged = 0
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Queue a call of an Api method.
+        :param method: name of the method, e.g. 'set_tool_temp'
+        :return: Future of the method's return value
+        """
+        if args:
+            raise TypeError('Queued commands take keyword arguments only')
+        getattr(self._api, method)
+        future = futures.Future()
+        with self._lock:
+            last = self._pending[-1] if self._pending else None
+            if (self.merge_jogs and method == 'jog' and last is not None and last.method == 'jog'
+                    and last.axes() == frozenset(a for a, v in kwargs.items() if v is not None)):
+                last.parts.append((future, kwargs))
+                self.merged += 1
+            else:
+                self._pending.append(_QueuedCommand(method, future, kwargs))
+            self._closing = False
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='octoprint-commands')
+                self._thread.daemon = True
+                self._thread.start()
+            self._lock.notify_all()
+        return future
+
+    def jog(self, x=None, y=None, z=None):
+        return self.submit('jog', x=x, y=y, z=z)
+
+    def home(self, x=None, y=None, z=None):
+        return self.submit('home', x=x, y=y, z=z)
+
+    def extrude(self, amount=5):
+        return self.submit('extrude', amount=amount)
+
+    def select_tool(self, tool=0):
+        return self.submit('select_tool', tool=tool)
+
+    def set_tool_temp(self, temp=0, tool=0):
+        return self.submit('set_tool_temp', temp=temp, tool=tool)
+
+    def set_bed_temp(self, temp=0):
+        return self.submit('set_bed_temp', temp=temp)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def cancel_pending(self, moves_only=False):
+        """
+        Cancel the commands that have not been sent yet.
+        :param moves_only: only cancel jog, home and extrude
+        :return: number of cancelled calls
+        """
+        cancelled = 0
+        with self._lock:
+            kept = deque()
+            for command in self._pending:
+                if moves_only and command.method not in self.MOVES:
+                    kept.append(command)
+                    continue
+                for future, _ in command.parts:
+                    if future.cancel():
+                        cancelled += 1
+            self._pending = kept
+            self._lock.notify_all()
+        return cancelled
+
+    def join(self, timeout=None):
+        """
+        Wait until all queued commands are sent.
+        :return: False if the timeout passed first
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+        return True
+
+    def close(self, cancel=False):
+        """
+        Stop the worker after the queued commands, or cancel them first.
+        The queue restarts its worker on the next call.
+        """
+        if cancel:
+            self.cancel_pending()
+        with self._lock:
+            self._closing = True
+            self._lock.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(cancel=exc_type is not None)
+        return False
+
+    def _next(self):
+        with self._lock:
+            while not self._pending:
+                if self._closing:
+                    self._thread = None
+                    self._lock.notify_all()
+                    return None
+                self._lock.wait()
+            self._busy = True
+            return self._pending.popleft()
+
+    def _run(self):
+        while True:
+            command = self._next()
+            if command is None:
+                return
+            try:
+                self._execute(command)
+            finally:
+                with self._lock:
+                    self._busy = False
+                    self._lock.notify_all()
+
+    def _execute(self, command):
+        parts = [(future, kwargs) for future, kwargs in command.parts
+                 if future.set_running_or_notify_cancel()]
+        if not parts:
+            return
+        kwargs = dict(parts[0][1])
+        for _, more in parts[1:]:
+            for axis, value in more.items():
+                if value is not None:
+                    kwargs[axis] += value
+        try:
+            result = getattr(self._api, command.method)(**kwargs)
+        except Exception as e:
+            for future, _ in parts:
+                future.set_exception(e)
+        else:
+            self.sent += 1
+            for future, _ in parts:
+                future.set_result(result)
+
+
+class _SharedRequest(object):
+    """
+    A GET request whose result is shared by coalescing readers.
+    """
+    __slots__ = ('done', 'result', 'error', 'finished')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished = None
+
+
+class CircuitBreaker(object):
+    """
+    Health tracking for one server.
+    After failure_threshold consecutive connection failures the circuit
+    opens and requests fail immediately with ServerNotFoundException.
+    Once reset_timeout seconds have passed, the next request first
+    probes /api/version (half-open); if the probe succeeds the circuit
+    closes again, otherwise it stays open for another reset_timeout.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=10.0, probe_timeout=2.0):
+        """
+        failure_threshold -- consecutive failures that open the circuit. Default: 3
+        reset_timeout -- seconds before an open circuit is probed again. Default: 10
+        probe_timeout -- connect and read timeout of the probe request. Default: 2
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.last_failure = None
+        self.last_success = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Decide how to handle the next request. Returns False if the request
+        can be sent, True if the caller has to probe the server first.
+        Raises ServerNotFoundException while the circuit is open.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return False
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            raise ServerNotFoundException('Server unreachable, circuit open since {0:.1f}s: {1}'
+                                          .format(time.time() - self.opened_at, self.last_error))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.last_success = time.time()
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self.last_failure = time.time()
+            self.last_error = error
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = self.last_failure
+
+    def status(self):
+        """
+        Dictionary with the current health information.
+        """
+        with self._lock:
+            return {'state': self.state,
+                    'failures': self.failures,
+                    'opened_at': self.opened_at,
+                    'last_failure': self.last_failure,
+                    'last_success': self.last_success,
+                    'last_error': str(self.last_error) if self.last_error else None}
+
+
+class RequestMetrics(object):
+    """
+    Request statistics of one Api object, grouped by URL-table key
+    ('printer', 'job', 'files', ...) and HTTP method: request counts,
+    latency and response size histograms, status codes and exceptions.
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _endpoint(self, endpoint, method):
+        key = (endpoint or 'other', method)
+        stats = self._endpoints.get(key)
+        if stats is None:
+            stats = self._endpoints[key] = {
+                'requests': 0,
+                'latency_buckets': [0] * len(self.LATENCY_BUCKETS),
+                'latency_sum': 0.0,
+                'size_buckets': [0] * len(self.SIZE_BUCKETS),
+                'size_sum': 0,
+                'status': {},
+                'errors': {}}
+        return stats
+
+    @staticmethod
+    def _bucket(buckets, counts, value):
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+
+    def observe(self, endpoint, method, seconds, status=None, size=0):
+        """
+        Record one completed HTTP request.
+        """
+        with self._lock:
+            stats = self._endpoint(endpoint, method)
+            stats['requests'] += 1
+            stats['latency_sum'] += seconds
+            self._bucket(self.LATENCY_BUCKETS, stats['latency_buckets'], seconds)
+            stats['size_sum'] += size
+            self._bucket(self.SIZE_BUCKETS, stats['size_buckets'], size)
+            if status is not None:
+                stats['status'][status] = stats['status'].get(status, 0) + 1
+
+    def error(self, endpoint, method, exception):
+        """
+        Record an exception raised for a request.
+        """
+        name = type(exception).__name__
+        with self._lock:
+            errors = self._endpoint(endpoint, method)['errors']
+            errors[name] = errors.get(name, 0) + 1
+
+    def snapshot(self):
+        """
+        Copy of the statistics: {(endpoint, method): {...}}
+        """
+        with self._lock:
+            return dict((key, {'requests': stats['requests'],
+                               'latency_buckets': list(stats['latency_buckets']),
+                               'latency_sum': stats['latency_sum'],
+                               'size_buckets': list(stats['size_buckets']),
+                               'size_sum': stats['size_sum'],
+                               'status': dict(stats['status']),
+                               'errors': dict(stats['errors'])})
+                        for key, stats in self._endpoints.items())
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+def _prometheus_labels(labels):
+    return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+def render_prometheus(printers, prefix='octoprint'):
+    """
+    Render the request metrics of several printers in the Prometheus
+    text exposition format.
+    :param printers: dictionary name -> Api, or a PrinterFleet
+    :param prefix: metric name prefix, default: 'octoprint'
+    :return: string
+    """
+    families = OrderedDict()
+
+    def add(name, kind, help_text, labels, value):
+        family = families.setdefault(name, (kind, help_text, []))
+        family[2].append((labels, value))
+
+    for printer in sorted(printers):
+        metrics = printers[printer].metrics
+        if metrics is None:
+            continue
+        for (endpoint, method), stats in sorted(metrics.snapshot().items()):
+            base = [('printer', printer), ('endpoint', endpoint), ('method', method)]
+            add(prefix + '_requests_total', 'counter', 'HTTP requests sent.',
+                base, stats['requests'])
+            histogram = prefix + '_request_duration_seconds'
+            cumulative = 0
+            for bound, count in zip(RequestMetrics.LATENCY_BUCKETS, stats['latency_buckets']):
+                cumulative += count
+                add(histogram + '_bucket', 'histogram', 'Request latency in seconds.',
+                    base + [('le', repr(float(bound)))], cumulative)
+            add(histogram + '_bucket', 'histogram', '', base + [('le', '+Inf')], stats['requests'])
+            add(histogram + '_sum', 'histogram', '', base, stats['latency_sum'])
+            add(histogram + '_count', 'histogram', '', base, stats['requests'])
+            histogram = prefix + '_response_size_bytes'
+            cumulative = 0
+            for bound, count in zip(RequestMetrics.SIZE_BUCKETS, stats['size_buckets']):
+                cumulative += count
+                add(histogram + '_bucket', 'histogram', 'Response body size in bytes.',
+                    base + [('le', str(bound))], cumulative)
+            add(histogram + '_bucket', 'histogram', '', base + [('le', '+Inf')], stats['requests'])
+            add(histogram + '_sum', 'histogram', '', base, stats['size_sum'])
+            add(histogram + '_count', 'histogram', '', base, stats['requests'])
+            for status, count in sorted(stats['status'].items()):
+                add(prefix + '_responses_total', 'counter', 'HTTP responses by status code.',
+                    base + [('status', status)], count)
+            for exception, count in sorted(stats['errors'].items()):
+                add(prefix + '_errors_total', 'counter', 'Exceptions raised by request.',
+                    base + [('exception', exception)], count)
+    lines = []
+    for name, (kind, help_text, samples) in families.items():
+        if help_text:
+            family = name
+            for suffix in ('_bucket', '_sum', '_count'):
+                if kind == 'histogram' and name.endswith(suffix):
+                    family = name[:-len(suffix)]
+            lines.append('# HELP {0} {1}'.format(family, help_text))
+            lines.append('# TYPE {0} {1}'.format(family, kind))
+        for labels, value in samples:
+            lines.append('{0}{1} {2}'.format(name, _prometheus_labels(labels), value))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(object):
+    """
+    Minimal HTTP server answering GET /metrics with render_prometheus,
+    for scraping by Prometheus. Runs in a background thread.
+    """
+
+    def __init__(self, printers, host='0.0.0.0', port=9464, prefix='octoprint'):
+        """
+        printers -- dictionary name -> Api, or a PrinterFleet
+        host, port -- listening address. Default: all interfaces, port 9464
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render_prometheus(exporter.printers, exporter.prefix).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.printers = printers
+        self.prefix = prefix
+        self._httpd = HTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='octoprint-metrics')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+class ResponseCache(object):
+    """
+    Cache for decoded GET responses with a time-to-live per endpoint
+    and least-recently-used eviction once max_entries is reached.
+
+    Endpoints are identified by their key in the Api URL table
+    ('version', 'connection', 'files', ...). Endpoints without a TTL
+    are never cached. Cached values are shared between callers and
+    must be treated as read-only.
+    """
+
+    DEFAULT_TTL = {'version': 3600.0,
+                   'connection': 10.0,
+                   'files': 30.0,
+                   'files-local': 30.0,
+                   'files-sd': 30.0}
+
+    # Endpoints whose cached entries are stale after a successful POST to the key
+    INVALIDATES = {'connection': ('connection', 'printer', 'job'),
+                   'job': ('job', 'printer', 'files', 'files-local', 'files-sd'),
+                   'files': ('files', 'files-local', 'files-sd', 'job'),
+                   'files-local': ('files', 'files-local', 'job'),
+                   'files-sd': ('files', 'files-sd', 'job'),
+                   'sd': ('files', 'files-sd', 'sd'),
+                   'printhead': ('printer',),
+                   'tool': ('printer', 'tool'),
+                   'bed': ('printer', 'bed'),
+                   'command': ('printer', 'tool', 'bed', 'job')}
+
+    MISSING = object()
+
+    def __init__(self, ttl=None, max_entries=64):
+        """
+        ttl -- dictionary URL key -> seconds, merged over DEFAULT_TTL.
+               A TTL of 0 or None disables caching for that endpoint.
+        max_entries -- maximum number of cached responses. Default: 64
+        """
+        self.ttl = dict(self.DEFAULT_TTL)
+        if ttl:
+            self.ttl.update(ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(url, param=None):
+        if param:
+            return url, tuple(sorted((str(k), str(v)) for k, v in param.items()))
+        return url, ()
+
+    def get(self, key):
+        """
+        Return the cached value for key or ResponseCache.MISSING.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return self.MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, url_key, key, value):
+        ttl = self.ttl.get(url_key)
+        if not ttl:
+            return
+        with self._lock:
+            self._entries[key] = (url_key, time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, url_key):
+        """
+        Drop all entries made stale by a write to url_key.
+        """
+        stale = self.INVALIDATES.get(url_key, (url_key,))
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[0] in stale]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
 class Api(object):
     """
     Management and wrapper class for OctoPrint
@@ -68,31 +1176,97 @@ class Api(object):
         base_url has to include the port information if not
         default http port (:80)
         """
-        self._url = {'base': base_url,
-                     'version': base_url + '/api/version',
-                     'files': base_url + '/api/files',
-                     'files-sd': base_url + '/api/files/sd',
-                     'files-local': base_url + '/api/files/local',
-                     'connection': base_url + '/api/connection',
-                     'printer': base_url + '/api/printer',
-                     'printhead': base_url + '/api/printer/printhead',
-                     'tool': base_url + '/api/printer/tool',
-                     'bed': base_url + '/api/printer/bed',
-                     'sd': base_url + '/api/printer/sd',
-                     'command': base_url + '/api/printer/command',
-                     'job': base_url + '/api/job'}
-
-    def __init__(self, base_url=None, api_key='', debug=False):
+        self._url = build_url_table(base_url)
+
+    def __init__(self, base_url=None, api_key='', debug=False,
+                 pool_size=4, connect_timeout=5.0, read_timeout=30.0, cache=None,
+                 coalesce_window=0.0, circuit_breaker=True, metrics=True, models=False):
         """
         Initialize the api object.
         :rtype : API object for Octoprint control
         base_url -- URL of the OctoPrint server, including port. Default: None
         api_key -- API key for accessing OctoPrint. Default: empty string
         debug -- Switch URL output on or off, default: False (no debug)
+        pool_size -- Number of keep-alive connections kept to the server. Default: 4
+        connect_timeout -- Seconds to wait for a connection, None waits forever. Default: 5
+        read_timeout -- Seconds to wait for a response, None waits forever. Default: 30
+        cache -- True or a ResponseCache to cache slow-changing GET responses
+                 (version, connection, files). Default: None (no caching)
+        coalesce_window -- Seconds a finished printer status fetch is shared with
+                           further readers. Concurrent readers always share the
+                           fetch in flight. Default: 0
+        circuit_breaker -- True, False or a CircuitBreaker. Fail fast with
+                           ServerNotFoundException once the server is found
+                           unreachable. Default: True
+        metrics -- True, False or a RequestMetrics collecting per-endpoint
+                   request statistics. Default: True
+        models -- Return typed models (octoprint_models.py) instead of
+                  dictionaries from get_status, get_tool_temp, get_bed_temp,
+                  get_job_info and get_files. Default: False
         """
         self._set_url(base_url=base_url)
         self._header = {'X-Api-Key': api_key, 'content-type': 'application/json'}
         self._debug = debug
+        self._timeout = (connect_timeout, read_timeout)
+        self._pool_size = pool_size
+        self._session = None
+        self._open_session()
+        if cache is True:
+            cache = ResponseCache()
+        elif cache is False:
+            cache = None
+        self._cache = cache
+        self._coalesce_window = coalesce_window
+        self._coalesce_lock = threading.Lock()
+        self._coalesced = {}
+        if circuit_breaker is True:
+            circuit_breaker = CircuitBreaker()
+        elif circuit_breaker is False:
+            circuit_breaker = None
+        self._breaker = circuit_breaker
+        if metrics is True:
+            metrics = RequestMetrics()
+        elif metrics is False:
+            metrics = None
+        self._metrics = metrics
+        self._pre_hooks = []
+        self._post_hooks = []
+        self._file_index = None
+        self._models = models
+        # (location, path) -> local analysis of files uploaded with analyze=True
+        self._analyses = {}
+        self._upload_registry = None
+        self._command_queue = None
+
+    def _open_session(self):
+        """
+        Create the pooled HTTP session all requests are sent through.
+        Connections are kept alive and reused between calls.
+        """
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self._session = session
+
+    def close(self):
+        """
+        Close all pooled connections to the server, after the commands
+        waiting in the command queue were sent.
+        The object stays usable, the next request opens a new pool.
+        """
+        if self._command_queue is not None:
+            self._command_queue.close()
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
 
     @property
     def apikey(self):
@@ -110,28 +1284,214 @@ class Api(object):
     def url(self, url_string):
         self._set_url(url_string)
 
-    def _get_request(self, url=None, param=None):
-        response = requests.get(url, headers=self._header, params=param)
+    @property
+    def cache(self):
+        return self._cache
+
+    def _url_key(self, url):
+        """
+        Return the key of the URL table entry url belongs to,
+        e.g. 'files-local' for <base>/api/files/local/test.gcode.
+        """
+        best_key, best_len = None, 0
+        for key, prefix in self._url.items():
+            if key == 'base' or len(prefix) <= best_len:
+                continue
+            if url == prefix or url.startswith(prefix + '/') or url.startswith(prefix + '?'):
+                best_key, best_len = key, len(prefix)
+        return best_key
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def add_hook(self, pre=None, post=None):
+        """
+        Register request hooks.
+        pre(method, url, kwargs) is called before a request is sent and may
+        modify the keyword arguments passed on to requests.
+        post(method, url, response, seconds, error) is called afterwards,
+        response is None and error set if no response was received.
+        """
+        if pre is not None:
+            self._pre_hooks.append(pre)
+        if post is not None:
+            self._post_hooks.append(post)
+
+    def remove_hook(self, pre=None, post=None):
+        if pre is not None:
+            self._pre_hooks.remove(pre)
+        if post is not None:
+            self._post_hooks.remove(post)
+
+    def _failed(self, url, exception, method='GET'):
+        """
+        Count an exception about to be raised for a request to url.
+        """
+        if self._metrics is not None:
+            self._metrics.error(self._url_key(url), method, exception)
+        return exception
+
+    @property
+    def health(self):
+        """
+        Health information of the server connection, see CircuitBreaker.status.
+        """
+        if self._breaker is None:
+            return None
+        return self._breaker.status()
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        """
+        Either a single number used for connect and read timeout
+        or a (connect, read) tuple.
+        """
+        if isinstance(value, (tuple, list)):
+            self._timeout = tuple(value)
+        else:
+            self._timeout = (value, value)
+
+    def _request(self, method, url, **kwargs):
+        """
+        Send a request through the pooled session.
+        Returns the raw response object.
+        """
+        if self._session is None:
+            self._open_session()
+        if self._debug:
+            print('{0} {1}'.format(method, url))
+        kwargs.setdefault('headers', self._header)
+        kwargs.setdefault('timeout', self._timeout)
+        for hook in self._pre_hooks:
+            hook(method, url, kwargs)
+        breaker = self._breaker
+        try:
+            if breaker is not None and breaker.acquire():
+                self._probe()
+        except ServerNotFoundException as e:
+            raise self._failed(url, e, method)
+        start = time.time()
+        try:
+            response = self._session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if breaker is not None:
+                breaker.record_failure(e)
+            for hook in self._post_hooks:
+                hook(method, url, None, time.time() - start, e)
+            raise self._failed(url, ServerNotFoundException(e), method)
+        elapsed = time.time() - start
+        if breaker is not None:
+            breaker.record_success()
+        if self._metrics is not None:
+            size = len(response.content) if not kwargs.get('stream') else 0
+            self._metrics.observe(self._url_key(url), method, elapsed,
+                                  response.status_code, size)
+        for hook in self._post_hooks:
+            hook(method, url, response, elapsed, None)
+        if method != 'GET' and response.status_code < 400:
+            if self._cache is not None:
+                self._cache.invalidate(self._url_key(url))
+            if self._coalesced:
+                # finished fetches predate the write, don't hand them out any more
+                with self._coalesce_lock:
+                    for key in [k for k, v in self._coalesced.items() if v.finished is not None]:
+                        del self._coalesced[key]
+        return response
+
+    def _probe(self):
+        """
+        Half-open circuit: check with a cheap request whether the server
+        is back before sending the real one.
+        """
+        breaker = self._breaker
+        try:
+            response = self._session.get(self._url['version'], headers=self._header,
+                                         timeout=breaker.probe_timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            breaker.record_failure(e)
+            raise ServerNotFoundException(e)
+        breaker.record_success()
+        response.close()
+
+    def _get_request(self, url=None, param=None, model=None):
+        """
+        GET request returning the decoded response, or with models enabled
+        and a model class given, the undecoded model.
+        """
+        if not self._models:
+            model = None
+        if self._cache is not None:
+            cache_key = ResponseCache.make_key(url, param)
+            if model is not None:
+                cache_key += (model.__name__,)
+            data = self._cache.get(cache_key)
+            if data is not ResponseCache.MISSING:
+                return data
+        response = self._request('GET', url, params=param)
         if response.status_code == 401:
-            raise NotAuthorizedException(response)
+            raise self._failed(url, NotAuthorizedException(response))
         elif response.status_code >= 400:
-            raise HTTPException(response)
+            raise self._failed(url, HTTPException(response))
         else:
-            data = response.json()
+            if model is not None:
+                data = model.from_json(response.content)
+            else:
+                data = response.json()
+            if self._cache is not None:
+                self._cache.put(self._url_key(url), cache_key, data)
             return data
 
+    def _coalesced_get(self, url, param=None, model=None):
+        """
+        GET request shared between concurrent callers: while a request
+        for the same url and parameters is in flight (or finished less
+        than coalesce_window seconds ago) its result is used instead of
+        sending another one. The result is shared and must not be modified.
+        """
+        key = ResponseCache.make_key(url, param)
+        if model is not None and self._models:
+            key += (model.__name__,)
+        with self._coalesce_lock:
+            shared = self._coalesced.get(key)
+            if shared is not None and shared.finished is not None and \
+                    time.time() - shared.finished > self._coalesce_window:
+                shared = None
+            leader = shared is None
+            if leader:
+                shared = self._coalesced[key] = _SharedRequest()
+        if leader:
+            try:
+                shared.result = self._get_request(url, param, model)
+            except Exception as e:
+                shared.error = e
+                with self._coalesce_lock:
+                    if self._coalesced.get(key) is shared:
+                        del self._coalesced[key]
+            finally:
+                shared.finished = time.time()
+                shared.done.set()
+        else:
+            shared.done.wait()
+        if shared.error is not None:
+            raise shared.error
+        return shared.result
+
     def _post_request(self, url=None, request=None):
-        response = requests.post(url, headers=self._header,
-                                 data=json.dumps(request))
+        response = self._request('POST', url, data=json.dumps(request))
         # Is printer busy?
         if response.status_code == 409:
-            raise PrinterBusyException(response)
+            raise self._failed(url, PrinterBusyException(response), 'POST')
         # Did the Authorization fail?
         elif response.status_code == 401:
-            raise NotAuthorizedException(response)
+            raise self._failed(url, NotAuthorizedException(response), 'POST')
         # Did some other HTTP error happen?
         elif response.status_code >= 400:
-            raise HTTPException(response)
+            raise self._failed(url, HTTPException(response), 'POST')
         # Is response empty?
         else:
             return response
@@ -139,7 +1499,7 @@ class Api(object):
     def get_status(self, history=True, limit=2):
         """
         Get the status of the OctoPrint server.
-        Returns a dictionary:
+        Returns a dictionary (a PrinterState with models enabled):
         {<json_decoded_data>}
         Otherwise raises an exception
         :param history:
@@ -151,7 +1511,7 @@ class Api(object):
         else:
             hist_str = 'false'
         param = {'history': hist_str, 'limit': limit}
-        return_val = self._get_request(self._url['printer'], param)
+        return_val = self._coalesced_get(self._url['printer'], param, PrinterState)
         return return_val
 
     def get_version(self):
@@ -249,11 +1609,15 @@ class Api(object):
         return_val = self._post_request(self._url['tool'], request)
         return return_val
 
-    def _get_temperatures(self, url, target_string):
-        param = {'history': 'false', 'limit': 2}
-        return_val = self._get_request(url, param)
-        if target_string in return_val:
-            return return_val[target_string]
+    def _get_temperatures(self, target_string):
+        # Derived from the full printer status, so concurrent readers of
+        # tools, bed and status share a single request.
+        return_val = self.get_status(history=False, limit=2)
+        if self._models:
+            return return_val.heater(target_string)
+        temperatures = return_val.get('temperature') or {}
+        if target_string in temperatures:
+            return temperatures[target_string]
         else:
             return None
 
@@ -266,7 +1630,7 @@ class Api(object):
         :return:
         """
         target_string = 'tool{0}'.format(tool)
-        return_val = self._get_temperatures(self._url['tool'], target_string)
+        return_val = self._get_temperatures(target_string)
         return return_val
 
     def set_bed_temp(self, temp=0):
@@ -288,17 +1652,17 @@ class Api(object):
         :return:
         """
         target_string = 'bed'
-        return_val = self._get_temperatures(self._url['bed'], target_string)
+        return_val = self._get_temperatures(target_string)
         return return_val
 
     def get_job_info(self):
         """
         Get information about the current job.
-        Returns a dictionary with the job info.
+        Returns a dictionary with the job info (a JobInfo with models enabled).
         Refer to the Octoprint doc for version 1.2.6
         :return:
         """
-        return_val = self._get_request(self._url['job'], None)
+        return_val = self._get_request(self._url['job'], None, JobInfo)
         return return_val
 
     def job_start(self):
@@ -377,33 +1741,334 @@ class Api(object):
         return_val = self._post_request(self._url['connection'], request)
         return return_val
 
-    def get_files(self, location=None):
+    def _files_url(self, location=None):
+        if location in ['local', 'sdcard']:
+            return '{0}/{1}'.format(self._url['files'], location)
+        return self._url['files']
+
+    def get_files(self, location=None, recursive=False):
         """
         Get the information of all files on the system
         :param location: Location to list. 'local', 'sdcard' or None for all
+        :param recursive: Include the contents of folders, default: False
         :return: file information dictionary
         """
-        if location in ['local', 'sdcard']:
-            url = '{0}/{1}'.format(self._url['files'], location)
-        else:
-            url = self._url['files']
-        return_val = self._get_request(url)
+        param = {'recursive': 'true'} if recursive else None
+        return_val = self._get_request(self._files_url(location), param, FileListing)
         return return_val
 
-    def select_file(self, name=None, location='local', start_print=False):
+    def get_files_if_changed(self, etag=None, location=None, recursive=True):
+        """
+        Conditional file listing: revalidate a listing fetched earlier
+        with its ETag, an unchanged listing costs only a 304 response.
+        :param etag: ETag of the listing held by the caller, None fetches it
+        :param location: Location to list. 'local', 'sdcard' or None for all
+        :param recursive: Include the contents of folders, default: True
+        :return: tuple (file information dictionary or None if unchanged, ETag)
+        """
+        url = self._files_url(location)
+        header = dict(self._header)
+        if etag:
+            header['If-None-Match'] = etag
+        param = {'recursive': 'true'} if recursive else None
+        response = self._request('GET', url, params=param, headers=header)
+        if response.status_code == 304:
+            return None, etag
+        elif response.status_code == 401:
+            raise self._failed(url, NotAuthorizedException(response))
+        elif response.status_code >= 400:
+            raise self._failed(url, HTTPException(response))
+        return response.json(), response.headers.get('ETag')
+
+    def file_index(self, location=None, cache_file=None, max_age=5.0):
+        """
+        Return the FileIndex of this printer (see octoprint_files.py),
+        created on first use. The arguments only apply to that first call.
+        """
+        if self._file_index is None:
+            from octoprint_files import FileIndex
+            self._file_index = FileIndex(self, location=location, cache_file=cache_file,
+                                         max_age=max_age)
+        return self._file_index
+
+    def select_file(self, name=None, location='local', start_print=False, check=None):
         """
         Selects a file for printing, either from local Octoprint file system or
         from SD card.
         :param name: File name
         :param location: Either 'locaL' or 'sdcard', default: 'local'
         :param start_print: Immediately start print, default: False
+        :param check: callable(analysis) deciding whether to go ahead, it gets
+                      the dictionary returned by file_analysis. The file is not
+                      selected and FileException raised if it returns False
         :return:
         """
+        if check is not None and not check(self.file_analysis(name, location)):
+            raise FileException('{0} rejected by check'.format(name))
         request = {'command': 'select', 'print': start_print}
         request_url = '{0}/{1}/{2}'.format(self._url['files'], location, name)
         return_val = self._post_request(request_url, request)
         return return_val
 
+    def wait_for_temperature(self, heater=0, target=None, tolerance=2.0, stable_for=0.0,
+                             timeout=None, push=None, **kwargs):
+        """
+        Block until heaters reached their target temperatures.
+        :param heater: tool number, heater name ('tool0', 'bed'), list of
+                       those, or dictionary heater -> target. Default: 0
+        :param target: target temperature, None for the target set on the printer
+        :param tolerance: allowed difference to the target in degrees. Default: 2
+        :param stable_for: seconds the temperatures have to stay within tolerance
+        :param timeout: seconds to wait at most, raises WaitTimeoutException
+        :param push: True to use push updates, or a running PushSubscription
+        :param kwargs: polling options of octoprint_wait.wait
+        :return: dictionary heater name -> last reading
+        """
+        from octoprint_wait import heater_targets, TemperatureCondition, wait
+        condition = TemperatureCondition(heater_targets(heater, target), tolerance, stable_for)
+        if isinstance(push, PushSubscription):
+            push = {self: push}
+        return wait([(self, condition)], timeout=timeout, push=push, **kwargs)[0]
+
+    def wait_for_state(self, state='Operational', timeout=None, push=None, **kwargs):
+        """
+        Block until the printer state text starts with state (or one of a list of states).
+        :param timeout: seconds to wait at most, raises WaitTimeoutException
+        :param push: True to use push updates, or a running PushSubscription
+        :param kwargs: polling options of octoprint_wait.wait
+        :return: the state text
+        """
+        from octoprint_wait import StateCondition, wait
+        if isinstance(push, PushSubscription):
+            push = {self: push}
+        return wait([(self, StateCondition(state))], timeout=timeout, push=push, **kwargs)[0]
+
+    def command_queue(self, merge_jogs=True):
+        """
+        Return the CommandQueue of this printer, created on first use,
+        for sending jog, home, extrude and temperature commands without
+        waiting for the response. merge_jogs only applies to the first call.
+        """
+        if self._command_queue is None:
+            self._command_queue = CommandQueue(self, merge_jogs=merge_jogs)
+        return self._command_queue
+
+    def send_gcode_batch(self, commands):
+        """
+        Send a list of G-code commands in a single request.
+        :param commands: list of command strings
+        :return:
+        """
+        request = {'commands': list(commands)}
+        return_val = self._post_request(self._url['command'], request)
+        return return_val
+
+    def send_gcode(self, commands, batch_size=50):
+        """
+        Send G-code commands to the printer.
+        Comments and blank lines are dropped and the commands are sent
+        in batches of batch_size per request. Iterators and open files
+        are consumed lazily, one batch at a time.
+        :param commands: a command, a string of several lines, or an
+                         iterable of commands (e.g. an open G-code file)
+        :param batch_size: commands per request, default: 50
+        :return: number of commands sent
+        """
+        sent = 0
+        batch = []
+        for line in _gcode_lines(commands):
+            batch.append(line)
+            if len(batch) >= batch_size:
+                self.send_gcode_batch(batch)
+                sent += len(batch)
+                batch = []
+        if batch:
+            self.send_gcode_batch(batch)
+            sent += len(batch)
+        return sent
+
+    def gcode_batcher(self, batch_size=50, flush_interval=0.5):
+        """
+        Return a GcodeBatcher collecting commands for this printer.
+        """
+        return GcodeBatcher(self, batch_size=batch_size, flush_interval=flush_interval)
+
+    def subscribe(self, callbacks=None, throttle=None, start=True, **kwargs):
+        """
+        Subscribe to updates pushed by OctoPrint instead of polling.
+        :param callbacks: dictionary topic -> callable(payload), see PushSubscription
+        :param throttle: multiplier for OctoPrint's 0.5s update interval
+        :param start: connect right away, default: True
+        :return: PushSubscription, stop() it when done
+        """
+        subscription = PushSubscription(self, throttle=throttle, **kwargs)
+        for topic, callback in (callbacks or {}).items():
+            subscription.on(topic, callback)
+        if start:
+            subscription.start()
+        return subscription
+
+    def upload_file(self, path, location='local', select=False, start_print=False,
+                    remote_name=None, folder=None, progress=None, analyze=False, dedupe=False,
+                    compress=False):
+        """
+        Upload a G-code or STL file to OctoPrint.
+        The file is streamed from disk, it is never read into memory as a whole.
+        :param path: Path of the local file
+        :param location: Either 'local' or 'sdcard', default: 'local'
+        :param select: Select the file for printing after upload, default: False
+        :param start_print: Start printing after upload, default: False
+        :param remote_name: File name on the server, default: name of the local file
+        :param folder: Folder on the server to upload into (local storage only)
+        :param progress: callable(bytes_sent, bytes_total) for progress reports
+        :param analyze: Analyze G-code locally before uploading (see octoprint_gcode.py),
+                        the result is added as 'analysis' and kept for file_analysis
+        :param dedupe: True or an octoprint_files.UploadRegistry. Skip the transfer if
+                       a file with the same content hash is already in location
+                       and select that file instead, the result then has
+                       'skipped': True. A registry also finds files uploaded
+                       earlier by other processes and on the SD card.
+        :param compress: True or a zlib level (1-9): send the body gzip-compressed
+                         (Content-Encoding: gzip), compressing while reading.
+                         Only for servers, or proxies in front of them, that
+                         decompress request bodies. Default: False
+        :return: dictionary with the server's upload result
+        """
+        remote_name = remote_name or os.path.basename(path)
+        self._check_upload(remote_name, location, folder)
+        analysis = None
+        if analyze and os.path.splitext(remote_name)[1].lower() in _MACHINECODE_EXTENSIONS:
+            from octoprint_gcode import analyze_file
+            analysis = analyze_file(path).to_dict()
+        content_hash = None
+        if dedupe is not None and dedupe is not False:
+            from octoprint_files import file_sha1
+            content_hash = file_sha1(path)
+        with open(path, 'rb') as source:
+            result = self.upload_stream(source, os.path.getsize(path), remote_name,
+                                        location=location, select=select,
+                                        start_print=start_print, folder=folder,
+                                        progress=progress, dedupe=dedupe,
+                                        content_hash=content_hash, compress=compress)
+        if analysis is not None:
+            self._analyses[(location, result['path'])] = analysis
+            result['analysis'] = analysis
+        return result
+
+    def upload_stream(self, source, size, remote_name, location='local', select=False,
+                      start_print=False, folder=None, progress=None, dedupe=False,
+                      content_hash=None, compress=False, throttle=None):
+        """
+        Upload size bytes read from the file-like object source as remote_name.
+        Arguments as for upload_file; dedupe needs the SHA1 of the content
+        as content_hash. throttle is called with the size of every chunk
+        as it goes on the wire (compressed, with compress), e.g.
+        octoprint_fleet.BandwidthLimiter.consume.
+        :return: dictionary with the server's upload result, 'path' is the
+                 path of the file on the server
+        """
+        self._check_upload(remote_name, location, folder)
+        remote_path = '{0}/{1}'.format(folder.strip('/'), remote_name) if folder else remote_name
+        registry = None
+        if dedupe is not None and dedupe is not False:
+            if content_hash is None:
+                raise ValueError('dedupe needs the content_hash of the upload')
+            from octoprint_files import UploadRegistry
+            if dedupe is True:
+                if self._upload_registry is None:
+                    self._upload_registry = UploadRegistry()
+                registry = self._upload_registry
+            else:
+                registry = dedupe
+            index = self.file_index()
+            index.refresh()
+            existing = registry.find(content_hash, index, location, size)
+            if existing is not None:
+                existing_path = existing.get('path') or existing['name']
+                if select or start_print:
+                    self.select_file(existing_path, location, start_print=start_print)
+                return {'done': True, 'skipped': True, 'hash': content_hash,
+                        'path': existing_path,
+                        'files': {location: {'name': existing['name'], 'path': existing_path,
+                                             'origin': location,
+                                             'refs': existing.get('refs', {})}}}
+        fields = {}
+        if folder:
+            fields['path'] = folder
+        if select:
+            fields['select'] = 'true'
+        if start_print:
+            fields['print'] = 'true'
+        if compress:
+            body = GzipUpload(MultipartUpload(source, remote_name, size, fields=fields,
+                                              progress=progress),
+                              level=6 if compress is True else compress, throttle=throttle)
+        else:
+            body = MultipartUpload(source, remote_name, size, fields=fields, progress=progress,
+                                   throttle=throttle)
+        result = self._upload_request('{0}/{1}'.format(self._url['files'], location), body)
+        result['path'] = remote_path
+        if compress:
+            result['transferred'] = body.bytes_out
+        if registry is not None:
+            registry.record(content_hash, self.url, location, remote_path, size)
+            result['hash'] = content_hash
+        return result
+
+    def file_analysis(self, name, location='local'):
+        """
+        Analysis of a file on the server: the local analysis if the file was
+        uploaded with analyze=True, otherwise OctoPrint's gcodeAnalysis from
+        the file index (empty while the server has not analyzed the file yet).
+        :param name: File path on the server
+        :param location: Either 'local' or 'sdcard', default: 'local'
+        :return: dictionary in the format of OctoPrint's gcodeAnalysis
+        """
+        analysis = self._analyses.get((location, name))
+        if analysis is not None:
+            return analysis
+        entry = self.file_index().get(name, location)
+        if entry is None:
+            raise FileException('No file {0} on {1}'.format(name, location))
+        return entry.get('gcodeAnalysis') or {}
+
+    @staticmethod
+    def _check_upload(name, location, folder=None):
+        """
+        Raise the matching FileException if OctoPrint would refuse the upload.
+        """
+        if location not in _FILE_LOCATIONS:
+            raise LocationException('Unknown location {0}, use one of {1}'
+                                    .format(location, ', '.join(_FILE_LOCATIONS)))
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in _MACHINECODE_EXTENSIONS + _MODEL_EXTENSIONS:
+            raise UnsupportedFileException('{0} is neither G-code nor STL'.format(name))
+        if location == 'sdcard' and extension in _MODEL_EXTENSIONS:
+            raise LocationException('STL files cannot be uploaded to the SD card')
+        if location == 'sdcard' and folder:
+            raise LocationException('Folders are not supported on the SD card')
+
+    def _upload_request(self, url, body):
+        header = dict(self._header)
+        header['content-type'] = body.content_type
+        if isinstance(body, GzipUpload):
+            header['Content-Encoding'] = 'gzip'
+        response = self._request('POST', url, data=body, headers=header)
+        # Is printer busy (e.g. overwriting the file being printed)?
+        if response.status_code == 409:
+            raise self._failed(url, PrinterBusyException(response), 'POST')
+        # Did the Authorization fail?
+        elif response.status_code == 401:
+            raise self._failed(url, NotAuthorizedException(response), 'POST')
+        # Did the server refuse the file type?
+        elif response.status_code == 415:
+            raise self._failed(url, UnsupportedFileException(response), 'POST')
+        # Did some other HTTP error happen?
+        elif response.status_code >= 400:
+            raise self._failed(url, HTTPException(response), 'POST')
+        else:
+            return response.json()
+
     def job(self, command=None):
         """
         Control a job.
@@ -428,8 +2093,6 @@ class Api(object):
 if __name__ == '__main__':
     # for parsing the config file in self-test
     import xml.etree.ElementTree
-    # for delay in self-test
-    import time
 
     config = xml.etree.ElementTree.parse('octoprint_api.xml')
     item = config.find('octoprint')
@@ -463,8 +2126,12 @@ if __name__ == '__main__':
     print('Get Tool 0 temp')
     r = op.get_tool_temp(tool=0)
     print(r)
-    print('Waiting 30s for temperatures to change, please wait')
-    time.sleep(30)
+    print('Waiting for temperatures to be reached, please wait')
+    try:
+        r = op.wait_for_temperature({'tool0': 200, 'bed': 60}, timeout=300)
+        print(r)
+    except WaitTimeoutException as e:
+        print(e)
     r = op.get_status()
     print(r)
     op.set_bed_temp(temp=0)
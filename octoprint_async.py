@@ -0,0 +1,399 @@
+"""
+octoprint_async.py: asyncio flavour of the OctoPrint API wrapper.
+
+AsyncApi mirrors octoprint_api.Api method by method, but every call
+is a coroutine, so a single event loop can keep requests to many
+printers in flight at the same time. It uses the same URL table and
+raises the same exceptions as the blocking client.
+
+Requires aiohttp.
+"""
+import asyncio
+import json
+
+import aiohttp
+
+from octoprint_api import (build_url_table, HTTPException, ServerNotFoundException,
+                           NotAuthorizedException, PrinterBusyException)
+
+
+class AsyncApi(object):
+    """
+    Management and wrapper class for OctoPrint, asyncio version
+    """
+
+    def _set_url(self, base_url=None):
+        """
+        Initialize the API urls based on the base_url.
+        base_url has to include the port information if not
+        default http port (:80)
+        """
+        self._url = build_url_table(base_url)
+
+    def __init__(self, base_url=None, api_key='', debug=False,
+                 pool_size=4, connect_timeout=5.0, read_timeout=30.0):
+        """
+        Initialize the api object.
+        The HTTP session is created on first use, inside the running loop.
+        base_url -- URL of the OctoPrint server, including port. Default: None
+        api_key -- API key for accessing OctoPrint. Default: empty string
+        debug -- Switch URL output on or off, default: False (no debug)
+        pool_size -- Number of connections kept to the server. Default: 4
+        connect_timeout -- Seconds to wait for a connection, None waits forever. Default: 5
+        read_timeout -- Seconds to wait for response data, None waits forever. Default: 30
+        """
+        self._set_url(base_url=base_url)
+        self._header = {'X-Api-Key': api_key, 'content-type': 'application/json'}
+        self._debug = debug
+        self._timeout = (connect_timeout, read_timeout)
+        self._pool_size = pool_size
+        self._session = None
+
+    @property
+    def apikey(self):
+        return self._header['X-Api-Key']
+
+    @apikey.setter
+    def apikey(self, api_key):
+        self._header['X-Api-Key'] = api_key
+
+    @property
+    def url(self):
+        return self._url['base']
+
+    @url.setter
+    def url(self, url_string):
+        self._set_url(url_string)
+
+    def _open_session(self):
+        connector = aiohttp.TCPConnector(limit=self._pool_size)
+        timeout = aiohttp.ClientTimeout(sock_connect=self._timeout[0],
+                                        sock_read=self._timeout[1])
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        """
+        Close all pooled connections to the server.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+        return False
+
+    async def _request(self, method, url, **kwargs):
+        """
+        Send a request through the pooled session.
+        Returns the response with its body already read.
+        """
+        if self._session is None or self._session.closed:
+            self._open_session()
+        if self._debug:
+            print('{0} {1}'.format(method, url))
+        kwargs.setdefault('headers', self._header)
+        try:
+            async with self._session.request(method, url, **kwargs) as response:
+                await response.read()
+                return response
+        except aiohttp.ClientConnectionError as e:
+            raise ServerNotFoundException(e)
+
+    async def _get_request(self, url=None, param=None):
+        response = await self._request('GET', url, params=param)
+        if response.status == 401:
+            raise NotAuthorizedException(response)
+        elif response.status >= 400:
+            raise HTTPException(response)
+        else:
+            data = await response.json(content_type=None)
+            return data
+
+    async def _post_request(self, url=None, request=None):
+        response = await self._request('POST', url, data=json.dumps(request))
+        # Is printer busy?
+        if response.status == 409:
+            raise PrinterBusyException(response)
+        # Did the Authorization fail?
+        elif response.status == 401:
+            raise NotAuthorizedException(response)
+        # Did some other HTTP error happen?
+        elif response.status >= 400:
+            raise HTTPException(response)
+        else:
+            return response
+
+    async def get_status(self, history=True, limit=2):
+        """
+        Get the status of the OctoPrint server.
+        :param history:
+        :param limit:
+        :return: dictionary of the decoded status
+        """
+        if history:
+            hist_str = 'true'
+        else:
+            hist_str = 'false'
+        param = {'history': hist_str, 'limit': limit}
+        return await self._get_request(self._url['printer'], param)
+
+    async def get_version(self):
+        """
+        Get version information of the OctoPrint server
+        :return:
+        """
+        return await self._get_request(self._url['version'], None)
+
+    async def get_connection(self):
+        """
+        Get connection information between OctoPrint server
+        and printer.
+        :return:
+        """
+        return await self._get_request(self._url['connection'], None)
+
+    async def home(self, x=None, y=None, z=None):
+        """
+        Home the printhead in the given axis.
+        Any value different than 'None' will home the respective axis.
+        :param x:
+        :param y:
+        :param z:
+        :return:
+        """
+        home_set = []
+        if x:
+            home_set.append('x')
+        if y:
+            home_set.append('y')
+        if z:
+            home_set.append('z')
+        request = {'command': 'home', 'axes': home_set}
+        return await self._post_request(self._url['printhead'], request)
+
+    async def jog(self, x=None, y=None, z=None):
+        """
+        Moves the printhead the given values, all values are incremental.
+        :param x:
+        :param y:
+        :param z:
+        :return:
+        """
+        request = {'command': 'jog'}
+        if x is not None:
+            request['x'] = x
+        if y is not None:
+            request['y'] = y
+        if z is not None:
+            request['z'] = z
+        return await self._post_request(self._url['printhead'], request)
+
+    async def extrude(self, amount=5):
+        """
+        Extrude <amount> mm of filament on the currently active extruder.
+        Use negative values to retract.
+        :param amount:
+        :return:
+        """
+        request = {'command': 'extrude', 'amount': amount}
+        return await self._post_request(self._url['tool'], request)
+
+    async def select_tool(self, tool=0):
+        """
+        Selects the active extruder
+        :param tool: extruder number, starting with 0. Default=0
+        :return:
+        """
+        request = {'command': 'select', 'tool': 'tool{0}'.format(tool)}
+        return await self._post_request(self._url['tool'], request)
+
+    async def set_tool_temp(self, temp=0, tool=0):
+        """
+        Set Tool <tool> to Temperature <temp>.
+        :param temp:
+        :param tool:
+        :return:
+        """
+        target_string = 'tool{0}'.format(tool)
+        request = {'command': 'target', 'targets': {target_string: temp}}
+        return await self._post_request(self._url['tool'], request)
+
+    async def _get_temperatures(self, url, target_string):
+        param = {'history': 'false', 'limit': 2}
+        return_val = await self._get_request(url, param)
+        if target_string in return_val:
+            return return_val[target_string]
+        else:
+            return None
+
+    async def get_tool_temp(self, tool=0):
+        """
+        Get the current temperature for tool <tool>.
+        :param tool:
+        :return: dictionary with actual, target and offset temperature
+        """
+        target_string = 'tool{0}'.format(tool)
+        return await self._get_temperatures(self._url['tool'], target_string)
+
+    async def set_bed_temp(self, temp=0):
+        """
+        Set the bed to <temp> degrees celsius.
+        :param temp:
+        :return:
+        """
+        request = {'command': 'target', 'target': temp}
+        return await self._post_request(self._url['bed'], request)
+
+    async def get_bed_temp(self):
+        """
+        Get the current bed temperature.
+        :return: dictionary with actual, target and offset temperature
+        """
+        return await self._get_temperatures(self._url['bed'], 'bed')
+
+    async def get_job_info(self):
+        """
+        Get information about the current job.
+        :return:
+        """
+        return await self._get_request(self._url['job'], None)
+
+    async def job_start(self):
+        """
+        Start the currently loaded job.
+        :return:
+        """
+        return await self.job('start')
+
+    async def job_restart(self):
+        """
+        Restart the currently running job.
+        :return:
+        """
+        return await self.job('restart')
+
+    async def job_pause(self):
+        """
+        Pause the currently printing job.
+        :return:
+        """
+        return await self.job('pause')
+
+    async def job_cancel(self):
+        """
+        Cancel the currently running job.
+        """
+        return await self.job('cancel')
+
+    async def get_connection_status(self):
+        """
+        Gets the current connection information
+        :return:
+        """
+        return await self._get_request(self._url['connection'])
+
+    async def connect(self, port=None, baudrate=None, profile=None, save=None, autoconnect=None):
+        """
+        Connects to a printer
+        :param port: Port to connect to
+        :param baudrate:
+        :param profile:
+        :param save:
+        :param autoconnect:
+        :return:
+        """
+        request = {'command': 'connect'}
+        if port:
+            request['port'] = str(port)
+        if baudrate:
+            request['baudrate'] = str(baudrate)
+        if profile:
+            request['printerProfile'] = str(profile)
+        if save:
+            request['save'] = True
+        if autoconnect:
+            request['autoconnect'] = True
+        return await self._post_request(self._url['connection'], request)
+
+    async def disconnect(self):
+        """
+        Disconnect from printer
+        :return:
+        """
+        request = {'command': 'disconnect'}
+        return await self._post_request(self._url['connection'], request)
+
+    async def get_files(self, location=None):
+        """
+        Get the information of all files on the system
+        :param location: Location to list. 'local', 'sdcard' or None for all
+        :return: file information dictionary
+        """
+        if location in ['local', 'sdcard']:
+            url = '{0}/{1}'.format(self._url['files'], location)
+        else:
+            url = self._url['files']
+        return await self._get_request(url)
+
+    async def select_file(self, name=None, location='local', start_print=False):
+        """
+        Selects a file for printing, either from local Octoprint file system or
+        from SD card.
+        :param name: File name
+        :param location: Either 'local' or 'sdcard', default: 'local'
+        :param start_print: Immediately start print, default: False
+        :return:
+        """
+        request = {'command': 'select', 'print': start_print}
+        request_url = '{0}/{1}/{2}'.format(self._url['files'], location, name)
+        return await self._post_request(request_url, request)
+
+    async def wait_for_temperature(self, heater=0, target=None, tolerance=2.0, stable_for=0.0,
+                                   timeout=None, **kwargs):
+        """
+        Wait until heaters reached their target temperatures,
+        see octoprint_api.Api.wait_for_temperature.
+        :return: dictionary heater name -> last reading
+        """
+        from octoprint_wait import heater_targets, TemperatureCondition, async_wait
+        condition = TemperatureCondition(heater_targets(heater, target), tolerance, stable_for)
+        return (await async_wait([(self, condition)], timeout=timeout, **kwargs))[0]
+
+    async def wait_for_state(self, state='Operational', timeout=None, **kwargs):
+        """
+        Wait until the printer state text starts with state (or one of a list of states).
+        :return: the state text
+        """
+        from octoprint_wait import StateCondition, async_wait
+        return (await async_wait([(self, StateCondition(state))], timeout=timeout, **kwargs))[0]
+
+    async def job(self, command=None):
+        """
+        Control a job, see octoprint_api.Api.job.
+        :param command: string, either start, restart, pause or cancel
+        :return:
+        """
+        if command.lower() in ['start', 'cancel', 'restart', 'pause']:
+            request = {'command': command.lower()}
+            return await self._post_request(self._url['job'], request)
+
+
+if __name__ == '__main__':
+    # for parsing the config file in self-test
+    import xml.etree.ElementTree
+
+    async def self_test():
+        config = xml.etree.ElementTree.parse('octoprint_api.xml')
+        item = config.find('octoprint')
+        async with AsyncApi(base_url=item.attrib['url'], api_key=item.attrib['apikey'],
+                            debug=True) as op:
+            results = await asyncio.gather(op.get_version(), op.get_status(),
+                                           op.get_connection(), op.get_job_info())
+            for r in results:
+                print(r)
+
+    asyncio.run(self_test())
@@ -0,0 +1,375 @@
+"""
+octoprint_files.py: Client-side index of the files stored on an OctoPrint server.
+
+FileIndex keeps the recursive file listing of a printer keyed by origin
+and path and revalidates it with conditional requests (ETag /
+If-None-Match), so an unchanged listing costs a 304 instead of the full,
+analysis-laden response. Sorted keys allow fast lookups by path prefix,
+size and date. With a cache_file the listing and its ETag survive
+between processes, e.g. between printer.py invocations.
+
+UploadRegistry remembers the content hash of every file uploaded through
+it, so Api.upload_file(..., dedupe=registry) can skip transfers of files a
+printer already has even where the listing carries no hash (SD card).
+
+    index = FileIndex(printer)
+    for entry in index.find(prefix='parts/', min_size=1000000):
+        print(entry['path'], entry['size'])
+    index.select('benchy', start_print=True)
+"""
+import bisect
+import hashlib
+import json
+import os
+import threading
+import time
+
+import octoprint_api
+
+
+class FileIndex(object):
+    """
+    Indexed file listing of one printer.
+    Entries are the file dictionaries of the OctoPrint listing, folders
+    are indexed separately and without their children.
+    """
+
+    def __init__(self, api, location=None, cache_file=None, max_age=5.0):
+        """
+        api -- octoprint_api.Api of the printer
+        location -- 'local', 'sdcard' or None to index both. Default: None
+        cache_file -- file to keep the listing in between processes. Default: None
+        max_age -- seconds lookups use the listing before revalidating it,
+                   None never revalidates automatically. Default: 5
+        """
+        self._api = api
+        self.location = location
+        self.cache_file = cache_file
+        self.max_age = max_age
+        self.etag = None
+        self.checked = None
+        self.free = None
+        self._files = {}
+        self._folders = {}
+        self._by_path = []
+        self._by_size = []
+        self._by_date = []
+        self._sizes = []
+        self._dates = []
+        self._by_hash = {}
+        if cache_file:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_file) as f:
+                cached = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        if cached.get('url') != self._api.url or cached.get('location') != self.location:
+            return
+        self.etag = cached.get('etag')
+        self._build(cached.get('listing') or {})
+
+    def _save(self, listing):
+        data = {'url': self._api.url, 'location': self.location,
+                'etag': self.etag, 'listing': listing}
+        temporary = '{0}.tmp'.format(self.cache_file)
+        try:
+            with open(temporary, 'w') as f:
+                json.dump(data, f)
+            os.rename(temporary, self.cache_file)
+        except (IOError, OSError):
+            pass
+
+    def _build(self, listing):
+        files, folders = {}, {}
+        pending = list(listing.get('files') or [])
+        while pending:
+            entry = pending.pop()
+            key = (entry.get('origin', 'local'), entry.get('path') or entry['name'])
+            if entry.get('type') == 'folder':
+                pending.extend(entry.get('children') or [])
+                folder = dict(entry)
+                folder.pop('children', None)
+                folders[key] = folder
+            else:
+                files[key] = entry
+        self._files = files
+        self._folders = folders
+        self._by_path = sorted((path, origin) for origin, path in files)
+        self._by_size = sorted((entry.get('size') or 0, path, origin)
+                               for (origin, path), entry in files.items())
+        self._by_date = sorted((entry.get('date') or 0, path, origin)
+                               for (origin, path), entry in files.items())
+        self._sizes = [key[0] for key in self._by_size]
+        self._dates = [key[0] for key in self._by_date]
+        by_hash = {}
+        for key, entry in files.items():
+            if entry.get('hash'):
+                by_hash.setdefault(entry['hash'], []).append(key)
+        self._by_hash = by_hash
+        self.free = listing.get('free')
+
+    def refresh(self, force=False):
+        """
+        Revalidate the listing with the server.
+        :param force: Fetch the full listing even if the ETag still matches
+        :return: True if the listing changed
+        """
+        listing, etag = self._api.get_files_if_changed(None if force else self.etag,
+                                                        location=self.location)
+        self.checked = time.time()
+        if listing is None:
+            return False
+        self.etag = etag
+        self._build(listing)
+        if self.cache_file:
+            self._save(listing)
+        return True
+
+    @property
+    def url(self):
+        return self._api.url
+
+    def _ensure(self):
+        if self.checked is None or (self.max_age is not None and
+                                    time.time() - self.checked > self.max_age):
+            self.refresh()
+
+    def __len__(self):
+        self._ensure()
+        return len(self._files)
+
+    def __iter__(self):
+        """
+        Iterate over all file entries ordered by path.
+        """
+        self._ensure()
+        return iter([self._files[(origin, path)] for path, origin in self._by_path])
+
+    def __contains__(self, path):
+        self._ensure()
+        return any((origin, path) in self._files for origin in octoprint_api._FILE_LOCATIONS)
+
+    @property
+    def folders(self):
+        self._ensure()
+        return [self._folders[key] for key in sorted(self._folders)]
+
+    def get(self, path, origin='local'):
+        """
+        Return the entry of the file, None if there is none.
+        """
+        self._ensure()
+        return self._files.get((origin, path))
+
+    def by_prefix(self, prefix, origin=None):
+        """
+        Entries whose path starts with prefix, ordered by path.
+        A folder path followed by '/' selects the folder recursively.
+        """
+        self._ensure()
+        start = bisect.bisect_left(self._by_path, (prefix, ''))
+        result = []
+        for path, path_origin in self._by_path[start:]:
+            if not path.startswith(prefix):
+                break
+            if origin is None or path_origin == origin:
+                result.append(self._files[(path_origin, path)])
+        return result
+
+    @staticmethod
+    def _range(keys, values, low, high):
+        lo = 0 if low is None else bisect.bisect_left(values, low)
+        hi = len(values) if high is None else bisect.bisect_right(values, high)
+        return keys[lo:hi]
+
+    def by_size(self, minimum=None, maximum=None):
+        """
+        Entries with minimum <= size <= maximum bytes, ordered by size.
+        """
+        self._ensure()
+        return [self._files[(origin, path)]
+                for _, path, origin in self._range(self._by_size, self._sizes, minimum, maximum)]
+
+    def by_date(self, since=None, until=None):
+        """
+        Entries uploaded between the timestamps since and until (inclusive),
+        ordered oldest first.
+        """
+        self._ensure()
+        return [self._files[(origin, path)]
+                for _, path, origin in self._range(self._by_date, self._dates, since, until)]
+
+    def by_origin(self, origin):
+        self._ensure()
+        return [self._files[(o, path)] for path, o in self._by_path if o == origin]
+
+    def newest(self, count=10):
+        self._ensure()
+        return [self._files[(origin, path)]
+                for _, path, origin in reversed(self._by_date[-count:])]
+
+    def by_hash(self, content_hash):
+        """
+        Entries whose SHA1 content hash (as listed by OctoPrint) matches.
+        """
+        self._ensure()
+        return [self._files[key] for key in sorted(self._by_hash.get(content_hash, ()))]
+
+    def find(self, prefix=None, origin=None, min_size=None, max_size=None,
+             since=None, until=None):
+        """
+        Entries matching all given criteria, ordered by path.
+        """
+        entries = self.by_prefix(prefix or '', origin)
+        if min_size is not None or max_size is not None:
+            entries = [e for e in entries
+                       if (min_size is None or (e.get('size') or 0) >= min_size) and
+                       (max_size is None or (e.get('size') or 0) <= max_size)]
+        if since is not None or until is not None:
+            entries = [e for e in entries
+                       if (since is None or (e.get('date') or 0) >= since) and
+                       (until is None or (e.get('date') or 0) <= until)]
+        return entries
+
+    def resolve(self, name, origin=None):
+        """
+        Find the single file meant by name: an exact path, a unique file
+        name anywhere in the folders or a unique path prefix.
+        Raises FileException if no file or more than one file matches.
+        """
+        self._ensure()
+        origins = [origin] if origin else octoprint_api._FILE_LOCATIONS
+        for o in origins:
+            if (o, name) in self._files:
+                return self._files[(o, name)]
+        matches = [entry for (o, path), entry in self._files.items()
+                   if o in origins and path.rsplit('/', 1)[-1] == name]
+        if not matches:
+            matches = self.by_prefix(name, origin)
+        if len(matches) == 1:
+            return matches[0]
+        if not matches:
+            raise octoprint_api.FileException('No file matches {0}'.format(name))
+        paths = sorted(e.get('path') or e['name'] for e in matches)
+        raise octoprint_api.FileException('{0} matches {1} files: {2}{3}'.format(
+            name, len(paths), ', '.join(paths[:5]), ', ...' if len(paths) > 5 else ''))
+
+    def select(self, name, start_print=False, origin=None):
+        """
+        Select the file resolved from name for printing (see resolve).
+        :return: the selected entry
+        """
+        entry = self.resolve(name, origin)
+        self._api.select_file(name=entry.get('path') or entry['name'],
+                              location=entry.get('origin', 'local'), start_print=start_print)
+        return entry
+
+
+def file_sha1(path, chunk_size=1024 * 1024):
+    """
+    SHA1 of the content of a local file, the hash OctoPrint lists for its files.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadRegistry(object):
+    """
+    Persistent map content hash -> files uploaded with that content,
+    per printer. Kept as JSON in path, shared by all Api objects using it.
+    """
+
+    def __init__(self, path=None):
+        """
+        path -- file the registry is kept in, None keeps it in memory only
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if path:
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    def record(self, content_hash, url, location, path, size):
+        """
+        Remember that the file with content_hash was stored on the printer
+        at url as location/path.
+        """
+        entry = {'url': url, 'location': location, 'path': path, 'size': size,
+                 'time': time.time()}
+        with self._lock:
+            entries = [e for e in self._entries.get(content_hash, [])
+                       if (e['url'], e['location'], e['path']) != (url, location, path)]
+            entries.append(entry)
+            self._entries[content_hash] = entries
+            self._save()
+
+    def lookup(self, content_hash, url=None):
+        """
+        Files recorded with content_hash, optionally only those on the printer at url.
+        """
+        with self._lock:
+            return [dict(e) for e in self._entries.get(content_hash, [])
+                    if url is None or e['url'] == url]
+
+    def forget(self, url, location, path):
+        """
+        Remove the records of a file, e.g. after deleting it from the printer.
+        """
+        with self._lock:
+            for content_hash in list(self._entries):
+                entries = [e for e in self._entries[content_hash]
+                           if (e['url'], e['location'], e['path']) != (url, location, path)]
+                if entries:
+                    self._entries[content_hash] = entries
+                else:
+                    del self._entries[content_hash]
+            self._save()
+
+    def find(self, content_hash, index, location=None, size=None):
+        """
+        Entry of index holding content_hash, using the hashes OctoPrint lists
+        and the recorded uploads to the printer of the index. Recorded files
+        only count if they are still listed with the same size.
+        :param location: only look at files in this location
+        :return: file entry of the index or None
+        """
+        for entry in index.by_hash(content_hash):
+            if location is None or entry.get('origin') == location:
+                return entry
+        for record in self.lookup(content_hash, index.url):
+            if location is not None and record['location'] != location:
+                continue
+            entry = index.get(record['path'], record['location'])
+            if entry is None or (size is not None and entry.get('size') != size):
+                continue
+            if entry.get('hash') and entry['hash'] != content_hash:
+                continue
+            return entry
+        return None
+
+    def _save(self):
+        if not self.path:
+            return
+        temporary = '{0}.tmp'.format(self.path)
+        try:
+            with open(temporary, 'w') as f:
+                json.dump(self._entries, f)
+            os.rename(temporary, self.path)
+        except (IOError, OSError):
+            pass
@@ -0,0 +1,340 @@
+"""
+octoprint_fleet.py: Run OctoPrint API calls on many printers at once.
+
+PrinterFleet wraps a set of named octoprint_api.Api objects and fans
+calls out to all of them on a bounded thread pool, so one slow or dead
+printer does not hold up the others.
+
+    fleet = PrinterFleet({'left': Api(url1, key1), 'right': Api(url2, key2)})
+    for result in fleet.as_completed('get_status', history=False):
+        print(result.name, result.value if result.ok else result.exception)
+    results = fleet.submit('job', 'pause').gather(timeout=10)
+
+distribute uploads one file to many printers at once, reading it through
+a single memory map, with limits on concurrent transfers and bandwidth:
+
+    fleet.distribute('batch.gcode', max_transfers=4, bandwidth=2000000,
+                     start_print=True, start_interval=30)
+"""
+import hashlib
+import mmap
+import os
+import threading
+import time
+from concurrent import futures
+
+
+class FleetResult(object):
+    """
+    Outcome of one call on one printer.
+    name -- name of the printer
+    value -- return value of the call, None if it failed
+    exception -- exception raised by the call, None if it succeeded
+    elapsed -- seconds the call took (up to the deadline if it timed out)
+    """
+    __slots__ = ('name', 'value', 'exception', 'elapsed')
+
+    def __init__(self, name, value=None, exception=None, elapsed=0.0):
+        self.name = name
+        self.value = value
+        self.exception = exception
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.exception is None
+
+    def get(self):
+        """
+        Return the value or raise the exception of the call.
+        """
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+    def __repr__(self):
+        if self.ok:
+            return 'FleetResult({0!r}, value={1!r})'.format(self.name, self.value)
+        return 'FleetResult({0!r}, exception={1!r})'.format(self.name, self.exception)
+
+
+class FleetCall(object):
+    """
+    A call running on several printers, as returned by PrinterFleet.submit.
+    """
+
+    def __init__(self, fleet_futures):
+        # future -> (printer name, start time)
+        self._futures = fleet_futures
+
+    @property
+    def names(self):
+        return [name for name, _ in self._futures.values()]
+
+    def _result(self, future):
+        name, started = self._futures[future]
+        try:
+            value = future.result()
+        except Exception as e:
+            return FleetResult(name, exception=e, elapsed=time.time() - started)
+        return FleetResult(name, value=value, elapsed=time.time() - started)
+
+    def as_completed(self, timeout=None):
+        """
+        Yield a FleetResult for every printer as soon as its call finishes.
+        With a timeout, calls still running at the deadline are cancelled
+        if possible and yielded with a futures.TimeoutError.
+        """
+        pending = set(self._futures)
+        try:
+            for future in futures.as_completed(self._futures, timeout=timeout):
+                pending.discard(future)
+                yield self._result(future)
+        except futures.TimeoutError:
+            for future in pending:
+                future.cancel()
+                name, started = self._futures[future]
+                yield FleetResult(name, exception=futures.TimeoutError(),
+                                  elapsed=time.time() - started)
+
+    def gather(self, timeout=None):
+        """
+        Wait for all printers and return a dictionary name -> FleetResult.
+        timeout -- overall deadline in seconds for the whole call
+        """
+        return dict((result.name, result) for result in self.as_completed(timeout=timeout))
+
+    def cancel(self):
+        """
+        Cancel the calls that have not started yet.
+        """
+        for future in self._futures:
+            future.cancel()
+
+
+class BandwidthLimiter(object):
+    """
+    Token bucket limiting the aggregate throughput of several transfers.
+    """
+
+    def __init__(self, bytes_per_second):
+        self.rate = float(bytes_per_second)
+        self._lock = threading.Lock()
+        self._available = 0.0
+        self._last = time.time()
+
+    def consume(self, amount):
+        """
+        Account for amount bytes, sleeping as long as needed to keep the rate.
+        """
+        with self._lock:
+            now = time.time()
+            # a second of unused budget at most, so idle time does not turn into bursts
+            self._available = min(self.rate, self._available + (now - self._last) * self.rate)
+            self._last = now
+            self._available -= amount
+            delay = -self._available / self.rate if self._available < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _SharedReader(object):
+    """
+    File-like view of a buffer (the memory-mapped upload) with its own
+    position, so concurrent transfers read the same mapping.
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self._position = 0
+
+    def read(self, size=-1):
+        end = len(self._data) if size is None or size < 0 else self._position + size
+        chunk = self._data[self._position:end]
+        self._position += len(chunk)
+        return chunk
+
+
+def _named_progress(progress, name):
+    """
+    Progress callback of one transfer, reporting to progress(name, sent, total).
+    """
+    def report(sent, total):
+        progress(name, sent, total)
+    return report
+
+
+class _StaggeredStart(object):
+    """
+    Hands out start times at least interval seconds apart.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class PrinterFleet(object):
+    """
+    Collection of named Api objects sharing one bounded worker pool.
+    """
+
+    def __init__(self, printers=None, max_workers=8):
+        """
+        printers -- dictionary name -> octoprint_api.Api. Default: empty fleet
+        max_workers -- maximum number of requests in flight at once. Default: 8
+        """
+        self._printers = dict(printers or {})
+        self._max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def add(self, name, api):
+        self._printers[name] = api
+
+    def remove(self, name):
+        return self._printers.pop(name)
+
+    @property
+    def names(self):
+        return sorted(self._printers)
+
+    def __getitem__(self, name):
+        return self._printers[name]
+
+    def __contains__(self, name):
+        return name in self._printers
+
+    def __len__(self):
+        return len(self._printers)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(max_workers=self._max_workers)
+            return self._executor
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Start method on every printer of the fleet.
+        method -- name of an Api method, or a callable called with the
+                  Api object as first argument
+        Remaining arguments are passed on to the method.
+        :return: FleetCall
+        """
+        executor = self._get_executor()
+        fleet_futures = {}
+        for name in self.names:
+            api = self._printers[name]
+            if callable(method):
+                function, call_args = method, (api,) + args
+            else:
+                function, call_args = getattr(api, method), args
+            future = executor.submit(function, *call_args, **kwargs)
+            fleet_futures[future] = (name, time.time())
+        return FleetCall(fleet_futures)
+
+    def as_completed(self, method, *args, **kwargs):
+        """
+        Run method on all printers and yield FleetResults as they finish.
+        """
+        return self.submit(method, *args, **kwargs).as_completed()
+
+    def gather(self, method, *args, **kwargs):
+        """
+        Run method on all printers and return a dictionary name -> FleetResult.
+        Use submit(...).gather(timeout) for an overall deadline.
+        """
+        return self.submit(method, *args, **kwargs).gather()
+
+    def distribute(self, path, location='local', remote_name=None, folder=None, names=None,
+                   max_transfers=4, bandwidth=None, progress=None, select=False,
+                   start_print=False, start_interval=0.0, dedupe=False, compress=False):
+        """
+        Upload one file to many printers concurrently. The file is memory-mapped
+        once and all transfers read from that mapping.
+        :param path: Path of the local file
+        :param location: Either 'local' or 'sdcard', default: 'local'
+        :param remote_name: File name on the printers, default: name of the local file
+        :param folder: Folder on the printers to upload into
+        :param names: Printers to upload to, default: all
+        :param max_transfers: Uploads running at the same time, default: 4
+        :param bandwidth: Limit of all transfers together in bytes per second
+                          sent, compressed bytes with compress, default: None (unlimited)
+        :param progress: callable(name, bytes_sent, bytes_total) for progress reports
+        :param select: Select the file for printing after upload, default: False
+        :param start_print: Start printing on each printer once its upload completed
+        :param start_interval: Minimum seconds between two print starts, e.g. to
+                               spread the heating load, default: 0
+        :param dedupe: As for Api.upload_file, skip printers already holding the file
+        :param compress: As for Api.upload_file, gzip the transfers
+        :return: dictionary name -> FleetResult with the upload result, which has
+                 'started' set to the start time if the print was started
+        """
+        names = list(names) if names is not None else self.names
+        remote_name = remote_name or os.path.basename(path)
+        limiter = BandwidthLimiter(bandwidth) if bandwidth else None
+        stagger = _StaggeredStart(start_interval) if start_print else None
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        content_hash = None
+        if dedupe is not None and dedupe is not False:
+            content_hash = hashlib.sha1(mapped).hexdigest()
+
+        def transfer(name):
+            api = self._printers[name]
+            report = _named_progress(progress, name) if progress is not None else None
+            # the limiter is charged for the bytes on the wire, compressed with compress
+            result = api.upload_stream(_SharedReader(mapped), size, remote_name,
+                                       location=location, select=select or start_print,
+                                       folder=folder, progress=report, dedupe=dedupe,
+                                       content_hash=content_hash, compress=compress,
+                                       throttle=limiter.consume if limiter else None)
+            if stagger is not None:
+                stagger.wait()
+                api.job_start()
+                result['started'] = time.time()
+            return result
+
+        executor = futures.ThreadPoolExecutor(max_workers=max_transfers)
+        try:
+            call = FleetCall(dict((executor.submit(transfer, name), (name, time.time()))
+                                  for name in names))
+            return call.gather()
+        finally:
+            executor.shutdown(wait=True)
+            if size:
+                mapped.close()
+
+    def close(self, close_printers=True):
+        """
+        Shut down the worker pool and close the connections of all printers.
+        close_printers -- also close the Api objects. Default: True
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        if close_printers:
+            for api in self._printers.values():
+                api.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
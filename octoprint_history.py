@@ -0,0 +1,295 @@
+"""
+octoprint_history.py: Fixed-size temperature history for OctoPrint printers.
+
+TemperatureHistory keeps the last <capacity> samples of every heater in
+preallocated, array-backed ring buffers (one column each for time, actual,
+target and offset), so memory stays constant on long prints. It is fed
+with the results of Api.get_status, get_tool_temp/get_bed_temp or push
+'temperature' samples and answers windowed statistics.
+
+If NumPy is installed, the statistics run vectorized on the buffer
+contents, otherwise the same results are computed with builtins.
+
+    history = TemperatureHistory(capacity=3600)
+    history.add_status(printer.get_status(history=True, limit=60))
+    print(history.mean('tool0', seconds=30), history.overshoot('bed'))
+"""
+import bisect
+import time
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+COLUMNS = ('time', 'actual', 'target', 'offset')
+
+
+class SensorHistory(object):
+    """
+    Ring buffer of the samples of one heater.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._columns = dict((name, array('d', [0.0]) * capacity) for name in COLUMNS)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def last_time(self):
+        if not self._count:
+            return None
+        return self._columns['time'][(self._next - 1) % self.capacity]
+
+    def append(self, timestamp, actual, target=0.0, offset=0.0):
+        """
+        Add one sample. Samples not newer than the last one are ignored,
+        so overlapping history responses can be added without duplicates.
+        """
+        if self._count and timestamp <= self.last_time:
+            return False
+        i = self._next
+        columns = self._columns
+        columns['time'][i] = timestamp
+        columns['actual'][i] = actual if actual is not None else float('nan')
+        columns['target'][i] = target or 0.0
+        columns['offset'][i] = offset or 0.0
+        self._next = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        return True
+
+    def column(self, name):
+        """
+        Return the column in chronological order (a copy).
+        """
+        data = self._columns[name]
+        if self._count < self.capacity:
+            ordered = data[:self._count]
+        else:
+            ordered = data[self._next:] + data[:self._next]
+        if numpy is not None:
+            return numpy.frombuffer(ordered, dtype=numpy.float64)
+        return ordered
+
+    def window(self, seconds=None, start=None, end=None):
+        """
+        Return a dictionary column name -> values for the samples in the
+        time range. seconds selects the last <seconds> before the newest
+        sample, start/end select absolute timestamps.
+        """
+        times = self.column('time')
+        if seconds is not None and self._count:
+            start = self.last_time - seconds
+        lo, hi = 0, len(times)
+        if numpy is not None:
+            if start is not None:
+                lo = int(numpy.searchsorted(times, start, side='left'))
+            if end is not None:
+                hi = int(numpy.searchsorted(times, end, side='right'))
+        else:
+            if start is not None:
+                lo = bisect.bisect_left(times, start)
+            if end is not None:
+                hi = bisect.bisect_right(times, end)
+        result = {'time': times[lo:hi]}
+        for name in COLUMNS[1:]:
+            result[name] = self.column(name)[lo:hi]
+        return result
+
+
+def _mean(values):
+    if numpy is not None:
+        return float(numpy.nanmean(values)) if len(values) else None
+    values = [v for v in values if v == v]
+    return sum(values) / len(values) if values else None
+
+
+def _min(values):
+    if numpy is not None:
+        return float(numpy.nanmin(values)) if len(values) else None
+    values = [v for v in values if v == v]
+    return min(values) if values else None
+
+
+def _max(values):
+    if numpy is not None:
+        return float(numpy.nanmax(values)) if len(values) else None
+    values = [v for v in values if v == v]
+    return max(values) if values else None
+
+
+class TemperatureHistory(object):
+    """
+    Temperature history of all heaters of one printer.
+    """
+
+    def __init__(self, capacity=3600):
+        """
+        capacity -- samples kept per heater, the oldest are overwritten. Default: 3600
+        """
+        self.capacity = capacity
+        self._sensors = {}
+
+    @property
+    def sensors(self):
+        return sorted(self._sensors)
+
+    def __getitem__(self, sensor):
+        return self._sensors[sensor]
+
+    def __contains__(self, sensor):
+        return sensor in self._sensors
+
+    def _sensor(self, name):
+        sensor = self._sensors.get(name)
+        if sensor is None:
+            sensor = self._sensors[name] = SensorHistory(self.capacity)
+        return sensor
+
+    def add_reading(self, sensor, reading, timestamp=None):
+        """
+        Add one reading as returned by get_tool_temp/get_bed_temp.
+        :param sensor: heater name, e.g. 'tool0' or 'bed'
+        :param reading: dictionary with actual, target and optionally offset
+        :param timestamp: time of the reading, default: now
+        """
+        if not reading:
+            return False
+        if timestamp is None:
+            timestamp = time.time()
+        return self._sensor(sensor).append(timestamp, reading.get('actual'),
+                                           reading.get('target'), reading.get('offset'))
+
+    def add_sample(self, sample, offsets=None):
+        """
+        Add one history sample {'time': t, 'tool0': {...}, 'bed': {...}},
+        as found in get_status history and push 'temperature' messages.
+        """
+        timestamp = sample.get('time')
+        if timestamp is None:
+            timestamp = time.time()
+        for name, reading in sample.items():
+            if name == 'time' or not isinstance(reading, dict):
+                continue
+            offset = reading.get('offset')
+            if offset is None and offsets:
+                offset = offsets.get(name)
+            self._sensor(name).append(timestamp, reading.get('actual'),
+                                      reading.get('target'), offset)
+
+    def add_status(self, status, timestamp=None):
+        """
+        Add the temperatures of a get_status result. If the result contains
+        a history, all new samples of it are added, otherwise the current
+        readings are added with the given timestamp (default: now).
+        """
+        temperatures = status.get('temperature', status)
+        history = temperatures.get('history')
+        if history:
+            offsets = dict((name, reading.get('offset')) for name, reading in temperatures.items()
+                           if name != 'history' and isinstance(reading, dict))
+            for sample in history:
+                self.add_sample(sample, offsets)
+        else:
+            if timestamp is None:
+                timestamp = time.time()
+            for name, reading in temperatures.items():
+                if name != 'history' and isinstance(reading, dict):
+                    self.add_reading(name, reading, timestamp)
+
+    def window(self, sensor, seconds=None, start=None, end=None):
+        """
+        Columns of sensor in a time range, see SensorHistory.window.
+        """
+        return self._sensors[sensor].window(seconds=seconds, start=start, end=end)
+
+    def mean(self, sensor, seconds=None, column='actual'):
+        return _mean(self.window(sensor, seconds)[column])
+
+    def minimum(self, sensor, seconds=None, column='actual'):
+        return _min(self.window(sensor, seconds)[column])
+
+    def maximum(self, sensor, seconds=None, column='actual'):
+        return _max(self.window(sensor, seconds)[column])
+
+    def overshoot(self, sensor, seconds=None):
+        """
+        Largest amount by which the actual temperature exceeded an
+        active (non-zero) target, 0.0 if it never did, None without data.
+        """
+        data = self.window(sensor, seconds)
+        actual, target = data['actual'], data['target']
+        if not len(actual):
+            return None
+        if numpy is not None:
+            active = target > 0
+            if not active.any():
+                return 0.0
+            return max(0.0, float(numpy.nanmax(actual[active] - target[active])))
+        excess = [a - t for a, t in zip(actual, target) if t > 0 and a == a]
+        return max([0.0] + excess)
+
+    def rate(self, sensor, seconds=60):
+        """
+        Rate of change of the actual temperature in degrees per second,
+        least-squares slope over the window. None with fewer than two samples.
+        """
+        data = self.window(sensor, seconds)
+        times, actual = data['time'], data['actual']
+        if numpy is not None:
+            valid = ~numpy.isnan(actual)
+            times, actual = times[valid], actual[valid]
+            if len(times) < 2:
+                return None
+            t = times - times.mean()
+            denominator = float((t * t).sum())
+            if denominator == 0:
+                return None
+            return float((t * (actual - actual.mean())).sum()) / denominator
+        pairs = [(t, a) for t, a in zip(times, actual) if a == a]
+        if len(pairs) < 2:
+            return None
+        t_mean = sum(t for t, _ in pairs) / len(pairs)
+        a_mean = sum(a for _, a in pairs) / len(pairs)
+        denominator = sum((t - t_mean) ** 2 for t, _ in pairs)
+        if denominator == 0:
+            return None
+        return sum((t - t_mean) * (a - a_mean) for t, a in pairs) / denominator
+
+    def downsample(self, sensor, points, seconds=None, column='actual'):
+        """
+        Reduce the window to at most <points> buckets of consecutive samples
+        for plotting. Returns a dictionary with the columns time (bucket
+        start), mean, min and max.
+        """
+        data = self.window(sensor, seconds)
+        times, values = data['time'], data[column]
+        count = len(times)
+        if count == 0 or points <= 0:
+            return {'time': [], 'mean': [], 'min': [], 'max': []}
+        points = min(points, count)
+        if numpy is not None:
+            edges = numpy.linspace(0, count, points + 1).astype(int)
+            starts = edges[:-1]
+            sums = numpy.add.reduceat(numpy.nan_to_num(values), starts)
+            valid = numpy.add.reduceat((~numpy.isnan(values)).astype(float), starts)
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                means = sums / valid
+            return {'time': times[starts],
+                    'mean': means,
+                    'min': numpy.fmin.reduceat(values, starts),
+                    'max': numpy.fmax.reduceat(values, starts)}
+        result = {'time': [], 'mean': [], 'min': [], 'max': []}
+        for n in range(points):
+            lo, hi = n * count // points, (n + 1) * count // points
+            bucket = values[lo:hi]
+            result['time'].append(times[lo])
+            result['mean'].append(_mean(bucket))
+            result['min'].append(_min(bucket))
+            result['max'].append(_max(bucket))
+        return result
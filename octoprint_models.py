@@ -0,0 +1,418 @@
+"""
+octoprint_models.py: Typed models of OctoPrint API responses.
+
+The models are __slots__ classes holding the raw response body. The body
+is decoded on first access, as a whole: large sections such as the
+temperature history or the children of folders are decoded with the rest
+(ask for less instead, e.g. get_status(history=False)). What is lazy is
+the wrapping: nested sections (heaters, the job's file, file entries)
+are turned into model objects only when they are used, so a status
+fetched just to check the state never builds objects for its heaters.
+
+Decoding uses the fastest JSON library installed (orjson, ujson, then the
+standard json module); set_json_backend selects another one.
+
+Models still behave like the dictionaries they replace for reading
+(status['state']['text'], status.get('temperature')), so existing code
+keeps working when an Api is created with models=True.
+
+    printer = Api(url, key, models=True)
+    status = printer.get_status(history=False)
+    if status.printing:
+        print(status.tool(0).actual, status.bed.target)
+"""
+import json
+
+
+def _detect_backends():
+    backends = [('json', json.loads)]
+    try:
+        import ujson
+        backends.insert(0, ('ujson', ujson.loads))
+    except ImportError:
+        pass
+    try:
+        import orjson
+        backends.insert(0, ('orjson', orjson.loads))
+    except ImportError:
+        pass
+    return backends
+
+
+_BACKENDS = _detect_backends()
+_backend_name, _loads = _BACKENDS[0]
+
+
+def set_json_backend(backend=None):
+    """
+    Select the function decoding response bodies.
+    :param backend: 'orjson', 'ujson', 'json', a callable taking bytes,
+                    or None for the fastest installed library
+    """
+    global _backend_name, _loads
+    if backend is None:
+        _backend_name, _loads = _BACKENDS[0]
+    elif callable(backend):
+        _backend_name, _loads = getattr(backend, '__module__', None) or 'custom', backend
+    else:
+        available = dict(_BACKENDS)
+        if backend not in available:
+            raise ValueError('JSON backend {0} is not installed, available: {1}'
+                             .format(backend, ', '.join(available)))
+        _backend_name, _loads = backend, available[backend]
+
+
+def json_backend():
+    """
+    Name of the JSON backend in use.
+    """
+    return _backend_name
+
+
+def loads(raw):
+    """
+    Decode a response body with the selected backend.
+    """
+    if _loads is json.loads and isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    return _loads(raw)
+
+
+class Model(object):
+    """
+    Base class of the response models: a decoded-on-demand JSON object
+    with read-only dictionary access to its members. The first access
+    decodes the complete body, sections are not decoded separately.
+    """
+    __slots__ = ('_raw', '_data')
+
+    def __init__(self, data=None, raw=None):
+        """
+        data -- decoded dictionary, or
+        raw -- undecoded response body (bytes), decoded on first access
+        """
+        self._data = data
+        self._raw = raw
+
+    @classmethod
+    def from_json(cls, raw):
+        return cls(raw=raw)
+
+    @property
+    def data(self):
+        """
+        The decoded dictionary.
+        """
+        if self._data is None:
+            self._data = loads(self._raw) if self._raw else {}
+            self._raw = None
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def keys(self):
+        return self.data.keys()
+
+    def items(self):
+        return self.data.items()
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __eq__(self, other):
+        if isinstance(other, Model):
+            other = other.data
+        return self.data == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def to_dict(self):
+        return self.data
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(type(self).__name__, self.data)
+
+
+class ToolTemperature(object):
+    """
+    Reading of one heater.
+    name -- heater name, e.g. 'tool0' or 'bed'
+    actual -- current temperature, None if unknown
+    target -- setpoint, None if unknown
+    offset -- temperature offset
+    """
+    __slots__ = ('name', 'actual', 'target', 'offset')
+
+    def __init__(self, name, actual=None, target=None, offset=0):
+        self.name = name
+        self.actual = actual
+        self.target = target
+        self.offset = offset
+
+    @classmethod
+    def from_dict(cls, name, reading):
+        return cls(name, reading.get('actual'), reading.get('target'), reading.get('offset', 0))
+
+    @property
+    def heating(self):
+        return bool(self.target) and self.actual is not None and self.actual < self.target
+
+    def __getitem__(self, key):
+        if key not in ('actual', 'target', 'offset'):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return {'actual': self.actual, 'target': self.target, 'offset': self.offset}
+
+    def __eq__(self, other):
+        if isinstance(other, ToolTemperature):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ToolTemperature({0!r}, actual={1!r}, target={2!r}, offset={3!r})'.format(
+            self.name, self.actual, self.target, self.offset)
+
+
+class PrinterState(Model):
+    """
+    Result of GET /api/printer.
+    """
+    __slots__ = ('_heaters',)
+
+    def __init__(self, data=None, raw=None):
+        Model.__init__(self, data, raw)
+        self._heaters = None
+
+    @property
+    def state_text(self):
+        return (self.data.get('state') or {}).get('text')
+
+    @property
+    def flags(self):
+        return (self.data.get('state') or {}).get('flags') or {}
+
+    @property
+    def operational(self):
+        return bool(self.flags.get('operational'))
+
+    @property
+    def printing(self):
+        return bool(self.flags.get('printing'))
+
+    @property
+    def paused(self):
+        return bool(self.flags.get('paused'))
+
+    @property
+    def ready(self):
+        return bool(self.flags.get('ready'))
+
+    @property
+    def error(self):
+        return bool(self.flags.get('error') or self.flags.get('closedOrError'))
+
+    @property
+    def temperatures(self):
+        """
+        Dictionary heater name -> ToolTemperature.
+        """
+        if self._heaters is None:
+            temperatures = self.data.get('temperature') or {}
+            self._heaters = dict((name, ToolTemperature.from_dict(name, reading))
+                                 for name, reading in temperatures.items()
+                                 if name != 'history' and isinstance(reading, dict))
+        return self._heaters
+
+    def heater(self, name):
+        return self.temperatures.get(name)
+
+    def tool(self, tool=0):
+        return self.temperatures.get('tool{0}'.format(tool))
+
+    @property
+    def tools(self):
+        return [self.temperatures[name] for name in sorted(self.temperatures)
+                if name.startswith('tool')]
+
+    @property
+    def bed(self):
+        return self.temperatures.get('bed')
+
+    @property
+    def history(self):
+        """
+        Temperature history samples as sent by the server.
+        """
+        return (self.data.get('temperature') or {}).get('history') or []
+
+
+class FileEntry(Model):
+    """
+    One file or folder of a file listing.
+    """
+    __slots__ = ('_children',)
+
+    def __init__(self, data=None, raw=None):
+        Model.__init__(self, data, raw)
+        self._children = None
+
+    @property
+    def name(self):
+        return self.data.get('name')
+
+    @property
+    def path(self):
+        return self.data.get('path') or self.data.get('name')
+
+    @property
+    def origin(self):
+        return self.data.get('origin')
+
+    @property
+    def size(self):
+        return self.data.get('size')
+
+    @property
+    def date(self):
+        return self.data.get('date')
+
+    @property
+    def type(self):
+        return self.data.get('type')
+
+    @property
+    def hash(self):
+        return self.data.get('hash')
+
+    @property
+    def is_folder(self):
+        return self.data.get('type') == 'folder'
+
+    @property
+    def analysis(self):
+        return self.data.get('gcodeAnalysis') or {}
+
+    @property
+    def estimated_print_time(self):
+        return self.analysis.get('estimatedPrintTime')
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = [FileEntry(child) for child in self.data.get('children') or []]
+        return self._children
+
+
+class FileListing(Model):
+    """
+    Result of GET /api/files. Iterating yields the top level FileEntries.
+    """
+    __slots__ = ('_files',)
+
+    def __init__(self, data=None, raw=None):
+        Model.__init__(self, data, raw)
+        self._files = None
+
+    @property
+    def files(self):
+        if self._files is None:
+            self._files = [FileEntry(entry) for entry in self.data.get('files') or []]
+        return self._files
+
+    @property
+    def free(self):
+        return self.data.get('free')
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def walk(self):
+        """
+        Yield all file entries, descending into folders.
+        """
+        pending = list(reversed(self.files))
+        while pending:
+            entry = pending.pop()
+            if entry.is_folder:
+                pending.extend(reversed(entry.children))
+            else:
+                yield entry
+
+
+class JobInfo(Model):
+    """
+    Result of GET /api/job.
+    """
+    __slots__ = ('_file',)
+
+    def __init__(self, data=None, raw=None):
+        Model.__init__(self, data, raw)
+        self._file = None
+
+    @property
+    def state(self):
+        return self.data.get('state')
+
+    @property
+    def file(self):
+        """
+        FileEntry of the selected file, None without selection.
+        """
+        if self._file is None:
+            entry = (self.data.get('job') or {}).get('file') or {}
+            if entry.get('name'):
+                self._file = FileEntry(entry)
+        return self._file
+
+    @property
+    def estimated_print_time(self):
+        return (self.data.get('job') or {}).get('estimatedPrintTime')
+
+    @property
+    def filament(self):
+        return (self.data.get('job') or {}).get('filament') or {}
+
+    @property
+    def completion(self):
+        return (self.data.get('progress') or {}).get('completion')
+
+    @property
+    def print_time(self):
+        return (self.data.get('progress') or {}).get('printTime')
+
+    @property
+    def print_time_left(self):
+        return (self.data.get('progress') or {}).get('printTimeLeft')
+
+    @property
+    def filepos(self):
+        return (self.data.get('progress') or {}).get('filepos')
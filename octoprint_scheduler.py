@@ -0,0 +1,353 @@
+"""
+octoprint_scheduler.py: Adaptive job polling for many printers.
+
+PollingScheduler polls get_job_info (and get_status while a printer is
+not printing, to notice heating) at an interval that depends on what
+each printer is doing: idle and paused printers are asked rarely,
+printing ones regularly and jobs close to their end often. The sum over
+all printers is kept within a request budget (requests per second).
+
+Completion times are predicted from the progress history of each job
+(least-squares fit of completion over time), with OctoPrint's own
+printTimeLeft as fallback, and callbacks fire on state changes and when
+a job completes.
+
+    scheduler = PollingScheduler({'left': api1, 'right': api2}, budget=2.0)
+    scheduler.on('complete', lambda tracker: print(tracker.name, 'done'))
+    with scheduler:
+        time.sleep(3600)
+        print(scheduler['left'].eta)
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent import futures
+
+import octoprint_api
+
+_log = logging.getLogger(__name__)
+
+IDLE = 'idle'
+HEATING = 'heating'
+PRINTING = 'printing'
+FINISHING = 'finishing'
+PAUSED = 'paused'
+OFFLINE = 'offline'
+
+# Seconds between polls per state
+DEFAULT_INTERVALS = {IDLE: 30.0,
+                     HEATING: 5.0,
+                     PRINTING: 15.0,
+                     FINISHING: 2.0,
+                     PAUSED: 30.0,
+                     OFFLINE: 60.0}
+
+_EVENTS = ('update', 'state', 'complete', 'error')
+
+
+class JobTracker(object):
+    """
+    What the scheduler knows about one printer.
+    name -- printer name
+    state -- one of idle, heating, printing, finishing, paused, offline
+    job -- last get_job_info result
+    status -- last get_status result, only fetched while not printing
+    samples -- recent (time, completion percent) pairs of the current job
+    polls -- number of polls so far
+    requests -- HTTP requests sent by the last poll
+    next_poll -- time of the next poll
+    """
+
+    def __init__(self, name, api, history=30):
+        self.name = name
+        self.api = api
+        self.state = None
+        self.job = None
+        self.status = None
+        self.samples = collections.deque(maxlen=history)
+        self.polls = 0
+        self.requests = 0
+        self.next_poll = 0.0
+        self.error = None
+        self.running = False
+
+    @property
+    def completion(self):
+        """
+        Completion of the current or last job in percent, None if unknown.
+        """
+        return ((self.job or {}).get('progress') or {}).get('completion')
+
+    @property
+    def remaining(self):
+        """
+        Predicted seconds until the job completes, None if unknown.
+        A straight line fitted to the recent progress samples is used once
+        they span at least 30 seconds, before that OctoPrint's estimate.
+        """
+        samples = self.samples
+        if len(samples) >= 3 and samples[-1][0] - samples[0][0] >= 30:
+            count = float(len(samples))
+            t_mean = sum(t for t, _ in samples) / count
+            c_mean = sum(c for _, c in samples) / count
+            denominator = sum((t - t_mean) ** 2 for t, _ in samples)
+            if denominator > 0:
+                rate = sum((t - t_mean) * (c - c_mean) for t, c in samples) / denominator
+                if rate > 0:
+                    # from the fitted line at the newest sample
+                    last_time = samples[-1][0]
+                    fitted = c_mean + rate * (last_time - t_mean)
+                    return max(0.0, (100.0 - fitted) / rate - (time.time() - last_time))
+        progress = (self.job or {}).get('progress') or {}
+        return progress.get('printTimeLeft')
+
+    @property
+    def eta(self):
+        """
+        Predicted completion time (seconds since the epoch), None if unknown.
+        """
+        remaining = self.remaining
+        if remaining is None or self.state not in (PRINTING, FINISHING):
+            return None
+        return time.time() + remaining
+
+    def __repr__(self):
+        return 'JobTracker({0!r}, state={1!r}, completion={2!r})'.format(
+            self.name, self.state, self.completion)
+
+
+class PollingScheduler(object):
+    """
+    Polls the jobs of many printers within a request budget.
+    """
+
+    def __init__(self, printers=None, budget=2.0, intervals=None, finishing_window=120.0,
+                 max_workers=4):
+        """
+        printers -- dictionary name -> octoprint_api.Api, or a PrinterFleet
+        budget -- maximum requests per second to all printers together. Default: 2
+        intervals -- dictionary state -> seconds between polls overriding
+                     DEFAULT_INTERVALS
+        finishing_window -- predicted seconds left below which a job counts
+                            as finishing and is polled more often. Default: 120
+        max_workers -- polls running at the same time. Default: 4
+        """
+        self.budget = float(budget)
+        self.intervals = dict(DEFAULT_INTERVALS)
+        self.intervals.update(intervals or {})
+        self.finishing_window = finishing_window
+        self._trackers = {}
+        self._callbacks = dict((event, []) for event in _EVENTS)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopping = False
+        self._thread = None
+        self._executor = None
+        self._max_workers = max_workers
+        self._tokens = 1.0
+        self._token_time = time.time()
+        if printers is not None:
+            for name in printers:
+                self.add(name, printers[name])
+
+    def add(self, name, api):
+        with self._lock:
+            self._trackers[name] = JobTracker(name, api)
+            self._wakeup.notify()
+
+    def remove(self, name):
+        with self._lock:
+            return self._trackers.pop(name)
+
+    def __getitem__(self, name):
+        return self._trackers[name]
+
+    def __iter__(self):
+        return iter(sorted(self._trackers))
+
+    def __len__(self):
+        return len(self._trackers)
+
+    def on(self, event, callback):
+        """
+        Register callback(tracker) for an event:
+        update -- after every poll
+        state -- when the state of a printer changed
+        complete -- when a job finished (completion reached 100 percent)
+        error -- when a poll failed, tracker.error holds the exception
+        """
+        if event not in _EVENTS:
+            raise ValueError('Unknown event {0}, use one of {1}'.format(event, ', '.join(_EVENTS)))
+        self._callbacks[event].append(callback)
+
+    def off(self, event, callback):
+        self._callbacks[event].remove(callback)
+
+    def _fire(self, event, tracker):
+        for callback in list(self._callbacks[event]):
+            try:
+                callback(tracker)
+            except Exception:
+                _log.exception('%s callback failed', event)
+
+    @staticmethod
+    def _requests_per_poll(state):
+        # get_status is only added while not printing
+        return 1 if state in (PRINTING, FINISHING) else 2
+
+    def interval(self, tracker):
+        """
+        Seconds until the next poll of tracker: the interval of its state,
+        shortened towards the predicted end of a job and stretched evenly
+        for all printers if they would exceed the budget together.
+        """
+        interval = self.intervals[tracker.state or IDLE]
+        if tracker.state in (PRINTING, FINISHING):
+            remaining = tracker.remaining
+            if remaining is not None:
+                interval = max(self.intervals[FINISHING], min(interval, remaining / 2.0))
+        demand = sum(self._requests_per_poll(t.state) / self.intervals[t.state or IDLE]
+                     for t in self._trackers.values())
+        if demand > self.budget:
+            interval *= demand / self.budget
+        return interval
+
+    def classify(self, job, status):
+        """
+        State of a printer from its job info and (if fetched) its status.
+        """
+        text = (job.get('state') or '').lower()
+        if text.startswith('printing') or text.startswith('sending'):
+            return PRINTING
+        if text.startswith('paus'):
+            return PAUSED
+        if text.startswith('offline') or text.startswith('error') or text.startswith('closed'):
+            return OFFLINE
+        temperatures = (status or {}).get('temperature') or {}
+        for name, reading in temperatures.items():
+            if name == 'history' or not reading:
+                continue
+            target, actual = reading.get('target') or 0, reading.get('actual') or 0
+            if target > 0 and actual < target - 2:
+                return HEATING
+        return IDLE
+
+    def poll(self, name):
+        """
+        Poll one printer now, update its tracker and fire the callbacks.
+        """
+        tracker = self._trackers[name]
+        previous = tracker.state
+        try:
+            tracker.requests = 1
+            job = tracker.api.get_job_info()
+            status = None
+            if previous not in (PRINTING, FINISHING) or \
+                    not (job.get('state') or '').lower().startswith('printing'):
+                tracker.requests = 2
+                status = tracker.api.get_status(history=False)
+        except (octoprint_api.HTTPException, octoprint_api.OctoprintException) as e:
+            tracker.error = e
+            state = OFFLINE
+            self._fire('error', tracker)
+        else:
+            tracker.error = None
+            tracker.job = job
+            tracker.status = status
+            state = self.classify(job, status)
+            completion = ((job.get('progress') or {}).get('completion'))
+            if state == PRINTING and completion is not None:
+                if tracker.samples and completion < tracker.samples[-1][1]:
+                    # a new job started
+                    tracker.samples.clear()
+                tracker.samples.append((time.time(), completion))
+                remaining = tracker.remaining
+                if remaining is not None and remaining <= self.finishing_window:
+                    state = FINISHING
+        tracker.polls += 1
+        tracker.state = state
+        if state != OFFLINE:
+            self._fire('update', tracker)
+        if state != previous:
+            self._fire('state', tracker)
+            if previous in (PRINTING, FINISHING) and state not in (PRINTING, PAUSED, OFFLINE):
+                if tracker.completion is not None and tracker.completion >= 100.0:
+                    self._fire('complete', tracker)
+            if state not in (PRINTING, FINISHING, PAUSED):
+                tracker.samples.clear()
+        return tracker
+
+    def _take_tokens(self, count):
+        """
+        Token bucket enforcing the budget: take count tokens (one per
+        request) or return the seconds to wait until that many are available.
+        """
+        now = time.time()
+        capacity = max(2.0, self.budget)
+        self._tokens = min(capacity, self._tokens + (now - self._token_time) * self.budget)
+        self._token_time = now
+        if self._tokens >= count:
+            self._tokens -= count
+            return 0.0
+        return (count - self._tokens) / self.budget
+
+    def _run_poll(self, tracker, charged):
+        try:
+            self.poll(tracker.name)
+        finally:
+            with self._lock:
+                # a print that just ended costs a status request more than
+                # charged up front, the bucket goes into debt for it
+                if tracker.requests > charged:
+                    self._tokens -= tracker.requests - charged
+                tracker.running = False
+                tracker.next_poll = time.time() + self.interval(tracker)
+                self._wakeup.notify()
+
+    def _run(self):
+        with self._lock:
+            while not self._stopping:
+                waiting = [t for t in self._trackers.values() if not t.running]
+                if not waiting:
+                    self._wakeup.wait()
+                    continue
+                tracker = min(waiting, key=lambda t: t.next_poll)
+                delay = tracker.next_poll - time.time()
+                charge = self._requests_per_poll(tracker.state)
+                if delay <= 0:
+                    delay = self._take_tokens(charge)
+                if delay > 0:
+                    self._wakeup.wait(delay)
+                    continue
+                tracker.running = True
+                self._executor.submit(self._run_poll, tracker, charge)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self._stopping = False
+            self._executor = futures.ThreadPoolExecutor(max_workers=self._max_workers)
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
@@ -0,0 +1,472 @@
+"""
+octoprint_telemetry.py: Compact on-disk telemetry log of OctoPrint printers.
+
+TelemetryRecorder appends one fixed-size binary record per snapshot
+(time, state, job progress and actual/target temperature of every
+heater) to a log file per printer, rotating to a new file when the
+current one reaches max_bytes or max_age seconds. A record of a printer
+with a tool and a bed takes 45 bytes, so a week of 1 Hz samples stays
+under 30 MB.
+
+TelemetryReader maps a log file into memory. Time ranges are found by
+binary search on the time column and only the selected records are
+converted into column arrays (NumPy arrays if installed, array.array
+otherwise). read_log does the same across all rotated files of a printer.
+
+    with TelemetryRecorder('/var/log/printers', 'left') as recorder:
+        while printing:
+            recorder.poll(printer)
+            time.sleep(1)
+
+    data = read_log('/var/log/printers', 'left', start=time.time() - 3600,
+                    columns=['time', 'tool0_actual', 'completion'])
+
+File layout (little endian): a header of HEADER_SIZE + 17 bytes per column
+holding the magic b'OPTL', the format version, the header and record
+sizes, the column count and the creation time, then for every column
+its name (16 bytes, NUL padded) and struct type code; the records follow.
+"""
+import bisect
+import mmap
+import os
+import struct
+import time
+from array import array
+
+from octoprint_api import HTTPException
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'OPTL'
+VERSION = 1
+# magic, version, header size, record size, column count, creation time
+_HEADER = struct.Struct('<4sHHHHd')
+HEADER_SIZE = _HEADER.size
+_COLUMN = struct.Struct('<16sc')
+
+# State text prefixes and their codes in the state column, 0 is unknown
+STATES = ('Unknown', 'Offline', 'Opening', 'Connecting', 'Operational', 'Printing',
+          'Sending', 'Pausing', 'Paused', 'Resuming', 'Cancelling', 'Finishing', 'Error',
+          'Closed')
+
+# Columns before the heaters
+BASE_COLUMNS = (('time', 'd'), ('state', 'B'), ('completion', 'f'), ('print_time', 'i'),
+                ('print_time_left', 'i'), ('filepos', 'q'))
+
+_NAN = float('nan')
+
+
+def state_code(text):
+    """
+    Code of a state text in the state column, 0 for unknown states.
+    """
+    if text:
+        for code, state in enumerate(STATES):
+            if code and text.startswith(state):
+                return code
+    return 0
+
+
+def state_text(code):
+    return STATES[code] if 0 <= code < len(STATES) else STATES[0]
+
+
+def heater_columns(heaters):
+    """
+    Column definitions (name, struct code) of a record with these heaters.
+    """
+    columns = list(BASE_COLUMNS)
+    for heater in heaters:
+        columns.append(('{0}_actual'.format(heater), 'f'))
+        columns.append(('{0}_target'.format(heater), 'f'))
+    return columns
+
+
+def _header_bytes(columns, created):
+    record = struct.Struct('<' + ''.join(code for _, code in columns))
+    header = [_HEADER.pack(MAGIC, VERSION, HEADER_SIZE + _COLUMN.size * len(columns),
+                           record.size, len(columns), created)]
+    for name, code in columns:
+        header.append(_COLUMN.pack(name.encode('ascii'), code.encode('ascii')))
+    return b''.join(header)
+
+
+def _read_header(data):
+    """
+    Returns (header size, columns, creation time) of a log file's content,
+    raises ValueError if it is not a telemetry log.
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError('Not a telemetry log, file too short')
+    magic, version, header_size, record_size, count, created = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a telemetry log of version {0}'.format(VERSION))
+    columns = []
+    for n in range(count):
+        name, code = _COLUMN.unpack_from(data, HEADER_SIZE + n * _COLUMN.size)
+        columns.append((name.rstrip(b'\0').decode('ascii'), code.decode('ascii')))
+    if struct.calcsize('<' + ''.join(code for _, code in columns)) != record_size:
+        raise ValueError('Corrupt telemetry log header')
+    return header_size, columns, created
+
+
+def _number(value, default=_NAN):
+    return default if value is None else value
+
+
+class TelemetryRecorder(object):
+    """
+    Appends snapshots of one printer to rotating log files in a directory.
+    Files are named <name>-<UTC creation time>.optl.
+    """
+
+    def __init__(self, directory, name, heaters=('tool0', 'bed'), max_bytes=64 * 1024 * 1024,
+                 max_age=24 * 3600.0, max_files=None):
+        """
+        directory -- directory of the log files, created if missing
+        name -- printer name, the prefix of the file names
+        heaters -- heaters recorded, others are ignored. Default: tool0 and bed
+        max_bytes -- size after which a new file is started. Default: 64 MB
+        max_age -- seconds after which a new file is started, None: no limit. Default: 1 day
+        max_files -- rotated files kept, the oldest are deleted, None keeps all
+        """
+        self.directory = directory
+        self.name = name
+        self.heaters = tuple(heaters)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_files = max_files
+        self._columns = heater_columns(self.heaters)
+        self._record = struct.Struct('<' + ''.join(code for _, code in self._columns))
+        self._file = None
+        self._size = 0
+        self._created = None
+        self._last_time = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @property
+    def path(self):
+        """
+        The file currently written, None before the first record.
+        """
+        return self._file.name if self._file is not None else None
+
+    @property
+    def record_size(self):
+        return self._record.size
+
+    @property
+    def files(self):
+        return log_files(self.directory, self.name)
+
+    def _open(self, now):
+        self.close()
+        existing = self.files
+        if existing and self._reusable(existing[-1], now):
+            path = existing[-1]
+            self._file = open(path, 'r+b', buffering=0)
+            self._file.seek(0, os.SEEK_END)
+            self._size = self._file.tell()
+            self._trim()
+            return
+        created = now
+        while True:
+            # names sort by creation time, several rotations per second included
+            path = os.path.join(self.directory, '{0}-{1}-{2:06d}.optl'.format(
+                self.name, time.strftime('%Y%m%d-%H%M%S', time.gmtime(created)),
+                int(round(created * 1e6)) % 1000000))
+            if not os.path.exists(path):
+                break
+            created += 1e-6
+        self._file = open(path, 'wb', buffering=0)
+        header = _header_bytes(self._columns, created)
+        self._file.write(header)
+        self._size = len(header)
+        self._created = created
+        self._last_time = None
+        self._expire()
+
+    def _reusable(self, path, now):
+        """
+        Whether an existing file of an earlier run can be continued.
+        """
+        try:
+            with open(path, 'rb') as f:
+                header_size, columns, created = _read_header(f.read(4096))
+            size = os.path.getsize(path)
+        except (IOError, OSError, ValueError):
+            return False
+        if columns != self._columns or size >= self.max_bytes:
+            return False
+        if self.max_age is not None and now - created >= self.max_age:
+            return False
+        self._created = created
+        count = (size - header_size) // self._record.size
+        self._last_time = None
+        if count:
+            with open(path, 'rb') as f:
+                f.seek(header_size + (count - 1) * self._record.size)
+                self._last_time = struct.unpack_from('<d', f.read(8))[0]
+        return True
+
+    def _trim(self):
+        # drop the partial record a crash may have left
+        header_size = HEADER_SIZE + _COLUMN.size * len(self._columns)
+        excess = (self._size - header_size) % self._record.size
+        if excess:
+            self._size -= excess
+            self._file.truncate(self._size)
+            self._file.seek(self._size)
+
+    def _expire(self):
+        if self.max_files is None:
+            return
+        for path in self.files[:-self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def append(self, timestamp, state=None, completion=None, print_time=None,
+               print_time_left=None, filepos=None, temperatures=None):
+        """
+        Append one record. Records not newer than the last one are dropped.
+        :param state: state text or code
+        :param temperatures: dictionary heater -> {'actual': ..., 'target': ...}
+        :return: True if the record was written
+        """
+        if self._last_time is not None and timestamp <= self._last_time:
+            return False
+        if self._file is None or self._size + self._record.size > self.max_bytes or \
+                (self.max_age is not None and timestamp - self._created >= self.max_age):
+            self._open(timestamp)
+            if self._last_time is not None and timestamp <= self._last_time:
+                return False
+        values = [timestamp,
+                  state if isinstance(state, int) else state_code(state),
+                  _number(completion),
+                  _number(print_time, -1),
+                  _number(print_time_left, -1),
+                  _number(filepos, -1)]
+        temperatures = temperatures or {}
+        for heater in self.heaters:
+            reading = temperatures.get(heater) or {}
+            values.append(_number(reading.get('actual')))
+            values.append(_number(reading.get('target')))
+        self._file.write(self._record.pack(*values))
+        self._size += self._record.size
+        self._last_time = timestamp
+        return True
+
+    def record(self, status=None, job=None, timestamp=None):
+        """
+        Append a snapshot from the results of Api.get_status and
+        Api.get_job_info (dictionaries or models), either may be None.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        state = None
+        temperatures = None
+        if status is not None:
+            state = (status.get('state') or {}).get('text')
+            temperatures = status.get('temperature')
+        progress = {}
+        if job is not None:
+            state = state or job.get('state')
+            progress = job.get('progress') or {}
+        return self.append(timestamp, state, progress.get('completion'),
+                           progress.get('printTime'), progress.get('printTimeLeft'),
+                           progress.get('filepos'), temperatures)
+
+    def poll(self, api):
+        """
+        Fetch status and job of the printer and append them.
+        A printer that is not operational is recorded with its job state only.
+        """
+        job = api.get_job_info()
+        try:
+            status = api.get_status(history=False)
+        except HTTPException:
+            status = None
+        return self.record(status, job)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def log_files(directory, name):
+    """
+    Log files of printer name in directory, oldest first.
+    """
+    prefix = '{0}-'.format(name)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return [os.path.join(directory, n) for n in sorted(names)
+            if n.startswith(prefix) and n.endswith('.optl') and
+            n[len(prefix):len(prefix) + 1].isdigit()]
+
+
+class _TimeColumn(object):
+    """
+    Sequence view of the time column of a mapped log, for bisect.
+    """
+
+    def __init__(self, reader):
+        self._reader = reader
+
+    def __len__(self):
+        return len(self._reader)
+
+    def __getitem__(self, index):
+        reader = self._reader
+        return struct.unpack_from('<d', reader._map, reader.header_size + index * reader.record_size)[0]
+
+
+class TelemetryReader(object):
+    """
+    Memory-mapped read access to one log file.
+    Records appended after opening are not seen, open a new reader for them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        try:
+            self.header_size, self.columns, self.created = _read_header(self._map)
+        except ValueError:
+            self.close()
+            raise
+        self._record = struct.Struct('<' + ''.join(code for _, code in self.columns))
+        self.record_size = self._record.size
+        self._count = (size - self.header_size) // self.record_size
+        self._index = dict((name, n) for n, (name, _) in enumerate(self.columns))
+
+    @property
+    def names(self):
+        return [name for name, _ in self.columns]
+
+    @property
+    def heaters(self):
+        return [name[:-len('_actual')] for name, _ in self.columns if name.endswith('_actual')]
+
+    def __len__(self):
+        return self._count
+
+    def time_range(self):
+        """
+        (first, last) record time, None for an empty log.
+        """
+        if not self._count:
+            return None
+        times = _TimeColumn(self)
+        return times[0], times[self._count - 1]
+
+    def span(self, start=None, end=None):
+        """
+        (first, stop) record indices of the records with start <= time <= end.
+        """
+        times = _TimeColumn(self)
+        lo = 0 if start is None else bisect.bisect_left(times, start)
+        hi = self._count if end is None else bisect.bisect_right(times, end)
+        return lo, max(lo, hi)
+
+    def read(self, start=None, end=None, columns=None):
+        """
+        Columns of the records between the timestamps start and end (inclusive).
+        :param columns: column names, default: all
+        :return: dictionary column name -> NumPy array (array.array without NumPy)
+        """
+        names = list(columns) if columns is not None else self.names
+        for name in names:
+            if name not in self._index:
+                raise KeyError('No column {0} in {1}'.format(name, self.path))
+        lo, hi = self.span(start, end)
+        offset = self.header_size + lo * self.record_size
+        if numpy is not None:
+            dtype = numpy.dtype([(name, '<' + code) for name, code in self.columns])
+            records = numpy.frombuffer(self._map, dtype=dtype, count=hi - lo, offset=offset) \
+                if hi > lo else numpy.zeros(0, dtype=dtype)
+            return dict((name, numpy.array(records[name])) for name in names)
+        result = dict((name, array(self.columns[self._index[name]][1])) for name in names)
+        if hi > lo:
+            view = memoryview(self._map)[offset:offset + (hi - lo) * self.record_size]
+            positions = [(name, self._index[name]) for name in names]
+            for values in self._record.iter_unpack(view):
+                for name, n in positions:
+                    result[name].append(values[n])
+            view.release()
+        return result
+
+    def close(self):
+        if self._map is not None and not isinstance(self._map, bytes):
+            self._map.close()
+        self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def _concatenate(parts):
+    if numpy is not None:
+        return numpy.concatenate(parts)
+    result = parts[0]
+    for part in parts[1:]:
+        result.extend(part)
+    return result
+
+
+def read_log(directory, name, start=None, end=None, columns=None):
+    """
+    Columns of the records of printer name between start and end, read from
+    all of its log files that overlap the range.
+    :param columns: column names, default: all columns of the newest file. Files
+                    without a requested column (other heaters) are skipped
+    :return: dictionary column name -> array, see TelemetryReader.read
+    """
+    paths = log_files(directory, name)
+    wanted = columns
+    if wanted is None and paths:
+        with TelemetryReader(paths[-1]) as newest:
+            wanted = newest.names
+    parts = []
+    for path in paths:
+        with TelemetryReader(path) as reader:
+            time_range = reader.time_range()
+            if time_range is None:
+                continue
+            if (end is not None and time_range[0] > end) or \
+                    (start is not None and time_range[1] < start):
+                continue
+            if any(column not in reader.names for column in wanted):
+                continue
+            parts.append(reader.read(start, end, wanted))
+    if not parts:
+        if columns is None:
+            return {}
+        return dict((column, numpy.zeros(0) if numpy is not None else array('d'))
+                    for column in columns)
+    return dict((column, _concatenate([part[column] for part in parts])) for column in parts[0])
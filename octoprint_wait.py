@@ -0,0 +1,355 @@
+"""
+octoprint_wait.py: Waiting for printer conditions instead of sleeping.
+
+A condition (TemperatureCondition, StateCondition) is checked against a
+printer until it holds. wait() does this for any number of (api,
+condition) pairs at once and returns as soon as all of them are met.
+Printers are polled with an interval growing from min_interval to
+max_interval while nothing happens, shortened when the heating rate
+predicts the target is close. With push subscriptions the conditions are
+checked on every pushed update instead, and polling only serves as a
+slow fallback. async_wait() is the same for AsyncApi objects.
+
+    printer.set_tool_temp(210)
+    printer.set_bed_temp(60)
+    printer.wait_for_temperature({'tool0': 210, 'bed': 60}, stable_for=10, timeout=600)
+    printer.job_start()
+
+    # several printers at once
+    wait([(left, TemperatureCondition({'bed': None})),
+          (right, TemperatureCondition({'bed': None}))], timeout=600)
+"""
+import asyncio
+import threading
+import time
+
+from octoprint_api import HTTPException, WaitTimeoutException
+
+# Seconds between fallback polls while push updates arrive
+PUSH_POLL_INTERVAL = 30.0
+
+
+def heater_targets(heater, target=None):
+    """
+    Dictionary heater name -> target temperature from the forms accepted
+    by the wait functions: a tool number, a heater name ('tool0', 'bed'),
+    a list of those (all with target), or a dictionary heater -> target.
+    A target of None means the target currently set on the printer.
+    """
+    if isinstance(heater, dict):
+        return dict((_heater_name(name), value) for name, value in heater.items())
+    if isinstance(heater, (list, tuple, set)):
+        return dict((_heater_name(name), target) for name in heater)
+    return {_heater_name(heater): target}
+
+
+def _heater_name(heater):
+    if isinstance(heater, int):
+        return 'tool{0}'.format(heater)
+    return heater
+
+
+class TemperatureCondition(object):
+    """
+    Heaters within tolerance of their targets for stable_for seconds.
+    """
+    needs_status = True
+
+    def __init__(self, targets, tolerance=2.0, stable_for=0.0):
+        """
+        targets -- dictionary heater name -> target temperature, None
+                   for the target set on the printer (see heater_targets)
+        tolerance -- allowed difference to the target in degrees. Default: 2
+        stable_for -- seconds all heaters have to stay within tolerance. Default: 0
+        """
+        self.targets = dict(targets)
+        self.tolerance = tolerance
+        self.stable_for = stable_for
+        self.readings = {}
+        self._since = None
+        self._last = {}
+        self._rates = {}
+
+    def _target(self, name, reading):
+        target = self.targets[name]
+        return reading.get('target') if target is None else target
+
+    def update(self, snapshot, now):
+        """
+        Check the condition against a snapshot {'state': text,
+        'temperature': {heater: reading}}, returns True once it is met.
+        """
+        temperatures = snapshot.get('temperature')
+        if temperatures is None:
+            self._since = None
+            return False
+        within = True
+        for name in self.targets:
+            reading = temperatures.get(name)
+            if not reading or reading.get('actual') is None:
+                within = False
+                continue
+            actual = reading['actual']
+            self.readings[name] = reading
+            last = self._last.get(name)
+            if last is not None and now > last[0]:
+                self._rates[name] = (actual - last[1]) / (now - last[0])
+            self._last[name] = (now, actual)
+            target = self._target(name, reading)
+            if target is None or target <= 0:
+                # heater off, nothing to wait for
+                continue
+            if abs(actual - target) > self.tolerance:
+                within = False
+        if not within:
+            self._since = None
+            return False
+        if self._since is None:
+            self._since = now
+        return now - self._since >= self.stable_for
+
+    def estimate(self, now):
+        """
+        Predicted seconds until the condition is met, None if unknown.
+        """
+        if self._since is not None:
+            return max(0.0, self.stable_for - (now - self._since))
+        longest = None
+        for name, (_, actual) in self._last.items():
+            target = self._target(name, self.readings[name])
+            rate = self._rates.get(name)
+            if target is None or target <= 0 or abs(actual - target) <= self.tolerance:
+                continue
+            if not rate or (target - actual) * rate <= 0:
+                return None
+            seconds = (abs(target - actual) - self.tolerance) / abs(rate)
+            longest = seconds if longest is None else max(longest, seconds)
+        if longest is None:
+            return None
+        return longest + self.stable_for
+
+    def result(self):
+        """
+        Dictionary heater name -> last reading.
+        """
+        return dict(self.readings)
+
+    def __repr__(self):
+        return 'TemperatureCondition({0!r}, tolerance={1!r}, stable_for={2!r})'.format(
+            self.targets, self.tolerance, self.stable_for)
+
+
+class StateCondition(object):
+    """
+    Printer state text starting with one of the given states,
+    e.g. 'Operational' or ['Operational', 'Error'].
+    """
+    needs_status = False
+
+    def __init__(self, states):
+        if isinstance(states, str):
+            states = [states]
+        self.states = list(states)
+        self.state = None
+
+    def update(self, snapshot, now):
+        self.state = snapshot.get('state')
+        text = (self.state or '').lower()
+        return any(text.startswith(state.lower()) for state in self.states)
+
+    def estimate(self, now):
+        return None
+
+    def result(self):
+        """
+        The state text that met the condition.
+        """
+        return self.state
+
+    def __repr__(self):
+        return 'StateCondition({0!r})'.format(self.states)
+
+
+def _is_not_operational(exception):
+    response = exception.args[0] if exception.args else None
+    return getattr(response, 'status_code', getattr(response, 'status', None)) == 409
+
+
+def _snapshot(condition, status=None, job=None):
+    if condition.needs_status:
+        if status is None:
+            return {'state': None, 'temperature': None}
+        state = status.get('state') or {}
+        return {'state': state.get('text'), 'temperature': status.get('temperature') or {}}
+    return {'state': (job or {}).get('state')}
+
+
+class _Entry(object):
+    """
+    Polling state of one (api, condition) pair.
+    """
+
+    def __init__(self, api, condition, min_interval):
+        self.api = api
+        self.condition = condition
+        self.interval = min_interval
+        self.next_poll = 0.0
+        self.met = False
+        self.pushed = {}
+        self.fresh = False
+        self.subscription = None
+
+    def next_interval(self, now, min_interval, max_interval, backoff):
+        self.interval = min(self.interval * backoff, max_interval)
+        interval = self.interval
+        estimate = self.condition.estimate(now)
+        if estimate is not None:
+            interval = min(interval, max(min_interval, estimate))
+        return interval
+
+    def poll(self):
+        """
+        Fetch what the condition needs and return the snapshot.
+        """
+        if self.condition.needs_status:
+            try:
+                return _snapshot(self.condition, status=self.api.get_status(history=False))
+            except HTTPException as e:
+                if not _is_not_operational(e):
+                    raise
+                return _snapshot(self.condition)
+        return _snapshot(self.condition, job=self.api.get_job_info())
+
+    def on_temperature(self, sample):
+        temperatures = dict(sample)
+        temperatures.pop('time', None)
+        self.pushed['temperature'] = temperatures
+        self.fresh = True
+
+    def on_state(self, state):
+        self.pushed['state'] = state.get('text')
+        self.fresh = True
+
+
+def _describe(entries):
+    return ', '.join('{0} on {1}'.format(entry.condition, entry.api.url)
+                     for entry in entries if not entry.met)
+
+
+def wait(conditions, timeout=None, min_interval=0.5, max_interval=5.0, backoff=1.5, push=None):
+    """
+    Block until all conditions hold.
+    :param conditions: list of (Api, condition) pairs, a printer may appear
+                       in several pairs
+    :param timeout: seconds to wait at most, None waits forever. Raises
+                    WaitTimeoutException when it passes
+    :param min_interval: first and shortest poll interval in seconds. Default: 0.5
+    :param max_interval: longest poll interval in seconds. Default: 5
+    :param backoff: factor the poll interval grows by while waiting. Default: 1.5
+    :param push: True to check on updates pushed by the printers, or a
+                 dictionary Api -> PushSubscription to use running subscriptions
+    :return: list of the condition results in the order of conditions
+    """
+    entries = [_Entry(api, condition, min_interval) for api, condition in conditions]
+    deadline = None if timeout is None else time.time() + timeout
+    changed = threading.Event()
+    own_subscriptions = []
+    # (subscription, topic, callback) to unregister when done
+    registered = []
+
+    def notify(_):
+        changed.set()
+
+    try:
+        if push:
+            subscriptions = dict(push) if isinstance(push, dict) else {}
+            for entry in entries:
+                subscription = subscriptions.get(entry.api)
+                if subscription is None:
+                    # one socket per printer, shared by all its conditions
+                    subscription = subscriptions[entry.api] = entry.api.subscribe()
+                    own_subscriptions.append(subscription)
+                if not any(s is subscription for s, _, callback in registered if callback is notify):
+                    for topic in ('temperature', 'state'):
+                        registered.append((subscription, topic, subscription.on(topic, notify)))
+                entry.subscription = subscription
+                registered.append((subscription, 'temperature',
+                                   subscription.on('temperature', entry.on_temperature)))
+                registered.append((subscription, 'state', subscription.on('state', entry.on_state)))
+        while True:
+            now = time.time()
+            for entry in entries:
+                if entry.met:
+                    continue
+                estimate = entry.condition.estimate(now)
+                if entry.fresh or (entry.pushed and estimate is not None and estimate <= 0):
+                    entry.fresh = False
+                    snapshot = {'state': entry.pushed.get('state'),
+                                'temperature': entry.pushed.get('temperature')}
+                    entry.met = entry.condition.update(snapshot, now)
+                if not entry.met and now >= entry.next_poll:
+                    entry.met = entry.condition.update(entry.poll(), time.time())
+                    now = time.time()
+                    if entry.subscription is not None and entry.subscription.connected:
+                        entry.next_poll = now + PUSH_POLL_INTERVAL
+                    else:
+                        entry.next_poll = now + entry.next_interval(now, min_interval,
+                                                                    max_interval, backoff)
+            waiting = [entry for entry in entries if not entry.met]
+            if not waiting:
+                return [entry.condition.result() for entry in entries]
+            delay = min(entry.next_poll for entry in waiting) - now
+            for entry in waiting:
+                if entry.subscription is not None:
+                    # stable_for may run out between pushed updates
+                    estimate = entry.condition.estimate(now)
+                    if estimate is not None:
+                        delay = min(delay, max(estimate, 0.05))
+            if deadline is not None:
+                if now >= deadline:
+                    raise WaitTimeoutException('Timed out waiting for {0}'.format(_describe(entries)))
+                delay = min(delay, deadline - now)
+            if delay > 0:
+                changed.wait(delay)
+                changed.clear()
+    finally:
+        for subscription, topic, callback in registered:
+            subscription.off(topic, callback)
+        for subscription in own_subscriptions:
+            subscription.stop()
+
+
+async def _async_poll(entry):
+    if entry.condition.needs_status:
+        try:
+            return _snapshot(entry.condition, status=await entry.api.get_status(history=False))
+        except HTTPException as e:
+            if not _is_not_operational(e):
+                raise
+            return _snapshot(entry.condition)
+    return _snapshot(entry.condition, job=await entry.api.get_job_info())
+
+
+async def _async_wait_one(entry, min_interval, max_interval, backoff):
+    while True:
+        snapshot = await _async_poll(entry)
+        now = time.time()
+        if entry.condition.update(snapshot, now):
+            entry.met = True
+            return entry.condition.result()
+        await asyncio.sleep(entry.next_interval(now, min_interval, max_interval, backoff))
+
+
+async def async_wait(conditions, timeout=None, min_interval=0.5, max_interval=5.0, backoff=1.5):
+    """
+    Wait until all conditions hold, asyncio version of wait for AsyncApi objects.
+    The printers are polled concurrently.
+    :return: list of the condition results in the order of conditions
+    """
+    entries = [_Entry(api, condition, min_interval) for api, condition in conditions]
+    waits = asyncio.gather(*[_async_wait_one(entry, min_interval, max_interval, backoff)
+                             for entry in entries])
+    try:
+        return await asyncio.wait_for(waits, timeout)
+    except asyncio.TimeoutError:
+        raise WaitTimeoutException('Timed out waiting for {0}'.format(_describe(entries)))
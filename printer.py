@@ -3,16 +3,166 @@ printer.py: A command-line interface for 3D-printers using
 the octoprint api via octoprint_api.py.
 
 Basic configuration (url, api-key) is either done via
-printer.cfg or via command-line arguments.
+printer.cfg or via command-line arguments. printer.cfg can also name
+several printers and groups of printers; most commands accept
+--printer NAME|GROUP|all and then run on all of them in parallel.
+
+If a daemon started with 'printer.py daemon' is running, commands are
+forwarded to it over a Unix socket and run on its warm connections.
 """
-import octoprint_api
-import argparse
-import ConfigParser
-from ConfigParser import NoOptionError, NoSectionError
+import json
+import os
+import socket
+import sys
+
+# Commands that are never forwarded to the daemon
+_LOCAL_COMMANDS = ['daemon', 'watch']
+# Seconds to connect to the daemon and hand over a command line
+_DAEMON_CONNECT_TIMEOUT = 2.0
+# Seconds to wait for the reply to a forwarded command
+_DAEMON_REPLY_TIMEOUT = 600.0
+# Global options followed by a value
+_VALUE_OPTIONS = ['--url', '-u', '--apikey', '-a', '--printer', '--parallel', '--timeout',
+                  '--output', '-O']
+
+
+def daemon_socket_path():
+    """
+    Returns the path of the daemon socket, $PRINTER_PY_SOCKET if set.
+    """
+    path = os.environ.get('PRINTER_PY_SOCKET')
+    if path:
+        return path
+    directory = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(directory, 'printer-py-{0}.sock'.format(os.getuid()))
+
+
+def _daemon_send(request, socket_path=None, timeout=_DAEMON_CONNECT_TIMEOUT):
+    """
+    Connect to the daemon and send a request, returns the connected socket.
+    Raises socket.error (OSError) if no daemon is listening.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(timeout)
+        client.connect(socket_path or daemon_socket_path())
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        client.shutdown(socket.SHUT_WR)
+    except (IOError, OSError):
+        client.close()
+        raise
+    return client
+
+
+def _daemon_reply(client, timeout=None):
+    """
+    Read and decode the daemon's reply from a socket returned by _daemon_send.
+    """
+    try:
+        client.settimeout(timeout)
+        data = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            data.append(chunk)
+    finally:
+        client.close()
+    return json.loads(b''.join(data).decode('utf-8'))
+
+
+def _daemon_call(request, socket_path=None, timeout=None):
+    """
+    Send a request to the daemon and return its decoded reply.
+    Raises socket.error (OSError) if no daemon is listening.
+    """
+    return _daemon_reply(_daemon_send(request, socket_path, timeout or _DAEMON_CONNECT_TIMEOUT),
+                         timeout)
+
+
+def _subcommand(argv):
+    """
+    Split argv into the global options and the subcommand with its
+    arguments, e.g. ['-u', url, 'file', 'select', 'watch'] into
+    (['-u', url], ['file', 'select', 'watch']).
+    """
+    index = 0
+    while index < len(argv):
+        argument = argv[index]
+        if argument == '--':
+            return argv[:index], argv[index + 1:]
+        if not argument.startswith('-') or argument == '-':
+            break
+        index += 2 if argument in _VALUE_OPTIONS else 1
+    return argv[:index], argv[index:]
+
+
+def forward_to_daemon(argv):
+    """
+    Run a command line in the daemon if one is running.
+    Returns the exit status, or None if the command has to run locally.
+    """
+    options, command = _subcommand(argv)
+    if '--no-daemon' in options or os.environ.get('PRINTER_PY_NO_DAEMON'):
+        return None
+    if (command and command[0] in _LOCAL_COMMANDS) or not hasattr(socket, 'AF_UNIX'):
+        return None
+    try:
+        client = _daemon_send({'argv': argv, 'cwd': os.getcwd()})
+    except (IOError, OSError):
+        return None
+    try:
+        reply = _daemon_reply(client, _DAEMON_REPLY_TIMEOUT)
+    except (IOError, OSError, ValueError) as e:
+        # the command may have run already, running it again locally could repeat it
+        sys.stderr.write('Error: no reply from the printer.py daemon: {0}\n'.format(e))
+        return 1
+    sys.stdout.write(reply.get('stdout', ''))
+    sys.stderr.write(reply.get('stderr', ''))
+    return reply.get('status', 0)
+
+
+# Try the daemon before importing the HTTP stack, that is the expensive part
+if __name__ == '__main__':
+    _status = forward_to_daemon(sys.argv[1:])
+    if _status is not None:
+        sys.exit(_status)
+
+import octoprint_api  # noqa: E402
+from octoprint_fleet import PrinterFleet  # noqa: E402
+import argparse  # noqa: E402
+import io  # noqa: E402
+import socketserver  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+import traceback  # noqa: E402
+from collections import OrderedDict  # noqa: E402
+try:
+    import ConfigParser
+    from ConfigParser import NoOptionError, NoSectionError
+except ImportError:
+    import configparser as ConfigParser
+    from configparser import NoOptionError, NoSectionError
 
 # constant definitions
 _JOB_COMMAND_LIST = ['start', 'cancel', 'pause', 'restart']
 
+# (url, apikey) -> Api, only used while running as daemon
+_warm_printers = None
+_warm_lock = threading.Lock()
+
+
+def _api(url, apikey):
+    if _warm_printers is not None:
+        key = (url, apikey)
+        with _warm_lock:
+            printer = _warm_printers.get(key)
+            if printer is None:
+                printer = octoprint_api.Api(base_url=url, api_key=apikey)
+                _warm_printers[key] = printer
+        return printer
+    return octoprint_api.Api(base_url=url, api_key=apikey)
+
 
 def init_printer(arguments):
     """
@@ -20,12 +170,15 @@ def init_printer(arguments):
     :param arguments: object with members URL and APIKEY
     :return: initialized octoprint_api-Api object
     """
-    printer = octoprint_api.Api(base_url=arguments.url, api_key=arguments.apikey)
-    return printer
+    return _api(arguments.url, arguments.apikey)
 
 
 def home_func(arguments):
     printer = init_printer(arguments)
+    home_row(printer, arguments)
+
+
+def home_row(printer, arguments):
     (x, y, z) = (False, False, False)
     if 'x' in arguments.axis.lower():
         x = True
@@ -34,6 +187,20 @@ def home_func(arguments):
     if 'z' in arguments.axis.lower():
         z = True
     printer.home(x, y, z)
+    return {'result': 'ok'}
+
+
+def temperature_lines(response):
+    """
+    Returns the human-readable temperature lines of a status response.
+    """
+    temps = response['temperature']
+    # Only temperature indices, in a nice sequence
+    t_keys = sorted(k for k in temps.keys() if k != 'history')
+    return ['{2:5} temp: {0:5.1f} C; setpoint: {1:5.1f} C'.format(temps[k]['actual'],
+                                                                  temps[k]['target'],
+                                                                  k)
+            for k in t_keys]
 
 
 def status_func(arguments):
@@ -43,54 +210,282 @@ def status_func(arguments):
         print(response)
     else:
         print('Printer status: {0}'.format(response['state']['text']))
-        temps = response['temperature']
-        t_keys = temps.keys()
-        # Safety check that only temperature indices are left
-        if 'history' in t_keys:
-            t_keys.remove('history')
-        # Put indices into nice sequence
-        t_keys.sort()
-        for k in t_keys:
-            print('{2:5} temp: {0:5.1f} C; setpoint: {1:5.1f} C'.format(temps[k]['actual'],
-                                                                        temps[k]['target'],
-                                                                        k))
+        for line in temperature_lines(response):
+            print(line)
+
+
+def status_row(printer, arguments):
+    response = printer.get_status(history=False)
+    row = {'state': response['state']['text']}
+    for name, reading in sorted(response['temperature'].items()):
+        if name != 'history':
+            row[name] = {'actual': reading['actual'], 'target': reading['target']}
+    return row
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return '--:--:--'
+    seconds = int(seconds)
+    return '{0:02d}:{1:02d}:{2:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def watch_lines(status, job_info):
+    """
+    Returns the lines of the watch display for a status and job snapshot.
+    """
+    lines = ['Printer status: {0}'.format(status['state']['text'])]
+    lines.extend(temperature_lines(status))
+    job = (job_info or {}).get('job') or {}
+    progress = (job_info or {}).get('progress') or {}
+    name = (job.get('file') or {}).get('name')
+    if name:
+        completion = progress.get('completion')
+        lines.append('Job: {0}'.format(name))
+        lines.append('Progress: {0:5.1f} %; elapsed: {1}; left: {2}'.format(
+            completion or 0.0, _format_seconds(progress.get('printTime')),
+            _format_seconds(progress.get('printTimeLeft'))))
+    else:
+        lines.append('Job: none')
+    return lines
+
+
+class TerminalView(object):
+    """
+    Redraws a block of lines in place, rewriting only the lines
+    that changed since the last frame.
+    """
+
+    def __init__(self, stream=sys.stdout):
+        self._stream = stream
+        self._lines = []
+        self._ansi = stream.isatty()
+
+    def render(self, lines):
+        out = []
+        if not self._ansi:
+            # no cursor control, print whole frames when something changed
+            if lines != self._lines:
+                out.extend(line + '\n' for line in lines)
+                out.append('\n')
+        else:
+            if self._lines:
+                # back to the first line of the previous frame
+                out.append('\x1b[{0}A'.format(len(self._lines)))
+            for n in range(max(len(lines), len(self._lines))):
+                old = self._lines[n] if n < len(self._lines) else None
+                new = lines[n] if n < len(lines) else ''
+                if new != old:
+                    out.append('\r\x1b[2K' + new)
+                out.append('\n')
+            if len(self._lines) > len(lines):
+                # park the cursor below the shorter frame
+                out.append('\x1b[{0}A'.format(len(self._lines) - len(lines)))
+        self._lines = list(lines)
+        self._stream.write(''.join(out))
+        self._stream.flush()
+
+
+def _watch_snapshot(printer):
+    status = printer.get_status(history=False)
+    try:
+        job_info = printer.get_job_info()
+    except (octoprint_api.HTTPException, octoprint_api.OctoprintException):
+        job_info = None
+    return {'time': time.time(),
+            'state': status['state'],
+            'temperature': dict((k, v) for k, v in status['temperature'].items() if k != 'history'),
+            'job': job_info.get('job') if job_info else None,
+            'progress': job_info.get('progress') if job_info else None}
+
+
+def _watch_output(arguments, snapshot, view):
+    if arguments.ndjson:
+        sys.stdout.write(json.dumps(snapshot, sort_keys=True) + '\n')
+        sys.stdout.flush()
+    else:
+        status = {'state': snapshot['state'], 'temperature': snapshot['temperature']}
+        job_info = {'job': snapshot['job'], 'progress': snapshot['progress']}
+        view.render(watch_lines(status, job_info))
+
+
+def _watch_push(printer, arguments):
+    """
+    Returns a started push subscription keeping a live snapshot,
+    or None if the push socket is not available.
+    """
+    snapshot = {}
+
+    def on_current(current):
+        temps = current.get('temps') or []
+        if temps:
+            sample = temps[-1]
+            snapshot['temperature'] = dict((k, v) for k, v in sample.items() if k != 'time')
+        snapshot.update({'time': time.time(),
+                         'state': current.get('state'),
+                         'job': current.get('job'),
+                         'progress': current.get('progress')})
+
+    subscription = printer.subscribe({'current': on_current, 'history': on_current})
+    deadline = time.time() + 5
+    while not subscription.connected and time.time() < deadline:
+        time.sleep(0.1)
+    if not subscription.connected:
+        subscription.stop()
+        return None
+    subscription.snapshot = snapshot
+    return subscription
+
+
+def watch_func(arguments):
+    printer = init_printer(arguments)
+    view = TerminalView()
+    subscription = _watch_push(printer, arguments) if arguments.push else None
+    if arguments.push and subscription is None and not arguments.ndjson:
+        print('Push updates not available, polling instead')
+    count = 0
+    try:
+        while arguments.count is None or count < arguments.count:
+            started = time.time()
+            try:
+                if subscription is not None:
+                    snapshot = dict(subscription.snapshot)
+                    if 'temperature' not in snapshot:
+                        # no update received yet
+                        snapshot = _watch_snapshot(printer)
+                else:
+                    snapshot = _watch_snapshot(printer)
+                _watch_output(arguments, snapshot, view)
+            except (octoprint_api.HTTPException, octoprint_api.OctoprintException) as e:
+                if arguments.ndjson:
+                    sys.stdout.write(json.dumps({'time': time.time(), 'error': str(e)}) + '\n')
+                    sys.stdout.flush()
+                else:
+                    view.render(['Error reading printer status: {0}'.format(e)])
+            count += 1
+            time.sleep(max(0.0, arguments.interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if subscription is not None:
+            subscription.stop()
+        printer.close()
 
 
 def jog_func(arguments):
     printer = init_printer(arguments)
+    jog_row(printer, arguments)
+
+
+def jog_row(printer, arguments):
     printer.jog(arguments.x, arguments.y, arguments.z)
+    return {'result': 'ok'}
 
 
 def extrude_func(arguments):
     printer = init_printer(arguments)
+    extrude_row(printer, arguments)
+
+
+def extrude_row(printer, arguments):
     printer.extrude(arguments.amount)
+    return {'result': 'ok'}
+
 
-    
 def tool_func(arguments):
     printer = init_printer(arguments)
+    tool_row(printer, arguments)
+
+
+def tool_row(printer, arguments):
     printer.set_tool_temp(arguments.temperature, arguments.number)
+    return {'tool{0}'.format(arguments.number): arguments.temperature}
 
 
 def bed_func(arguments):
     printer = init_printer(arguments)
+    bed_row(printer, arguments)
+
+
+def bed_row(printer, arguments):
     printer.set_bed_temp(arguments.temperature)
+    return {'bed': arguments.temperature}
 
 
 def config_file_func(filename='printer.cfg'):
+    """
+    Read the configuration file. Besides the [settings] section with
+    baseurl and apikey of the default printer it may hold
+    [printer NAME] sections (baseurl, apikey) and [group NAME] sections
+    (printers = comma separated printer or group names). A 'printer'
+    option in [settings] names the printer or group used without --printer.
+    """
     cp = ConfigParser.RawConfigParser()
     cp.read(filename)
     ret_value = {}
-    try:
-        ret_value['url'] = cp.get('settings', 'baseurl')
-    except (NoOptionError, NoSectionError):
-        ret_value['url'] = None
-    try:
-        ret_value['apikey'] = cp.get('settings', 'apikey')
-    except (NoOptionError, NoSectionError):
-        ret_value['apikey'] = None
+    for key, option in (('url', 'baseurl'), ('apikey', 'apikey'), ('printer', 'printer')):
+        try:
+            ret_value[key] = cp.get('settings', option)
+        except (NoOptionError, NoSectionError):
+            ret_value[key] = None
+    printers = OrderedDict()
+    groups = OrderedDict()
+    for section in cp.sections():
+        kind, _, name = section.partition(' ')
+        name = name.strip()
+        if kind == 'printer' and name:
+            printers[name] = dict((key, cp.get(section, option) if cp.has_option(section, option)
+                                   else None)
+                                  for key, option in (('url', 'baseurl'), ('apikey', 'apikey')))
+        elif kind == 'group' and name:
+            members = cp.get(section, 'printers') if cp.has_option(section, 'printers') else ''
+            groups[name] = [member.strip() for member in members.split(',') if member.strip()]
+    ret_value['printers'] = printers
+    ret_value['groups'] = groups
     return ret_value
 
 
+def resolve_printers(configfile, target):
+    """
+    Returns an OrderedDict name -> (url, apikey) of the printers selected by
+    target: a printer name, a group name, 'all' or a comma separated list of those.
+    Raises ValueError for unknown names.
+    """
+    printers, groups = configfile.get('printers') or {}, configfile.get('groups') or {}
+    selected = OrderedDict()
+    pending = [name.strip() for name in target.split(',') if name.strip()]
+    seen = set()
+    while pending:
+        name = pending.pop(0)
+        if name in seen:
+            continue
+        seen.add(name)
+        if name == 'all' and 'all' not in printers and 'all' not in groups:
+            pending = list(printers) + pending
+        elif name in printers:
+            selected[name] = (printers[name]['url'], printers[name]['apikey'])
+        elif name in groups:
+            pending = list(groups[name]) + pending
+        else:
+            raise ValueError('Unknown printer or group {0}'.format(name))
+    if not selected:
+        raise ValueError('No printers selected by {0}'.format(target))
+    return selected
+
+
+def connection_row(printer, arguments):
+    if arguments.connect:
+        printer.connect(port=arguments.port, baudrate=arguments.baudrate, profile=arguments.profile,
+                        save=arguments.save, autoconnect=arguments.autoconnect)
+        return {'result': 'ok'}
+    elif arguments.disconnect:
+        printer.disconnect()
+        return {'result': 'ok'}
+    current = printer.get_connection_status().get('current') or {}
+    return {'state': current.get('state'), 'port': current.get('port'),
+            'baudrate': current.get('baudrate')}
+
+
 def connection_func(arguments):
     printer = init_printer(arguments)
     if arguments.connect:
@@ -113,30 +508,372 @@ def job_control_func(arguments):
     return return_val
 
 
+def job_row(printer, arguments):
+    printer.job(command=arguments.command)
+    return {'result': 'ok'}
+
+
+def file_cache_path(url):
+    """
+    File the listing of the printer at url is cached in between invocations.
+    """
+    directory = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                             os.path.join(os.path.expanduser('~'), '.cache'), 'printer-py')
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            return None
+    name = ''.join(c if c.isalnum() else '_' for c in (url or '').split('://')[-1])
+    return os.path.join(directory, 'files-{0}.json'.format(name))
+
+
+def init_file_index(printer, arguments):
+    return printer.file_index(cache_file=file_cache_path(printer.url))
+
+
 def file_select_func(arguments):
     printer = init_printer(arguments)
-    printer.select_file(name=arguments.filename,
-                        location=arguments.location,
-                        start_print=arguments.start_print)
+    entry = file_select_row(printer, arguments)
+    if entry['selected'] != arguments.filename:
+        print('Selected {0}'.format(entry['selected']))
+
+
+def file_select_row(printer, arguments):
+    index = init_file_index(printer, arguments)
+    entry = index.select(arguments.filename, origin=arguments.location,
+                         start_print=arguments.start_print)
+    return {'selected': entry.get('path') or entry['name']}
 
 
 def file_list_func(arguments):
     printer = init_printer(arguments)
-    files = printer.get_files()
+    index = init_file_index(printer, arguments)
+    since = time.time() - arguments.days * 86400 if arguments.days is not None else None
+    files = index.find(prefix=arguments.prefix, origin=arguments.location,
+                       min_size=arguments.min_size, max_size=arguments.max_size, since=since)
+    if arguments.newest:
+        files = sorted(files, key=lambda entry: entry.get('date') or 0, reverse=True)
     if arguments.long:
-        print(files)
+        for fileitem in files:
+            print(fileitem)
     else:
-        for fileitem in files['files']:
-            print('{0}\t{1}\t{2}'.format(fileitem['name'], fileitem['size'], fileitem['origin']))
+        for fileitem in files:
+            print('{0}\t{1}\t{2}'.format(fileitem.get('path') or fileitem['name'],
+                                         fileitem['size'], fileitem['origin']))
 
 
-def parser_func():
-    configfile = config_file_func()
-    parser = argparse.ArgumentParser()
+class _DaemonState(object):
+    """
+    Parsers of the daemon, cached per configuration file and rebuilt
+    when the file changes.
+    """
+
+    def __init__(self):
+        self._parsers = {}
+
+    def parser(self, cwd):
+        filename = os.path.join(cwd, 'printer.cfg')
+        try:
+            mtime = os.path.getmtime(filename)
+        except OSError:
+            mtime = None
+        cached = self._parsers.get(filename)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, build_parser(config_file_func(filename)))
+            self._parsers[filename] = cached
+        return cached[1]
+
+    def run(self, argv, cwd):
+        """
+        Run a command line, returns (status, stdout, stderr).
+        sys.stdout and sys.stderr have to be _ThreadOutput objects.
+        """
+        stdout, stderr = io.StringIO(), io.StringIO()
+        sys.stdout.redirect(stdout)
+        sys.stderr.redirect(stderr)
+        status = 0
+        try:
+            args = self.parser(cwd).parse_args(argv)
+            run_command(args)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.redirect(None)
+            sys.stderr.redirect(None)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+
+class _ThreadOutput(object):
+    """
+    Replacement of sys.stdout or sys.stderr in the daemon. Commands run
+    in parallel threads, each writes to the buffer it redirected to.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def redirect(self, buffer):
+        self._local.buffer = buffer
+
+    def _target(self):
+        buffer = getattr(self._local, 'buffer', None)
+        return self.stream if buffer is None else buffer
+
+    def write(self, data):
+        return self._target().write(data)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Serves each client connection in a thread of its own, so a slow
+    command or a stuck client does not hold up the others.
+    """
+    daemon_threads = True
+    request_queue_size = 16
+
+    def __init__(self, socket_path, idle_timeout=None):
+        old_umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path, _DaemonRequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.state = _DaemonState()
+        self.idle_timeout = idle_timeout
+        self.active = 0
+        self.last_active = time.time()
+        self._active_lock = threading.Lock()
+        self._stopping = False
+
+    def begin(self):
+        with self._active_lock:
+            self.active += 1
+
+    def end(self):
+        with self._active_lock:
+            self.active -= 1
+            self.last_active = time.time()
+
+    def stop(self):
+        """
+        End serve_forever, callable from any thread but the serving one.
+        """
+        with self._active_lock:
+            if self._stopping:
+                return
+            self._stopping = True
+        threading.Thread(target=self.shutdown).start()
+
+    def service_actions(self):
+        if self.idle_timeout is not None and not self.active and \
+                time.time() - self.last_active >= self.idle_timeout:
+            self.stop()
+
+
+class _DaemonRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.begin()
+        try:
+            if not _daemon_handle(self.request, self.server.state):
+                self.server.stop()
+        finally:
+            self.server.end()
+
+
+def _daemon_serve(socket_path, idle_timeout=None):
+    global _warm_printers
+    if os.path.exists(socket_path):
+        try:
+            _daemon_call({'command': 'ping'}, socket_path, timeout=1)
+            print('Daemon already running on {0}'.format(socket_path))
+            return
+        except (IOError, OSError, ValueError):
+            # stale socket of a daemon that died
+            os.remove(socket_path)
+    server = _DaemonServer(socket_path, idle_timeout)
+    _warm_printers = {}
+    print('Daemon listening on {0}'.format(socket_path))
+    sys.stdout.flush()
+    saved = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _ThreadOutput(sys.stdout), _ThreadOutput(sys.stderr)
+    try:
+        server.serve_forever(poll_interval=0.2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout, sys.stderr = saved
+        server.server_close()
+        os.remove(socket_path)
+        for printer in _warm_printers.values():
+            printer.close()
+        _warm_printers = None
+
+
+def _daemon_handle(connection, state):
+    """
+    Serve one client connection, returns False when asked to stop.
+    """
+    try:
+        connection.settimeout(10)
+        data = []
+        while True:
+            chunk = connection.recv(65536)
+            if not chunk:
+                break
+            data.append(chunk)
+        request = json.loads(b''.join(data).decode('utf-8'))
+        command = request.get('command')
+        if command in ('ping', 'stop'):
+            reply = {'status': 0, 'stdout': '', 'stderr': ''}
+        else:
+            status, out, err = state.run(request['argv'], request.get('cwd', '.'))
+            reply = {'status': status, 'stdout': out, 'stderr': err}
+        connection.sendall(json.dumps(reply).encode('utf-8'))
+        return command != 'stop'
+    except (IOError, OSError, ValueError, KeyError):
+        return True
+    finally:
+        connection.close()
+
+
+def daemon_func(arguments):
+    socket_path = arguments.socket or daemon_socket_path()
+    if arguments.stop:
+        try:
+            _daemon_call({'command': 'stop'}, socket_path, timeout=5)
+            print('Daemon stopped')
+        except (IOError, OSError, ValueError):
+            print('No daemon running on {0}'.format(socket_path))
+        return
+    _daemon_serve(socket_path, arguments.idle_timeout)
+
+
+def _format_cell(value):
+    if value is None:
+        return '-'
+    if isinstance(value, dict) and 'actual' in value:
+        return '{0:.1f}/{1:.1f}'.format(value['actual'] or 0.0, value['target'] or 0.0)
+    return str(value)
+
+
+def print_table(rows):
+    """
+    Print (name, row dictionary) pairs as a table, one column per key.
+    """
+    columns = []
+    for _, row in rows:
+        columns.extend(key for key in row if key not in columns)
+    lines = [['printer'] + columns]
+    lines.extend([name] + [_format_cell(row.get(key)) for key in columns] for name, row in rows)
+    widths = [max(len(line[n]) for line in lines) for n in range(len(lines[0]))]
+    for line in lines:
+        print('  '.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip())
+
+
+def fleet_func(arguments, printers):
+    """
+    Run the row function of a command on several printers in parallel and
+    print the aggregated results. Exits with status 1 if any printer failed.
+    :param printers: OrderedDict name -> (url, apikey)
+    """
+    fleet = PrinterFleet(dict((name, _api(url, apikey)) for name, (url, apikey) in printers.items()),
+                         max_workers=arguments.parallel)
+    failed = False
+    try:
+        call = fleet.submit(arguments.row_func, arguments)
+        rows = {}
+        for result in call.as_completed(timeout=arguments.timeout):
+            if result.ok:
+                row = result.value
+            else:
+                failed = True
+                row = {'error': str(result.exception) or type(result.exception).__name__}
+            if arguments.output == 'ndjson':
+                record = OrderedDict([('printer', result.name)])
+                record.update(row)
+                sys.stdout.write(json.dumps(record) + '\n')
+                sys.stdout.flush()
+            rows[result.name] = row
+        if arguments.output != 'ndjson':
+            print_table([(name, rows[name]) for name in printers if name in rows])
+    finally:
+        # the daemon keeps its connections for the next command
+        fleet.close(close_printers=_warm_printers is None)
+    if failed:
+        sys.exit(1)
+
+
+def run_command(args):
+    try:
+        target = getattr(args, 'printer', None)
+        configured = False
+        if target is None and args.url is None:
+            # [settings] without a printer of its own
+            target = args.config.get('printer')
+            configured = target is not None
+        if target is not None:
+            try:
+                printers = resolve_printers(args.config, target)
+            except ValueError as e:
+                print('Error: {0}'.format(e))
+                sys.exit(2)
+            if configured and len(printers) > 1 and getattr(args, 'row_func', None) is None:
+                # a configured group is only the default of the fleet commands
+                if args.func is not daemon_func:
+                    print('Error: no printer URL configured and the default {0} selects {1} '
+                          'printers, use --printer NAME or --url'.format(target, len(printers)))
+                    sys.exit(2)
+                args.func(args)
+                return
+            if len(printers) == 1 and args.output == 'table':
+                # a single printer keeps the usual output
+                args.url, args.apikey = list(printers.values())[0]
+            elif getattr(args, 'row_func', None) is None:
+                print('Error: this command runs on one printer only, {0} selects {1}'.format(
+                    target, len(printers)))
+                sys.exit(2)
+            else:
+                fleet_func(args, printers)
+                return
+        args.func(args)
+    except (octoprint_api.HTTPException, octoprint_api.OctoprintException) as e:
+        print('Error executing command. Error information: {0}'.format(e))
+
+
+def _add_printer_argument(subparser, row_func):
+    # also accepted after the command; SUPPRESS keeps a global --printer
+    subparser.add_argument('--printer', default=argparse.SUPPRESS,
+                           help='Printer, group, comma separated list or all')
+    subparser.set_defaults(row_func=row_func)
+
+
+def build_parser(configfile):
+    parser = argparse.ArgumentParser(prog='printer.py')
     parser.add_argument('--url', '-u', default=configfile['url'],
                         help='Printer URL')
     parser.add_argument('--apikey', '-a', default=configfile['apikey'],
                         help='API key for printer access')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='Run locally even if a daemon is running')
+    parser.add_argument('--printer',
+                        help='Printer, group, comma separated list or all from printer.cfg')
+    parser.add_argument('--parallel', type=int, default=8,
+                        help='Printers contacted at the same time, defaults to 8')
+    parser.add_argument('--timeout', type=float,
+                        help='Seconds to wait for all printers, defaults to no limit')
+    parser.add_argument('--output', '-O', choices=['table', 'ndjson'], default='table',
+                        help='Output of commands run on several printers, defaults to table')
+    parser.set_defaults(config=configfile, row_func=None)
     subcommand = parser.add_subparsers()
 
     jog_parser = subcommand.add_parser('jog',
@@ -145,10 +882,12 @@ def parser_func():
     jog_parser.add_argument('-y', type=int, help='Distance on y axis')
     jog_parser.add_argument('-z', type=int, help='Distance on z axis')
     jog_parser.set_defaults(func=jog_func)
+    _add_printer_argument(jog_parser, jog_row)
 
     home_parser = subcommand.add_parser('home')
     home_parser.add_argument('axis')
     home_parser.set_defaults(func=home_func)
+    _add_printer_argument(home_parser, home_row)
 
     status_parser = subcommand.add_parser('status',
                                           help='Get the status of the printer')
@@ -159,6 +898,19 @@ def parser_func():
     status_parser.add_argument('--no_history', '-n', action='store_true',
                                help='Disable history output (only relevant for machine-readable output)')
     status_parser.set_defaults(func=status_func)
+    _add_printer_argument(status_parser, status_row)
+
+    watch_parser = subcommand.add_parser('watch',
+                                         help='Continuously show status and job progress')
+    watch_parser.add_argument('--interval', '-i', type=float, default=1.0,
+                              help='Refresh interval in seconds, defaults to 1')
+    watch_parser.add_argument('--ndjson', '-j', action='store_true',
+                              help='Stream one JSON object per refresh instead of a display')
+    watch_parser.add_argument('--push', '-p', action='store_true',
+                              help='Use push updates from the server when available')
+    watch_parser.add_argument('--count', '-c', type=int,
+                              help='Stop after this many refreshes')
+    watch_parser.set_defaults(func=watch_func)
 
     tooltemp_parser = subcommand.add_parser('tool',
                                             help='Set tool temperature')
@@ -167,18 +919,21 @@ def parser_func():
     tooltemp_parser.add_argument('temperature', type=int, default=0,
                                  help='Tool temperature (defaults to 0 (off))')
     tooltemp_parser.set_defaults(func=tool_func)
+    _add_printer_argument(tooltemp_parser, tool_row)
 
     bedtemp_parser = subcommand.add_parser('bed',
                                            help='Set bed temperature')
     bedtemp_parser.add_argument('temperature', type=int, default=0,
                                 help='Temperature, defaults to 0 (bed off)')
     bedtemp_parser.set_defaults(func=bed_func)
+    _add_printer_argument(bedtemp_parser, bed_row)
 
     extrude_parser = subcommand.add_parser('extrude',
                                            help='Extrude from currently active extruder')
     extrude_parser.add_argument('amount', type=int, default=5,
                                 help='Extrude length, negative values to retract (defaults to 5mm)')
     extrude_parser.set_defaults(func=extrude_func)
+    _add_printer_argument(extrude_parser, extrude_row)
 
     connection_parser = subcommand.add_parser('connection',
                                               help='Connection handling')
@@ -198,6 +953,7 @@ def parser_func():
     connection_parser.add_argument('--autoconnect',
                                    help='Auto connect on startup')
     connection_parser.set_defaults(func=connection_func)
+    _add_printer_argument(connection_parser, connection_row)
 
     file_parser = subcommand.add_parser('file',
                                         help='File operations')
@@ -211,14 +967,25 @@ def parser_func():
                              choices=['local', 'sdcard'],
                              help='File location (local or SD card), defaults to local')
     file_select.add_argument('filename',
-                             help='File name')
+                             help='File path, file name or unique path prefix')
     file_select.set_defaults(func=file_select_func)
+    _add_printer_argument(file_select, file_select_row)
     file_list = file_subparser.add_parser('list',
                                           help='List files. Default: file name and location only')
     file_list.add_argument('--long', '-l', action='store_true',
                            help='Long information')
     file_list.add_argument('--location', '-o', choices=['local', 'sdcard'],
                            help='Location to list')
+    file_list.add_argument('--prefix', '-P',
+                           help='Only paths starting with this prefix, e.g. a folder/')
+    file_list.add_argument('--min-size', type=int,
+                           help='Only files of at least this many bytes')
+    file_list.add_argument('--max-size', type=int,
+                           help='Only files of at most this many bytes')
+    file_list.add_argument('--days', type=float,
+                           help='Only files uploaded within the last days')
+    file_list.add_argument('--newest', '-n', action='store_true',
+                           help='Sort newest first instead of by path')
     file_list.set_defaults(func=file_list_func)
 
     job_parser = subcommand.add_parser('job',
@@ -227,12 +994,26 @@ def parser_func():
                             choices=_JOB_COMMAND_LIST,
                             help='Start, cancel, pause/unpause or restart a job')
     job_parser.set_defaults(func=job_control_func)
+    _add_printer_argument(job_parser, job_row)
 
+    daemon_parser = subcommand.add_parser('daemon',
+                                          help='Run a resident daemon keeping connections warm')
+    daemon_parser.add_argument('--stop', action='store_true',
+                               help='Stop the running daemon')
+    daemon_parser.add_argument('--socket', '-s',
+                               help='Unix socket path, defaults to $PRINTER_PY_SOCKET or '
+                                    '$XDG_RUNTIME_DIR/printer-py-<uid>.sock')
+    daemon_parser.add_argument('--idle-timeout', type=float,
+                               help='Exit after this many seconds without commands')
+    daemon_parser.set_defaults(func=daemon_func)
+    return parser
+
+
+def parser_func():
+    configfile = config_file_func()
+    parser = build_parser(configfile)
     args = parser.parse_args()
-    try:
-        args.func(args)
-    except (octoprint_api.HTTPException, octoprint_api.OctoprintException) as e:
-        print('Error executing command. Error information: {0}'.format(e))
+    run_command(args)
 
 if __name__ == '__main__':
     parser_func()
@@ -0,0 +1,34 @@
+"""
+Fixtures running the clients against a local FakeOctoPrint server.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_octoprint import FakeOctoPrint  # noqa: E402
+import octoprint_api  # noqa: E402
+
+
+@pytest.fixture
+def fake():
+    server = FakeOctoPrint(api_key='fake').start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def printer(fake):
+    api = octoprint_api.Api(base_url=fake.url, api_key='fake')
+    yield api
+    api.close()
+
+
+def api_requests(fake, method=None, path=None):
+    """
+    Requests the fake server received, optionally filtered by method and path.
+    """
+    return [r for r in fake.requests
+            if (method is None or r[0] == method) and (path is None or r[1] == path)]
@@ -0,0 +1,163 @@
+"""
+Api and AsyncApi against the fake server: reading status and
+temperatures, printhead and file commands, and the mapping of HTTP
+errors to exceptions.
+"""
+import asyncio
+
+import pytest
+
+import octoprint_api
+from octoprint_api import (Api, NotAuthorizedException, PrinterBusyException,
+                           UnsupportedFileException)
+from octoprint_async import AsyncApi
+
+
+def test_status(printer):
+    status = printer.get_status(history=False)
+    assert status['state']['text'] == 'Operational'
+    assert status['state']['flags']['operational']
+    assert 'history' not in status['temperature']
+
+
+def test_status_history_limit(printer):
+    status = printer.get_status(history=True, limit=3)
+    assert len(status['temperature']['history']) == 3
+
+
+def test_temperatures(fake, printer):
+    printer.set_tool_temp(temp=200, tool=0)
+    printer.set_bed_temp(temp=60)
+    assert fake.printer.heaters['tool0']['target'] == 200
+    assert fake.printer.heaters['bed']['target'] == 60
+    assert printer.get_tool_temp(0)['target'] == 200
+    assert printer.get_bed_temp()['target'] == 60
+    assert printer.get_tool_temp(5) is None
+
+
+def test_jog_and_home(fake, printer):
+    printer.jog(x=10, y=-5)
+    printer.jog(x=10)
+    position = fake.printer.position
+    assert (position['x'], position['y'], position['z']) == (20, -5, 0)
+    printer.home(x=True, y=True, z=True)
+    assert (fake.printer.position['x'], fake.printer.position['y']) == (0, 0)
+
+
+def test_select_and_start(fake, printer):
+    fake.printer.add_file('local', 'cube.gcode', size=100)
+    printer.select_file('cube.gcode', start_print=True)
+    assert fake.printer.selected == ('local', 'cube.gcode')
+    job = printer.get_job_info()
+    assert job['state'] == 'Printing'
+    assert job['job']['file']['name'] == 'cube.gcode'
+
+
+def test_upload(fake, printer, tmp_path):
+    path = tmp_path / 'part.gcode'
+    path.write_bytes(b'G28\nG1 X10 Y10 E1\n' * 100)
+    result = printer.upload_file(str(path), select=True)
+    assert result['done']
+    entry = fake.printer.files[('local', 'part.gcode')]
+    assert entry['size'] == path.stat().st_size
+    assert fake.printer.selected == ('local', 'part.gcode')
+
+
+def test_upload_into_folder(fake, printer, tmp_path):
+    path = tmp_path / 'part.gcode'
+    path.write_bytes(b'G28\n')
+    printer.upload_file(str(path), folder='parts', remote_name='a.gcode')
+    assert ('local', 'parts/a.gcode') in fake.printer.files
+
+
+def test_wrong_api_key(fake):
+    with Api(base_url=fake.url, api_key='wrong') as api:
+        with pytest.raises(NotAuthorizedException):
+            api.get_status()
+        with pytest.raises(NotAuthorizedException):
+            api.jog(x=1)
+
+
+def test_busy(fake, printer):
+    # nothing selected
+    with pytest.raises(PrinterBusyException):
+        printer.job_start()
+    fake.printer.add_file('local', 'cube.gcode', size=100)
+    printer.select_file('cube.gcode', start_print=True)
+    with pytest.raises(PrinterBusyException):
+        printer.jog(x=1)
+
+
+def test_upload_of_printed_file_is_busy(fake, printer, tmp_path):
+    path = tmp_path / 'cube.gcode'
+    path.write_bytes(b'G28\n')
+    printer.upload_file(str(path), start_print=True)
+    with pytest.raises(PrinterBusyException):
+        printer.upload_file(str(path))
+
+
+def test_unsupported_file_type(fake, printer, tmp_path, monkeypatch):
+    path = tmp_path / 'notes.txt'
+    path.write_bytes(b'hello')
+    with pytest.raises(UnsupportedFileException):
+        printer.upload_file(str(path))
+    assert not fake.requests or all(r[1] != '/api/files/local' for r in fake.requests)
+    # the server's 415 maps to the same exception
+    monkeypatch.setattr(Api, '_check_upload', staticmethod(lambda *args: None))
+    with pytest.raises(UnsupportedFileException):
+        printer.upload_file(str(path))
+
+
+def test_server_not_found():
+    with Api(base_url='http://127.0.0.1:1', api_key='fake') as api:
+        with pytest.raises(octoprint_api.ServerNotFoundException):
+            api.get_version()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_async_status_and_temperatures(fake):
+    async def scenario():
+        async with AsyncApi(base_url=fake.url, api_key='fake') as api:
+            status, version = await asyncio.gather(api.get_status(history=False),
+                                                   api.get_version())
+            await api.set_tool_temp(temp=210)
+            await api.set_bed_temp(temp=55)
+            return status, version, await api.get_tool_temp(), await api.get_bed_temp()
+
+    status, version, tool, bed = run(scenario())
+    assert status['state']['text'] == 'Operational'
+    assert 'api' in version
+    assert tool['target'] == 210
+    assert bed['target'] == 55
+
+
+def test_async_jog_and_select(fake):
+    fake.printer.add_file('local', 'cube.gcode', size=100)
+
+    async def scenario():
+        async with AsyncApi(base_url=fake.url, api_key='fake') as api:
+            await api.jog(z=2)
+            await api.select_file('cube.gcode')
+            return await api.get_job_info()
+
+    job = run(scenario())
+    assert fake.printer.position['z'] == 2
+    assert job['job']['file']['name'] == 'cube.gcode'
+
+
+def test_async_errors(fake):
+    async def wrong_key():
+        async with AsyncApi(base_url=fake.url, api_key='wrong') as api:
+            await api.get_status()
+
+    async def busy():
+        async with AsyncApi(base_url=fake.url, api_key='fake') as api:
+            await api.job_start()
+
+    with pytest.raises(NotAuthorizedException):
+        run(wrong_key())
+    with pytest.raises(PrinterBusyException):
+        run(busy())
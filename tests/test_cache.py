@@ -0,0 +1,25 @@
+"""
+ResponseCache hits and invalidation by writes.
+"""
+from octoprint_api import Api
+
+from conftest import api_requests
+
+
+def test_cache_hit_and_invalidation_by_post(fake):
+    with Api(base_url=fake.url, api_key='fake', cache=True) as api:
+        assert api.get_connection()['current']['state'] == 'Operational'
+        api.get_connection()
+        assert len(api_requests(fake, 'GET', '/api/connection')) == 1
+        assert api._cache.hits == 1
+
+        api.disconnect()
+        assert api.get_connection()['current']['state'] == 'Closed'
+        assert len(api_requests(fake, 'GET', '/api/connection')) == 2
+
+
+def test_cache_skips_uncached_endpoints(fake):
+    with Api(base_url=fake.url, api_key='fake', cache=True) as api:
+        api.get_job_info()
+        api.get_job_info()
+    assert len(api_requests(fake, 'GET', '/api/job')) == 2
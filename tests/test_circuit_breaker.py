@@ -0,0 +1,67 @@
+"""
+CircuitBreaker transitions against a closed and a restarted fake server.
+"""
+import time
+
+import pytest
+
+from fake_octoprint import FakeOctoPrint
+from octoprint_api import Api, CircuitBreaker, HTTPException, ServerNotFoundException
+
+
+def _free_port():
+    server = FakeOctoPrint().start()
+    port = int(server.url.rsplit(':', 1)[1])
+    server.stop()
+    return port
+
+
+def test_breaker_opens_after_threshold_and_closes_after_probe():
+    port = _free_port()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.3, probe_timeout=1.0)
+    with Api(base_url='http://127.0.0.1:{0}'.format(port), api_key='fake',
+             circuit_breaker=breaker) as api:
+        for _ in range(2):
+            assert breaker.state == CircuitBreaker.CLOSED
+            with pytest.raises(ServerNotFoundException):
+                api.get_version()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.failures == 2
+
+        # open: fails without trying the server
+        start = time.time()
+        with pytest.raises(ServerNotFoundException, match='circuit open'):
+            api.get_version()
+        assert time.time() - start < 0.1
+        assert breaker.failures == 2
+
+        # half-open probe fails: open again
+        time.sleep(0.35)
+        with pytest.raises(ServerNotFoundException):
+            api.get_version()
+        assert breaker.state == CircuitBreaker.OPEN
+
+        # half-open probe succeeds: closed
+        fake = FakeOctoPrint(port=port).start()
+        try:
+            time.sleep(0.35)
+            assert 'api' in api.get_version()
+            assert breaker.state == CircuitBreaker.CLOSED
+            assert breaker.failures == 0
+            assert [r[1] for r in fake.requests] == ['/api/version', '/api/version']
+            assert api.health['state'] == CircuitBreaker.CLOSED
+        finally:
+            fake.stop()
+
+
+def test_breaker_ignores_http_errors():
+    fake = FakeOctoPrint(error_rate=1.0).start()
+    breaker = CircuitBreaker(failure_threshold=1)
+    try:
+        with Api(base_url=fake.url, api_key='fake', circuit_breaker=breaker) as api:
+            for _ in range(3):
+                with pytest.raises(HTTPException):
+                    api.get_status()
+            assert breaker.state == CircuitBreaker.CLOSED
+    finally:
+        fake.stop()
@@ -0,0 +1,79 @@
+"""
+printer.py command line with printers and groups from printer.cfg.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+from fake_octoprint import FakeOctoPrint
+
+PRINTER_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'printer.py')
+
+
+@pytest.fixture
+def farm(tmp_path):
+    fakes = [FakeOctoPrint(api_key='fake').start() for _ in range(2)]
+    with open(str(tmp_path / 'printer.cfg'), 'w') as f:
+        f.write('[settings]\nprinter = farm\n\n')
+        for name, fake in zip(('left', 'right'), fakes):
+            f.write('[printer {0}]\nbaseurl = {1}\napikey = fake\n\n'.format(name, fake.url))
+        f.write('[group farm]\nprinters = left, right\n')
+    yield tmp_path
+    for fake in fakes:
+        fake.stop()
+
+
+def run(directory, *argv):
+    env = dict(os.environ, PRINTER_PY_SOCKET=str(directory / 'printer.sock'))
+    return subprocess.run([sys.executable, PRINTER_PY] + list(argv), cwd=str(directory), env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          universal_newlines=True, timeout=60)
+
+
+def test_group_default_runs_fleet_commands(farm):
+    result = run(farm, '--no-daemon', 'status')
+    assert result.returncode == 0, result.stdout
+    lines = result.stdout.splitlines()
+    assert lines[0].split()[0] == 'printer'
+    assert [line.split()[0] for line in lines[1:]] == ['left', 'right']
+
+
+def test_group_default_does_not_apply_to_single_printer_commands(farm):
+    result = run(farm, '--no-daemon', 'daemon', '--stop')
+    assert result.returncode == 0, result.stdout
+    assert 'No daemon running' in result.stdout
+    assert 'one printer only' not in result.stdout
+
+
+def test_group_default_with_watch_asks_for_a_printer(farm):
+    result = run(farm, '--no-daemon', 'watch', '--count', '1')
+    assert result.returncode == 2
+    assert 'use --printer NAME or --url' in result.stdout
+    assert 'Traceback' not in result.stdout
+
+
+def test_daemon_with_group_default(farm):
+    env = dict(os.environ, PRINTER_PY_SOCKET=str(farm / 'printer.sock'))
+    daemon = subprocess.Popen([sys.executable, PRINTER_PY, 'daemon', '--idle-timeout', '30'],
+                              cwd=str(farm), env=env, stdout=subprocess.PIPE,
+                              universal_newlines=True)
+    try:
+        assert daemon.stdout.readline().startswith('Daemon listening')
+        result = run(farm, 'status')
+        assert result.returncode == 0, result.stdout
+        assert [line.split()[0] for line in result.stdout.splitlines()[1:]] == ['left', 'right']
+        assert run(farm, 'daemon', '--stop').stdout.strip() == 'Daemon stopped'
+        assert daemon.wait(10) == 0
+    finally:
+        if daemon.poll() is None:
+            daemon.kill()
+        daemon.stdout.close()
+
+
+def test_explicit_group_for_single_printer_command_is_an_error(farm):
+    result = run(farm, '--no-daemon', '--printer', 'farm', 'daemon', '--stop')
+    assert result.returncode == 2
+    assert 'one printer only' in result.stdout
@@ -0,0 +1,38 @@
+"""
+Concurrent status reads sharing one /api/printer request.
+"""
+import threading
+
+from fake_octoprint import FakeOctoPrint
+from octoprint_api import Api
+
+from conftest import api_requests
+
+
+def test_concurrent_status_requests_are_coalesced():
+    fake = FakeOctoPrint(latency=0.2).start()
+    try:
+        with Api(base_url=fake.url, api_key='fake', pool_size=10) as api:
+            results = []
+            barrier = threading.Barrier(10)
+
+            def read():
+                barrier.wait()
+                results.append(api.get_status(history=False))
+
+            threads = [threading.Thread(target=read) for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert len(results) == 10
+        assert all(result is results[0] for result in results)
+        assert len(api_requests(fake, 'GET', '/api/printer')) == 1
+    finally:
+        fake.stop()
+
+
+def test_without_coalescing_sequential_requests_are_sent(fake, printer):
+    printer.get_status()
+    printer.get_status()
+    assert len(api_requests(fake, 'GET', '/api/printer')) == 2
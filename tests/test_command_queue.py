@@ -0,0 +1,116 @@
+"""
+CommandQueue: jog merging, cancellation and join against the fake server.
+"""
+import json
+import time
+
+import pytest
+
+from fake_octoprint import FakeOctoPrint
+from octoprint_api import Api, PrinterBusyException
+
+from conftest import api_requests
+
+
+@pytest.fixture
+def slow_fake():
+    # every request takes long enough for commands to pile up behind it
+    server = FakeOctoPrint(api_key='fake', latency=0.2).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def slow_printer(slow_fake):
+    api = Api(base_url=slow_fake.url, api_key='fake')
+    yield api
+    api.close()
+
+
+@pytest.fixture
+def queue(slow_printer):
+    return slow_printer.command_queue()
+
+
+def in_flight(queue, future):
+    """
+    Wait until the worker took the command of future off the queue.
+    """
+    deadline = time.time() + 5
+    while len(queue) or not future.running():
+        assert time.time() < deadline
+        time.sleep(0.005)
+
+
+def posted(fake, path):
+    return [json.loads(r[3]) for r in api_requests(fake, 'POST', path)]
+
+
+def test_jogs_on_same_axes_are_merged(slow_fake, queue):
+    first = queue.jog(x=1)
+    in_flight(queue, first)
+    rest = [queue.jog(x=1) for _ in range(9)]
+    assert queue.join(timeout=5)
+    assert posted(slow_fake, '/api/printer/printhead') == [
+        {'command': 'jog', 'x': 1}, {'command': 'jog', 'x': 9}]
+    assert slow_fake.printer.position['x'] == 10
+    assert all(future.done() and future.exception() is None for future in [first] + rest)
+    assert queue.sent == 2
+    assert queue.merged == 8
+
+
+def test_jogs_on_other_axes_are_not_merged(slow_fake, queue):
+    first = queue.jog(x=1)
+    in_flight(queue, first)
+    queue.jog(x=1)
+    queue.jog(y=2)
+    queue.jog(y=2)
+    queue.jog(x=1)
+    assert queue.join(timeout=5)
+    assert posted(slow_fake, '/api/printer/printhead') == [
+        {'command': 'jog', 'x': 1}, {'command': 'jog', 'x': 1},
+        {'command': 'jog', 'y': 4}, {'command': 'jog', 'x': 1}]
+
+
+def test_cancelled_future_is_not_sent(slow_fake, queue):
+    first = queue.jog(x=1)
+    in_flight(queue, first)
+    temperature = queue.set_tool_temp(temp=200)
+    home = queue.home(x=True, y=True)
+    assert home.cancel()
+    assert queue.join(timeout=5)
+    assert temperature.done() and not temperature.cancelled()
+    assert home.cancelled()
+    assert posted(slow_fake, '/api/printer/printhead') == [{'command': 'jog', 'x': 1}]
+    assert len(posted(slow_fake, '/api/printer/tool')) == 1
+
+
+def test_cancel_pending_moves_only(slow_fake, queue):
+    first = queue.jog(x=1)
+    in_flight(queue, first)
+    jog = queue.jog(y=1)
+    bed = queue.set_bed_temp(temp=60)
+    extrude = queue.extrude(amount=5)
+    assert queue.cancel_pending(moves_only=True) == 2
+    assert queue.join(timeout=5)
+    assert jog.cancelled() and extrude.cancelled()
+    assert not bed.cancelled()
+    assert posted(slow_fake, '/api/printer/printhead') == [{'command': 'jog', 'x': 1}]
+    assert posted(slow_fake, '/api/printer/bed') == [{'command': 'target', 'target': 60}]
+    assert posted(slow_fake, '/api/printer/tool') == []
+
+
+def test_join_times_out_while_commands_are_pending(queue):
+    queue.jog(z=1)
+    queue.set_bed_temp(temp=50)
+    assert not queue.join(timeout=0.05)
+    assert queue.join(timeout=5)
+    assert len(queue) == 0
+
+
+def test_errors_end_up_in_the_future(slow_fake, slow_printer, queue):
+    slow_fake.printer.add_file('local', 'cube.gcode', size=100)
+    slow_printer.select_file('cube.gcode', start_print=True)
+    future = queue.jog(x=1)
+    with pytest.raises(PrinterBusyException):
+        future.result(timeout=5)
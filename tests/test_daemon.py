@@ -0,0 +1,98 @@
+"""
+printer.py daemon: forwarding, parallel clients and the idle timeout.
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from fake_octoprint import FakeOctoPrint
+
+PRINTER_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'printer.py')
+
+
+def start_daemon(directory, *options):
+    env = dict(os.environ, PRINTER_PY_SOCKET=str(directory / 'printer.sock'))
+    daemon = subprocess.Popen([sys.executable, PRINTER_PY, 'daemon'] + list(options),
+                              cwd=str(directory), env=env, stdout=subprocess.PIPE,
+                              universal_newlines=True)
+    assert daemon.stdout.readline().startswith('Daemon listening')
+    return daemon
+
+
+def run(directory, *argv):
+    env = dict(os.environ, PRINTER_PY_SOCKET=str(directory / 'printer.sock'))
+    return subprocess.run([sys.executable, PRINTER_PY] + list(argv), cwd=str(directory), env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, timeout=60)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    process = start_daemon(tmp_path, '--idle-timeout', '60')
+    yield process
+    run(tmp_path, 'daemon', '--stop')
+    try:
+        process.wait(10)
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+
+
+def test_stuck_client_does_not_block_others(tmp_path, daemon):
+    fake = FakeOctoPrint(api_key='fake').start()
+    stuck = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # connected, but never finishes sending its request
+        stuck.connect(str(tmp_path / 'printer.sock'))
+        stuck.sendall(b'{"argv": ')
+        start = time.time()
+        result = run(tmp_path, '-u', fake.url, '-a', 'fake', 'status', '-n')
+        assert result.returncode == 0, result.stderr
+        assert 'Operational' in result.stdout
+        assert time.time() - start < 5
+    finally:
+        stuck.close()
+        fake.stop()
+
+
+def test_parallel_commands_keep_their_output(tmp_path, daemon):
+    fakes = [FakeOctoPrint(api_key='fake', latency=0.3).start() for _ in range(4)]
+    for n, fake in enumerate(fakes):
+        fake.printer.heaters['bed']['target'] = 10.0 * (n + 1)
+    results = [None] * len(fakes)
+
+    def call(n):
+        results[n] = run(tmp_path, '-u', fakes[n].url, '-a', 'fake', 'status', '-n')
+
+    try:
+        threads = [threading.Thread(target=call, args=(n,)) for n in range(len(fakes))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for fake in fakes:
+            fake.stop()
+    for n, result in enumerate(results):
+        assert result.returncode == 0, result.stderr
+        setpoints = [line.split('setpoint:')[1].strip() for line in result.stdout.splitlines()
+                     if line.startswith('bed')]
+        assert setpoints == ['{0:.1f} C'.format(10.0 * (n + 1))]
+
+
+def test_idle_timeout_ends_daemon(tmp_path):
+    process = start_daemon(tmp_path, '--idle-timeout', '0.5')
+    try:
+        assert process.wait(10) == 0
+        assert not os.path.exists(str(tmp_path / 'printer.sock'))
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
@@ -0,0 +1,90 @@
+"""
+send_gcode and GcodeBatcher splitting commands into /api/printer/command
+requests.
+"""
+import io
+import json
+import time
+
+import pytest
+
+from octoprint_api import PrinterBusyException
+
+from conftest import api_requests
+
+
+def batches(fake):
+    return [json.loads(r[3])['commands'] for r in api_requests(fake, 'POST', '/api/printer/command')]
+
+
+def test_send_gcode_splits_by_batch_size(fake, printer):
+    commands = ['G1 X{0}'.format(n) for n in range(12)]
+    assert printer.send_gcode(commands, batch_size=5) == 12
+    assert batches(fake) == [commands[:5], commands[5:10], commands[10:]]
+    assert fake.printer.commands == commands
+
+
+def test_send_gcode_drops_comments_and_blank_lines(fake, printer):
+    assert printer.send_gcode('G28 ; home\n\n; only a comment\nG1 Z5\n  M105  ') == 3
+    assert batches(fake) == [['G28', 'G1 Z5', 'M105']]
+
+
+def test_send_gcode_from_file(fake, printer):
+    source = io.StringIO(''.join('G1 Y{0} ; move\n'.format(n) for n in range(7)))
+    assert printer.send_gcode(source, batch_size=3) == 7
+    assert [len(batch) for batch in batches(fake)] == [3, 3, 1]
+    assert batches(fake)[2] == ['G1 Y6']
+
+
+def test_send_gcode_consumes_iterators_lazily(fake, printer):
+    consumed = []
+
+    def commands():
+        for n in range(6):
+            consumed.append(n)
+            yield 'G4 P{0}'.format(n)
+
+    # items taken from the generator at the time of each request
+    taken = []
+    printer.add_hook(pre=lambda method, url, kwargs: taken.append(len(consumed)))
+    printer.send_gcode(commands(), batch_size=2)
+    assert taken == [2, 4, 6]
+
+
+def test_batcher_sends_by_count(fake, printer):
+    with printer.gcode_batcher(batch_size=3, flush_interval=None) as gcode:
+        gcode.add(['M104 S200', 'M140 S60'])
+        assert batches(fake) == []
+        gcode.add('G28\nG1 Z10\nG1 X5')
+        assert batches(fake) == [['M104 S200', 'M140 S60', 'G28']]
+        assert gcode.sent == 3
+    # leaving the context flushes the rest
+    assert batches(fake)[1:] == [['G1 Z10', 'G1 X5']]
+    assert gcode.sent == 5
+
+
+def test_batcher_flushes_after_interval(fake, printer):
+    gcode = printer.gcode_batcher(batch_size=50, flush_interval=0.2)
+    gcode.add('G28')
+    gcode.add('G1 Z5')
+    assert batches(fake) == []
+    deadline = time.time() + 5
+    while not batches(fake):
+        assert time.time() < deadline
+        time.sleep(0.02)
+    assert batches(fake) == [['G28', 'G1 Z5']]
+    # the next command starts a new interval
+    gcode.add('M105')
+    time.sleep(0.05)
+    assert len(batches(fake)) == 1
+    gcode.flush()
+    assert batches(fake)[1] == ['M105']
+
+
+def test_batcher_raises_timed_flush_errors_on_next_add(fake, printer):
+    fake.printer.connected = False
+    gcode = printer.gcode_batcher(flush_interval=0.05)
+    gcode.add('G28')
+    time.sleep(0.3)
+    with pytest.raises(PrinterBusyException):
+        gcode.add('G1 Z5')
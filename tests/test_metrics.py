@@ -0,0 +1,38 @@
+"""
+MetricsExporter serving the request metrics of an Api in the
+Prometheus text format.
+"""
+import socket
+
+import requests
+
+from octoprint_api import MetricsExporter
+
+
+def test_exporter_serves_metrics_and_releases_port(printer):
+    printer.get_status()
+    printer.get_status()
+    printer.jog(x=1)
+    exporter = MetricsExporter({'p': printer}, host='127.0.0.1', port=0).start()
+    port = exporter.port
+    try:
+        url = 'http://127.0.0.1:{0}'.format(port)
+        response = requests.get(url + '/metrics', timeout=5)
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+        text = response.text
+        assert '# TYPE octoprint_requests_total counter' in text
+        assert '# TYPE octoprint_request_duration_seconds histogram' in text
+        assert 'octoprint_requests_total{printer="p",endpoint="printer",method="GET"} 2' in text
+        assert 'octoprint_requests_total{printer="p",endpoint="printhead",method="POST"} 1' in text
+        assert requests.get(url + '/other', timeout=5).status_code == 404
+    finally:
+        exporter.stop()
+    # closed connections may linger in TIME_WAIT, a listening socket would still block the bind
+    probe = socket.socket()
+    probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        probe.bind(('127.0.0.1', port))
+        probe.listen(1)
+    finally:
+        probe.close()
@@ -0,0 +1,91 @@
+"""
+PushSubscription against the SockJS endpoint of the fake server.
+"""
+import threading
+
+import pytest
+
+from fake_octoprint import FakeOctoPrint
+from octoprint_api import Api
+
+
+class Recorder(object):
+    """
+    Collects the payloads of the topics it is registered for.
+    """
+
+    def __init__(self, subscription, topics):
+        self.payloads = dict((topic, []) for topic in topics)
+        self._changed = threading.Condition()
+        for topic in topics:
+            subscription.on(topic, self._callback(topic))
+
+    def _callback(self, topic):
+        def record(payload):
+            with self._changed:
+                self.payloads[topic].append(payload)
+                self._changed.notify_all()
+        return record
+
+    def wait_for(self, predicate, timeout=5.0):
+        with self._changed:
+            assert self._changed.wait_for(lambda: predicate(self.payloads), timeout), self.payloads
+
+
+@pytest.fixture
+def push_fake():
+    server = FakeOctoPrint(api_key='fake', push_interval=0.05).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def push_printer(push_fake):
+    api = Api(base_url=push_fake.url, api_key='fake')
+    yield api
+    api.close()
+
+
+def test_topics_are_dispatched(push_fake, push_printer):
+    subscription = push_printer.subscribe(start=False, reconnect_delay=0.1)
+    recorder = Recorder(subscription, ('connected', 'history', 'temperature', 'state', 'event',
+                                       'progress'))
+    with subscription:
+        recorder.wait_for(lambda p: p['connected'] and p['state'] and p['temperature'])
+        assert subscription.connected
+        assert recorder.payloads['state'][0]['text'] == 'Operational'
+        assert 'tool0' in recorder.payloads['temperature'][-1]
+
+        push_printer.set_tool_temp(temp=200)
+        recorder.wait_for(lambda p: p['temperature'][-1]['tool0']['target'] == 200)
+
+        push_printer.select_file('benchy.gcode', start_print=True)
+        recorder.wait_for(lambda p: [e['type'] for e in p['event']] == ['FileSelected',
+                                                                         'PrintStarted'])
+        assert recorder.payloads['event'][0]['payload']['name'] == 'benchy.gcode'
+        recorder.wait_for(lambda p: p['state'][-1]['text'] == 'Printing' and p['progress'])
+        # state is only dispatched when it changes
+        assert [s['text'] for s in recorder.payloads['state']] == ['Operational', 'Printing']
+    assert not subscription.connected
+
+
+def test_messages_iterator(push_printer):
+    with push_printer.subscribe() as subscription:
+        topics = set()
+        for topic, _ in subscription.messages(timeout=5):
+            topics.add(topic)
+            if {'connected', 'history', 'current', 'temperature'} <= topics:
+                break
+    assert {'connected', 'history', 'current', 'temperature'} <= topics
+
+
+def test_reconnects_after_server_drops_stream(push_fake, push_printer):
+    subscription = push_printer.subscribe(start=False, reconnect_delay=0.1)
+    recorder = Recorder(subscription, ('connected', 'disconnected', 'temperature'))
+    with subscription:
+        recorder.wait_for(lambda p: p['connected'] and p['temperature'])
+        push_fake._httpd.close_connections()
+        recorder.wait_for(lambda p: len(p['disconnected']) == 1 and len(p['connected']) == 2)
+        assert subscription.connected
+        received = len(recorder.payloads['temperature'])
+        recorder.wait_for(lambda p: len(p['temperature']) > received)
@@ -0,0 +1,45 @@
+"""
+PollingScheduler request budget accounting.
+"""
+from octoprint_scheduler import IDLE, PRINTING, PollingScheduler
+
+
+class StubApi(object):
+    """
+    Answers job and status requests from a fixed job state, counting them.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.requests = 0
+
+    def get_job_info(self):
+        self.requests += 1
+        return {'state': self.state, 'progress': {'completion': 50.0, 'printTimeLeft': 3600}}
+
+    def get_status(self, history=False):
+        self.requests += 1
+        return {'temperature': {}}
+
+
+def test_poll_counts_requests():
+    scheduler = PollingScheduler({'p': StubApi('Printing')})
+    assert scheduler.poll('p').requests == 2
+    assert scheduler['p'].state == PRINTING
+    assert scheduler.poll('p').requests == 1
+
+
+def test_ended_print_is_charged_for_the_status_request():
+    api = StubApi('Printing')
+    scheduler = PollingScheduler({'p': api}, budget=2.0)
+    scheduler.poll('p')
+    api.state = 'Operational'
+    tracker = scheduler['p']
+    charge = scheduler._requests_per_poll(tracker.state)
+    assert charge == 1
+    scheduler._tokens = 2.0
+    scheduler._run_poll(tracker, charge)
+    assert tracker.state == IDLE
+    assert tracker.requests == 2
+    # the request not charged up front is taken from the bucket afterwards
+    assert scheduler._tokens == 1.0